@@ -3,14 +3,34 @@ ASGI config for crowdfunding project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+/projects/<pk>/events/ is answered here, as a Server-Sent Events stream
+(see projects.events); everything else goes to Django. The Procfile
+serves it with gunicorn's uvicorn worker, the WSGI application cannot
+reach the event stream.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
 """
 
 import os
+import re
 
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'crowdfunding.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from crowdfunding.checks import warn_at_startup  # noqa: E402, needs the apps loaded
+from projects.events import stream  # noqa: E402
+
+warn_at_startup()
+
+EVENTS_PATH = re.compile(r'^/projects/(\d+)/events/$')
+
+
+async def application(scope, receive, send):
+    match = EVENTS_PATH.match(scope['path']) if scope['type'] == 'http' else None
+    if match:
+        return await stream(scope, receive, send, int(match.group(1)))
+    return await django_application(scope, receive, send)
@@ -0,0 +1,86 @@
+"""
+Several read-only API calls in one HTTP request.
+
+    POST /batch/
+    {"requests": ["/projects/?ids=1,2,3", "/7/pledges/", "/7/recommended/"]}
+
+    {"responses": [{"url": "/projects/?ids=1,2,3", "status": 200, "body": [...]}, ...]}
+
+Each URL is resolved and its API view called in process, in order, as a
+GET. The batch request is authenticated once and every sub-request runs
+as that user, so sub-requests skip authentication and share the
+request's database connection. Conditional headers are not passed on.
+A sub-request that fails gets its own status; the batch itself answers
+200 once its body is valid.
+"""
+import logging
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.http import Http404, HttpRequest, QueryDict
+from django.urls import Resolver404, resolve
+from rest_framework import status
+from rest_framework.exceptions import ParseError
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+logger = logging.getLogger(__name__)
+
+# headers a sub-request must not inherit
+_DROP_HEADERS = (
+    'HTTP_AUTHORIZATION', 'HTTP_IF_NONE_MATCH', 'HTTP_IF_MODIFIED_SINCE',
+    'CONTENT_LENGTH', 'CONTENT_TYPE',
+)
+
+
+def _error(url, code, detail):
+    return {'url': url, 'status': code, 'body': {'detail': detail}}
+
+
+class Batch(APIView):
+
+    def post(self, request):
+        urls = request.data.get('requests') if isinstance(request.data, dict) else None
+        if not isinstance(urls, list) or not all(isinstance(url, str) for url in urls):
+            raise ParseError('Expected {"requests": ["/url/", ...]}')
+        if len(urls) > settings.BATCH_MAX_REQUESTS:
+            raise ParseError('At most %d requests per batch' % settings.BATCH_MAX_REQUESTS)
+        return Response({'responses': [self.call(request, url) for url in urls]})
+
+    def call(self, request, url):
+        parts = urlsplit(url)
+        if parts.scheme or parts.netloc:
+            return _error(url, status.HTTP_400_BAD_REQUEST, 'Only paths on this API can be batched.')
+        try:
+            match = resolve(parts.path)
+        except Resolver404:
+            return _error(url, status.HTTP_404_NOT_FOUND, 'Not found.')
+        view_class = getattr(match.func, 'cls', None)
+        if view_class is None or not issubclass(view_class, APIView) or issubclass(view_class, Batch):
+            return _error(url, status.HTTP_400_BAD_REQUEST, 'Not an API endpoint that can be batched.')
+
+        sub = HttpRequest()
+        sub.method = 'GET'
+        sub.path = sub.path_info = parts.path
+        sub.META = {key: value for key, value in request.META.items() if key not in _DROP_HEADERS}
+        sub.META.update(REQUEST_METHOD='GET', PATH_INFO=parts.path, QUERY_STRING=parts.query)
+        sub.GET = QueryDict(parts.query)
+        sub.resolver_match = match
+        # DRF authenticates a request carrying these as this user without asking the authenticators
+        sub._force_auth_user = request.user
+        sub._force_auth_token = request.auth
+
+        try:
+            response = match.func(sub, *match.args, **match.kwargs)
+        except (ObjectDoesNotExist, Http404):
+            # views that look objects up without turning a miss into a 404
+            return _error(url, status.HTTP_404_NOT_FOUND, 'Not found.')
+        except Exception:
+            logger.exception('Batched request %s failed', url)
+            return _error(url, status.HTTP_500_INTERNAL_SERVER_ERROR, 'Server error.')
+        if response.streaming:
+            return _error(url, status.HTTP_400_BAD_REQUEST, 'Streaming responses cannot be batched.')
+        if not hasattr(response, 'data'):
+            return _error(url, status.HTTP_400_BAD_REQUEST, 'Only JSON API responses can be batched.')
+        return {'url': url, 'status': response.status_code, 'body': response.data}
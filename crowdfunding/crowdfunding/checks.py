@@ -0,0 +1,55 @@
+"""
+System checks for settings that only matter once there are several processes.
+"""
+import logging
+
+from django.conf import settings
+from django.core.checks import Error, Tags, Warning, register
+
+logger = logging.getLogger(__name__)
+
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def shared_cache():
+    return settings.CACHES['default']['BACKEND'] not in PROCESS_LOCAL_CACHES
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    if shared_cache():
+        return []
+    return [Warning(
+        'The default cache is local to each process.',
+        hint=(
+            'Cached responses are only expired in the worker that made the change. '
+            'Set DJANGO_CACHE_BACKEND and DJANGO_CACHE_LOCATION to a shared cache '
+            'when running more than one worker.'
+        ),
+        id='crowdfunding.W001',
+    )]
+
+
+@register(Tags.caches, Tags.database)
+def check_replica_pins(app_configs, **kwargs):
+    if not settings.DATABASE_REPLICAS or shared_cache():
+        return []
+    return [Error(
+        'DATABASE_REPLICA_URLS is set but the default cache is local to each process.',
+        hint=(
+            'Replica pins live in the cache; a client pinned after a write on one worker '
+            'would read from a lagging replica on another. Configure a shared cache.'
+        ),
+        id='crowdfunding.E001',
+    )]
+
+
+def warn_at_startup():
+    """ log the deploy warnings when a production server loads the application """
+    if settings.DEBUG:
+        return
+    for warning in check_shared_cache(None):
+        logger.warning('%s %s', warning.msg, warning.hint)
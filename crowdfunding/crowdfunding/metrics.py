@@ -0,0 +1,292 @@
+"""
+Request metrics in the Prometheus text format.
+
+MetricsMiddleware records, per resolved URL pattern and method: request
+count, a latency histogram, SQL query count and time, serializer time
+and response size. Serializer time is collected by TimedSerializerMixin
+and includes any queries run while rendering.
+
+Each process keeps its numbers in memory. When settings.METRICS_DIR is
+set, every process also writes them to its own file there at most once
+per METRICS_FLUSH_INTERVAL seconds, and /metrics/ adds up the files of
+all workers. Clear the directory when the deployment starts.
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse
+from rest_framework import permissions, serializers
+from rest_framework.views import APIView
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+_lock = threading.Lock()
+_series = {}
+_local = threading.local()
+_started = time.time()
+_last_flush = 0.0
+
+
+def _new_series():
+    return {
+        'requests': 0,
+        'latency_buckets': [0] * (len(LATENCY_BUCKETS) + 1),
+        'latency_sum': 0.0,
+        'sql_queries': 0,
+        'sql_seconds': 0.0,
+        'serializer_seconds': 0.0,
+        'response_bytes': 0,
+    }
+
+
+def observe(route, method, seconds, sql_queries, sql_seconds, serializer_seconds, response_bytes):
+    bucket = next(
+        (i for i, bound in enumerate(LATENCY_BUCKETS) if seconds <= bound), len(LATENCY_BUCKETS)
+    )
+    with _lock:
+        series = _series.setdefault('%s %s' % (method, route), _new_series())
+        series['requests'] += 1
+        series['latency_buckets'][bucket] += 1
+        series['latency_sum'] += seconds
+        series['sql_queries'] += sql_queries
+        series['sql_seconds'] += sql_seconds
+        series['serializer_seconds'] += serializer_seconds
+        series['response_bytes'] += response_bytes
+
+
+def _process_counters():
+    # caches that keep their own per-process hit/miss counts
+    from projects.cache import response_cache_stats
+    from tasks.queue import queue_stats
+    from users.authentication import token_cache
+    response_cache = response_cache_stats()
+    tokens = token_cache.stats()
+    return dict(queue_stats(), **{
+        'response_cache_hits': response_cache['hits'],
+        'response_cache_misses': response_cache['misses'],
+        'token_cache_hits': tokens['hits'],
+        'token_cache_misses': tokens['misses'],
+    })
+
+
+def _gauges():
+    # read from the database at scrape time, the same for every worker
+    from tasks.queue import depth
+    return {'task_queue_%s' % name: value for name, value in depth().items()}
+
+
+def snapshot():
+    with _lock:
+        series = json.loads(json.dumps(_series))
+    return {'series': series, 'counters': _process_counters()}
+
+
+def _path():
+    return os.path.join(settings.METRICS_DIR, 'metrics-%d-%d.json' % (os.getpid(), _started))
+
+
+def flush(force=False):
+    """ write this process's numbers to METRICS_DIR, rate limited unless forced """
+    global _last_flush
+    if not settings.METRICS_DIR:
+        return
+    now = time.monotonic()
+    if not force and now - _last_flush < settings.METRICS_FLUSH_INTERVAL:
+        return
+    _last_flush = now
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    handle, temporary = tempfile.mkstemp(dir=settings.METRICS_DIR, suffix='.tmp')
+    with os.fdopen(handle, 'w') as output:
+        json.dump(snapshot(), output)
+    os.replace(temporary, _path())
+
+
+def collect():
+    """ the numbers of every worker added together """
+    if not settings.METRICS_DIR:
+        return snapshot()
+    flush(force=True)
+    merged = {'series': {}, 'counters': defaultdict(int)}
+    for name in os.listdir(settings.METRICS_DIR):
+        if not (name.startswith('metrics-') and name.endswith('.json')):
+            continue
+        try:
+            with open(os.path.join(settings.METRICS_DIR, name)) as source:
+                data = json.load(source)
+        except (OSError, ValueError):
+            continue
+        for key, series in data['series'].items():
+            total = merged['series'].setdefault(key, _new_series())
+            for field, value in series.items():
+                if field == 'latency_buckets':
+                    total[field] = [a + b for a, b in zip(total[field], value)]
+                else:
+                    total[field] += value
+        for field, value in data['counters'].items():
+            merged['counters'][field] += value
+    return merged
+
+
+def _quantile(q, buckets):
+    """ estimate a quantile from histogram buckets, the way histogram_quantile() does """
+    total = sum(buckets)
+    if not total:
+        return 0.0
+    rank = q * total
+    seen = 0
+    lower = 0.0
+    for bound, count in zip(LATENCY_BUCKETS + (float('inf'),), buckets):
+        if seen + count >= rank:
+            if bound == float('inf'):
+                return lower
+            return lower + (bound - lower) * (rank - seen) / count
+        seen += count
+        lower = bound
+    return lower
+
+
+def render(data):
+    lines = []
+
+    def family(name, kind, help_text):
+        lines.append('# HELP %s %s' % (name, help_text))
+        lines.append('# TYPE %s %s' % (name, kind))
+
+    def labels(key, **extra):
+        method, route = key.split(' ', 1)
+        pairs = [('route', route), ('method', method)] + list(extra.items())
+        return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('"', '\\"')) for k, v in pairs)
+
+    series = sorted(data['series'].items())
+    family('http_requests_total', 'counter', 'Requests handled.')
+    for key, values in series:
+        lines.append('http_requests_total%s %d' % (labels(key), values['requests']))
+
+    family('http_request_duration_seconds', 'histogram', 'Request latency.')
+    for key, values in series:
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), values['latency_buckets']):
+            cumulative += count
+            lines.append('http_request_duration_seconds_bucket%s %d' % (labels(key, le=bound), cumulative))
+        lines.append('http_request_duration_seconds_sum%s %f' % (labels(key), values['latency_sum']))
+        lines.append('http_request_duration_seconds_count%s %d' % (labels(key), values['requests']))
+
+    family('http_request_duration_quantile_seconds', 'gauge', 'Latency quantiles estimated from the histogram.')
+    for key, values in series:
+        for q in QUANTILES:
+            lines.append('http_request_duration_quantile_seconds%s %f' % (
+                labels(key, quantile=q), _quantile(q, values['latency_buckets'])
+            ))
+
+    for field, kind, help_text, fmt in (
+        ('sql_queries', 'counter', 'SQL statements run.', '%d'),
+        ('sql_seconds', 'counter', 'Time spent in SQL.', '%f'),
+        ('serializer_seconds', 'counter', 'Time spent serializing, including lazy queries.', '%f'),
+        ('response_bytes', 'counter', 'Response body bytes, streaming responses excluded.', '%d'),
+    ):
+        name = 'http_request_%s_total' % field
+        family(name, kind, help_text)
+        for key, values in series:
+            lines.append(('%s%s ' + fmt) % (name, labels(key), values[field]))
+
+    for field, value in sorted(data['counters'].items()):
+        family(field + '_total', 'counter', field.replace('_', ' ').capitalize() + '.')
+        lines.append('%s_total %d' % (field, value))
+
+    for field, value in sorted(data.get('gauges', {}).items()):
+        family(field, 'gauge', field.replace('_', ' ').capitalize() + '.')
+        lines.append('%s %s' % (field, value))
+    return '\n'.join(lines) + '\n'
+
+
+# Collection
+
+@contextmanager
+def timing(kind):
+    """ add the time spent inside to the current request's `kind` total """
+    totals = getattr(_local, 'totals', None)
+    if totals is None or _local.depth.get(kind):
+        # not inside a request, or already timed by an outer block
+        yield
+        return
+    _local.depth[kind] = 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        totals[kind] += time.perf_counter() - start
+        _local.depth[kind] = 0
+
+
+class TimedListSerializer(serializers.ListSerializer):
+
+    @property
+    def data(self):
+        with timing('serializer'):
+            return super().data
+
+
+class TimedSerializerMixin:
+    """ count the time spent producing `.data` as serializer time """
+
+    class Meta:
+        list_serializer_class = TimedListSerializer
+
+    @property
+    def data(self):
+        with timing('serializer'):
+            return super().data
+
+
+class MetricsMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def _execute(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            _local.totals['sql'] += time.perf_counter() - start
+            _local.totals['queries'] += 1
+
+    def __call__(self, request):
+        _local.totals = defaultdict(float)
+        _local.depth = {}
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(self._execute))
+                response = self.get_response(request)
+        finally:
+            totals, _local.totals = _local.totals, None
+
+        match = getattr(request, 'resolver_match', None)
+        route = match.route if match is not None else 'unmatched'
+        observe(
+            route, request.method, time.perf_counter() - start,
+            int(totals['queries']), totals['sql'], totals['serializer'],
+            0 if response.streaming else len(response.content),
+        )
+        flush()
+        return response
+
+
+class Metrics(APIView):
+    # Prometheus scrape target, staff only
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        data = collect()
+        data['gauges'] = _gauges()
+        return HttpResponse(render(data), content_type='text/plain; version=0.0.4')
@@ -0,0 +1,181 @@
+"""
+Per-request SQL recording, N+1 detection and query budgets.
+
+QueryRecorder captures every statement run on any connection while it is
+active and groups them by normalized shape. A shape that repeats is a
+likely N+1; the recorder remembers which serializer field was being
+rendered the second time it ran.
+
+QueryBudgetMiddleware records each request and compares the count with
+the `query_budget` declared on the view class, either a number or a dict
+keyed by HTTP method. Going over the budget raises QueryBudgetExceeded
+when settings.QUERY_BUDGET_RAISE is set (`manage.py test` sets it) and
+is logged otherwise.
+
+A streaming response runs most of its queries after the middleware has
+returned, while it is being sent. Its content is wrapped so each chunk
+is recorded on its own and held to the same budget: a stream makes a
+few queries per chunk, however many chunks there are.
+
+Queries run inside unrecorded() are left out, such as the tasks that
+TASKS_EAGER runs in the request instead of a worker.
+"""
+import logging
+import re
+import sys
+import threading
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+from rest_framework.fields import Field
+
+logger = logging.getLogger(__name__)
+
+_IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_SPACES = re.compile(r'\s+')
+
+_paused = threading.local()
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def normalize(sql):
+    """ the shape of a statement: literals and IN lists collapsed """
+    sql = _LITERALS.sub('?', sql)
+    sql = _IN_LIST.sub('IN (...)', sql)
+    return _SPACES.sub(' ', sql).strip()
+
+
+def _rendering_field():
+    """ the innermost serializer field on the stack, as 'SerializerName.field' """
+    frame = sys._getframe(1)
+    while frame is not None:
+        field = frame.f_locals.get('self')
+        if isinstance(field, Field) and field.field_name and field.parent is not None:
+            return '%s.%s' % (type(field.parent).__name__, field.field_name)
+        frame = frame.f_back
+    return None
+
+
+class QueryRecorder:
+    """
+    Context manager recording the SQL run inside it:
+
+        with QueryRecorder() as queries:
+            client.get('/projects/')
+        queries.count, queries.n_plus_one()
+    """
+
+    def __init__(self, n_plus_one_threshold=None):
+        if n_plus_one_threshold is None:
+            n_plus_one_threshold = settings.QUERY_N_PLUS_ONE_THRESHOLD
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.statements = []
+        self.shapes = Counter()
+        self.sources = {}
+        self._stack = None
+
+    def __call__(self, execute, sql, params, many, context):
+        if getattr(_paused, 'depth', 0):
+            return execute(sql, params, many, context)
+        shape = normalize(sql)
+        self.statements.append(sql)
+        self.shapes[shape] += 1
+        if self.shapes[shape] == 2:
+            self.sources[shape] = _rendering_field()
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def n_plus_one(self):
+        """ [(shape, times, field)] for shapes repeated at least the threshold """
+        return [
+            (shape, times, self.sources.get(shape))
+            for shape, times in self.shapes.most_common()
+            if times >= self.n_plus_one_threshold
+        ]
+
+    def report(self):
+        lines = ['%d queries' % self.count]
+        for shape, times, field in self.n_plus_one():
+            lines.append('  likely N+1, %dx from %s: %s' % (times, field or 'unknown', shape))
+        return '\n'.join(lines)
+
+
+@contextmanager
+def unrecorded():
+    """ keep the queries run inside out of every active QueryRecorder """
+    depth = getattr(_paused, 'depth', 0)
+    _paused.depth = depth + 1
+    try:
+        yield
+    finally:
+        _paused.depth = depth
+
+
+def view_budget(view_class, method):
+    budget = getattr(view_class, 'query_budget', None)
+    if isinstance(budget, dict):
+        return budget.get(method)
+    return budget
+
+
+class QueryBudgetMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with QueryRecorder() as queries:
+            response = self.get_response(request)
+        self.check(request, queries)
+        if response.streaming:
+            response.streaming_content = self.record_chunks(request, response.streaming_content)
+        return response
+
+    def record_chunks(self, request, content):
+        content = iter(content)
+        while True:
+            # recording only while a chunk is made, not while it is sent
+            with QueryRecorder() as queries:
+                chunk = next(content, None)
+            self.check(request, queries, ' (streamed chunk)')
+            if chunk is None:
+                return
+            yield chunk
+
+    def check(self, request, queries, part=''):
+        view_class = getattr(request, '_query_budget_view', None)
+        budget = view_budget(view_class, request.method)
+        name = (view_class.__name__ if view_class else request.path) + part
+        if queries.n_plus_one():
+            logger.warning('%s %s: %s', request.method, name, queries.report())
+        if budget is not None and queries.count > budget:
+            message = '%s %s ran over its query budget of %d: %s' % (
+                request.method, name, budget, queries.report()
+            )
+            if settings.QUERY_BUDGET_RAISE:
+                raise QueryBudgetExceeded(message)
+            logger.error(message)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # as_view() leaves the class on the function, DRF as `cls`
+        request._query_budget_view = (
+            getattr(view_func, 'view_class', None) or getattr(view_func, 'cls', None)
+        )
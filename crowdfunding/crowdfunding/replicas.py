@@ -0,0 +1,159 @@
+"""
+Read replicas for safe-method requests.
+
+ReplicaMiddleware picks, for every GET, HEAD or OPTIONS request handled
+by a view of the projects or users apps, one of settings.DATABASE_REPLICAS
+in turn. ReplicaRouter then sends that request's reads there. Writes,
+and reads after the request has written anything, always use the
+primary, as does every other request.
+
+Read your writes: a client whose request wrote to the primary is pinned
+to it for REPLICA_PIN_SECONDS, so it does not read its own changes back
+from a replica that has not caught up yet. Clients are told apart by
+their Authorization header, else their session cookie, else their
+address. Logging in changes exactly that, so credentials are always read
+from the primary instead: tokens and sessions, and the session's user,
+which is loaded before the request moves to a replica. Pins live in the default cache, which has to be shared for every
+worker to see them; the system checks refuse a process-local cache when
+replicas are configured. Responses read from a replica are never stored
+in the response cache, as a lagging replica would cache old rows under
+the version a write has just bumped.
+
+Health: each process checks a replica with SELECT 1 before using it, at
+most once per REPLICA_CHECK_INTERVAL seconds. A replica that fails the
+check, or fails a request with a database error, is left out for
+REPLICA_RETRY_AFTER seconds. With no healthy replica reads use the
+primary.
+"""
+import hashlib
+import itertools
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+REPLICA_APPS = ('projects', 'users')
+# a client that has just logged in presents credentials a replica may not have yet
+PRIMARY_APPS = ('authtoken', 'sessions')
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_local = threading.local()
+_lock = threading.Lock()
+_turn = itertools.count()
+# alias -> (monotonic time of the next check, healthy)
+_health = {}
+
+
+def _check(alias):
+    try:
+        with connections[alias].cursor() as cursor:
+            cursor.execute('SELECT 1')
+        return True
+    except DatabaseError:
+        logger.warning('Replica %s failed its health check', alias, exc_info=True)
+        return False
+
+
+def mark_down(alias):
+    """ leave `alias` out for REPLICA_RETRY_AFTER seconds """
+    with _lock:
+        _health[alias] = (time.monotonic() + settings.REPLICA_RETRY_AFTER, False)
+
+
+def is_healthy(alias):
+    next_check, healthy = _health.get(alias, (0, False))
+    if time.monotonic() < next_check:
+        return healthy
+    if not _check(alias):
+        mark_down(alias)
+        return False
+    with _lock:
+        _health[alias] = (time.monotonic() + settings.REPLICA_CHECK_INTERVAL, True)
+    return True
+
+
+def pick_replica():
+    """ the next healthy replica, None when there is none """
+    replicas = settings.DATABASE_REPLICAS
+    if not replicas:
+        return None
+    start = next(_turn)
+    for offset in range(len(replicas)):
+        alias = replicas[(start + offset) % len(replicas)]
+        if is_healthy(alias):
+            return alias
+    return None
+
+
+def _pin_key(request):
+    client = (
+        request.META.get('HTTP_AUTHORIZATION')
+        or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+        or request.META.get('REMOTE_ADDR', '')
+    )
+    return 'replica-pin:%s' % hashlib.sha1(client.encode()).hexdigest()
+
+
+def reading_replica():
+    """ the replica this request reads from, None for the primary """
+    replica = getattr(_local, 'replica', None)
+    return None if replica is None or _local.wrote else replica
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label in PRIMARY_APPS:
+            return DEFAULT_DB_ALIAS
+        return reading_replica() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        # only set while ReplicaMiddleware handles a request
+        if hasattr(_local, 'wrote'):
+            _local.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replicas hold the same rows as the primary
+        return True
+
+
+class ReplicaMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        _local.replica = None
+        _local.wrote = False
+        try:
+            response = self.get_response(request)
+        finally:
+            wrote = _local.wrote
+            del _local.replica, _local.wrote
+        if wrote:
+            cache.set(_pin_key(request), True, settings.REPLICA_PIN_SECONDS)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.method not in SAFE_METHODS or not settings.DATABASE_REPLICAS:
+            return
+        if view_func.__module__.split('.')[0] not in REPLICA_APPS:
+            return
+        if cache.get(_pin_key(request)):
+            return
+        if hasattr(request, 'user'):
+            # AuthenticationMiddleware loads the session's user lazily, do it on the primary
+            request.user.is_authenticated
+        _local.replica = pick_replica()
+
+    def process_exception(self, request, exception):
+        replica = getattr(_local, 'replica', None)
+        if replica is not None and isinstance(exception, DatabaseError):
+            logger.error('Taking replica %s out of rotation after %r', replica, exception)
+            mark_down(replica)
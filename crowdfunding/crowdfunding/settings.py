@@ -48,18 +48,28 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'users.apps.UsersConfig',
+    'tasks.apps.TasksConfig',
 ]
 
 REST_FRAMEWORK = {
 'DEFAULT_AUTHENTICATION_CLASSES': [
-'rest_framework.authentication.TokenAuthentication',
+'users.authentication.CachedTokenAuthentication',
 'rest_framework.authentication.SessionAuthentication',
-]
+],
+'DEFAULT_PAGINATION_CLASS': 'projects.pagination.OptInCursorPagination',
+'PAGE_SIZE': 50,
 }
 
 AUTH_USER_MODEL = 'users.CustomUser'
 
+# In-process cache of authenticated tokens, see users.authentication
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', 10000))
+TOKEN_CACHE_TTL = int(os.environ.get('TOKEN_CACHE_TTL', 60))
+
 MIDDLEWARE = [
+    'crowdfunding.metrics.MetricsMiddleware',
+    'crowdfunding.querybudget.QueryBudgetMiddleware',
+    'crowdfunding.replicas.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -71,6 +81,56 @@ MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
 ]
 
+# Seconds a POST's Idempotency-Key and response are kept, see projects.idempotency
+IDEMPOTENCY_KEY_TTL = int(os.environ.get('IDEMPOTENCY_KEY_TTL', 24 * 60 * 60))
+
+# Length of the precomputed trending and leaderboard lists
+RANKING_SIZE = 50
+
+# Most read-only sub-requests one POST /batch/ may carry
+BATCH_MAX_REQUESTS = 20
+
+# Request metrics served at /metrics/. With several worker processes set
+# METRICS_DIR to a directory they share, see crowdfunding.metrics
+METRICS_DIR = os.environ.get('METRICS_DIR', '')
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 1))
+
+# Views declare `query_budget`; going over it raises with QUERY_BUDGET_RAISE
+# and is logged otherwise, see crowdfunding.querybudget
+QUERY_BUDGET_RAISE = os.environ.get('QUERY_BUDGET_RAISE', '') == 'True'
+QUERY_N_PLUS_ONE_THRESHOLD = 5
+
+# Work that follows a write runs on `manage.py run_workers`, see tasks.queue.
+# With TASKS_EAGER it runs inline instead
+TASKS_EAGER = os.environ.get('TASKS_EAGER', '') == 'True'
+
+# `manage.py test` turns on QUERY_BUDGET_RAISE and TASKS_EAGER
+TEST_RUNNER = 'crowdfunding.testrunner.TestRunner'
+TASKS_BATCH_SIZE = int(os.environ.get('TASKS_BATCH_SIZE', 100))
+# Seconds a worker holds its claim, after that another worker may run the task
+TASKS_LEASE = int(os.environ.get('TASKS_LEASE', 300))
+TASKS_MAX_ATTEMPTS = int(os.environ.get('TASKS_MAX_ATTEMPTS', 5))
+# Seconds before the first retry, doubling up to the maximum
+TASKS_RETRY_DELAY = 5
+TASKS_MAX_RETRY_DELAY = 60 * 60
+# Tasks run_workers enqueues every so many seconds
+TASKS_PERIODIC = {
+    'projects.trending.update_rankings': 60,
+    'projects.idempotency.purge_expired': 60 * 60,
+    'projects.events.purge': 10 * 60,
+}
+
+# Live updates at /projects/<pk>/events/, served by crowdfunding.asgi, see projects.events
+EVENTS_BACKEND = 'projects.events.DatabaseBackend'
+EVENTS_POLL_INTERVAL = float(os.environ.get('EVENTS_POLL_INTERVAL', 0.5))
+# Seconds an event may commit after one with a higher id, events this young are read again
+EVENTS_SETTLE = 2
+EVENTS_KEEPALIVE = 15
+# Events a client may fall behind by before its stream is closed
+EVENTS_CLIENT_BUFFER = 100
+# Seconds events are kept for clients resuming with Last-Event-ID
+EVENTS_RETENTION = 10 * 60
+
 ROOT_URLCONF = 'crowdfunding.urls'
 
 TEMPLATES = [
@@ -102,6 +162,26 @@ DATABASES = {
     }
 }
 
+# Cache
+# Local memory by default; point DJANGO_CACHE_BACKEND/DJANGO_CACHE_LOCATION
+# at a shared cache (memcached, redis, database) in production. Response
+# cache versions live here, so with local memory a write only expires the
+# cached responses of the worker that made it; `manage.py check --deploy`
+# warns about it.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get(
+            'DJANGO_CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.environ.get('DJANGO_CACHE_LOCATION', ''),
+    }
+}
+
+# Seconds a cached API response is kept, invalidation normally expires it first
+RESPONSE_CACHE_TIMEOUT = int(os.environ.get('RESPONSE_CACHE_TIMEOUT', 300))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
@@ -146,3 +226,20 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
 db_from_env = dj_database_url.config(conn_max_age=500)
 DATABASES['default'].update(db_from_env)
+
+# Read replicas for GET requests, see crowdfunding.replicas. A comma
+# separated list of database URLs; to try it locally copy db.sqlite3 and
+# set DATABASE_REPLICA_URLS=sqlite:////path/to/replica1.sqlite3,...
+DATABASE_REPLICAS = []
+for number, url in enumerate(filter(None, os.environ.get('DATABASE_REPLICA_URLS', '').split(',')), 1):
+    DATABASES['replica%d' % number] = dict(
+        dj_database_url.parse(url, conn_max_age=500), TEST={'MIRROR': 'default'}
+    )
+    DATABASE_REPLICAS.append('replica%d' % number)
+
+DATABASE_ROUTERS = ['crowdfunding.replicas.ReplicaRouter']
+# Seconds a client reads from the primary after it wrote
+REPLICA_PIN_SECONDS = int(os.environ.get('REPLICA_PIN_SECONDS', 5))
+# Seconds between health checks of a replica, and before a failed one is tried again
+REPLICA_CHECK_INTERVAL = int(os.environ.get('REPLICA_CHECK_INTERVAL', 10))
+REPLICA_RETRY_AFTER = int(os.environ.get('REPLICA_RETRY_AFTER', 30))
@@ -0,0 +1,19 @@
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """
+    The default runner with query budgets enforced and tasks run inline.
+    Other runners get the same with QUERY_BUDGET_RAISE=True and
+    TASKS_EAGER=True in the environment.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._strict = override_settings(QUERY_BUDGET_RAISE=True, TASKS_EAGER=True)
+        self._strict.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._strict.disable()
+        super().teardown_test_environment(**kwargs)
@@ -2,6 +2,8 @@ from django.contrib import admin
 from django.urls import path, include
 from rest_framework.authtoken.views import obtain_auth_token
 from users.views import CustomAuthToken
+from .batch import Batch
+from .metrics import Metrics
 
 
 
@@ -12,6 +14,8 @@ urlpatterns = [
     path('api-auth/', include('rest_framework.urls')),
     # path('api-token-auth/', obtain_auth_token, name='api_token_auth'),
     path('api-token-auth/', CustomAuthToken.as_view(), name='api_token_auth'),
+    path('metrics/', Metrics.as_view()),
+    path('batch/', Batch.as_view()),
 ]
 
 
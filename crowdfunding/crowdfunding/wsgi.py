@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'crowdfunding.settings')
 
 application = get_wsgi_application()
+
+from crowdfunding.checks import warn_at_startup  # noqa: E402, needs the apps loaded
+
+warn_at_startup()
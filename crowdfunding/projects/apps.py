@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class ProjectsConfig(AppConfig):
     name = 'projects'
+
+    def ready(self):
+        # connects the signal receivers that keep recommendations, search, trending and live events current
+        from . import events, recommendations, search, trending  # noqa: F401
+        from crowdfunding import checks  # noqa: F401
@@ -0,0 +1,96 @@
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.response import Response
+
+from crowdfunding.replicas import reading_replica
+
+from .streaming import wants_stream
+
+# per process, read with response_cache_stats()
+_stats = {'hits': 0, 'misses': 0}
+
+
+def _version_key(resource):
+    return 'response-version:%s' % resource
+
+
+def _fresh_version():
+    # time based, so a version key that was evicted never comes back as an old value
+    return int(time.time() * 1000000)
+
+
+def get_versions(resources):
+    keys = [_version_key(resource) for resource in resources]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, _fresh_version(), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def _bump(resources):
+    for resource in resources:
+        key = _version_key(resource)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _fresh_version(), None)
+
+
+def bump_versions(*resources):
+    """
+    expire every cached response built from one of `resources`
+
+    Inside a transaction the versions are bumped again once it commits: a
+    GET running in between still reads the old rows and may cache them
+    under the first new version.
+    """
+    _bump(resources)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: _bump(resources))
+
+
+def response_cache_stats():
+    return dict(_stats)
+
+
+def cached_response(*resources):
+    """
+    Cache the data of a successful GET handler.
+
+    `resources` are format strings filled from the URL kwargs, such as
+    'project:{pk}'. The cache key includes the current version of each
+    resource, so bump_versions() invalidates without deleting anything.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            if request.method != 'GET' or wants_stream(request):
+                return method(view, request, *args, **kwargs)
+            names = [resource.format(**kwargs) for resource in resources]
+            versions = get_versions(names)
+            path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+            key = 'response:%s:%s' % (path, '.'.join(str(version) for version in versions))
+
+            cached = cache.get(key)
+            if cached is not None:
+                _stats['hits'] += 1
+                response = Response(cached)
+                response['X-Cache'] = 'HIT'
+                return response
+
+            _stats['misses'] += 1
+            response = method(view, request, *args, **kwargs)
+            # a replica may lag behind the versions, only the primary's rows are cached
+            if response.status_code == 200 and not response.streaming and not reading_replica():
+                cache.set(key, response.data, settings.RESPONSE_CACHE_TIMEOUT)
+            response['X-Cache'] = 'MISS'
+            return response
+        return wrapper
+    return decorator
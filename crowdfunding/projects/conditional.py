@@ -0,0 +1,40 @@
+import hashlib
+
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+
+from .cache import get_versions
+
+
+def _etag(parts):
+    return hashlib.md5(repr(parts).encode()).hexdigest()
+
+
+def version_state(*resources):
+    """ ETag for a list from the response cache versions of `resources`, without a query """
+    return _etag(tuple(zip(resources, get_versions(resources)))), None
+
+
+def row_state(queryset, pk):
+    """ ETag and Last-Modified for a single row, (None, None) when it does not exist """
+    updated_at = queryset.filter(pk=pk).values_list('updated_at', flat=True).first()
+    if updated_at is None:
+        return None, None
+    return _etag((queryset.model._meta.label, pk, updated_at)), updated_at
+
+
+def conditional_get(state_func):
+    """
+    Method decorator answering If-None-Match and If-Modified-Since with a
+    304 before the handler runs. `state_func` receives the URL kwargs and
+    returns (etag, last_modified); it runs once per request.
+    """
+    def get_state(request, *args, **kwargs):
+        if not hasattr(request, '_conditional_state'):
+            request._conditional_state = state_func(**kwargs)
+        return request._conditional_state
+
+    return method_decorator(condition(
+        etag_func=lambda request, *args, **kwargs: get_state(request, *args, **kwargs)[0],
+        last_modified_func=lambda request, *args, **kwargs: get_state(request, *args, **kwargs)[1],
+    ))
@@ -0,0 +1,288 @@
+"""
+Live funding updates as Server-Sent Events.
+
+    GET /projects/<pk>/events/
+
+    event: totals
+    data: {"goal": 500, "amount_raised": 120, "pledge_count": 4, "unique_supporter_count": 3}
+
+    id: 981
+    event: pledge
+    data: {"id": 77, "amount": 20, "comment": "Go!", "anonymous": false, "supporter": 12}
+
+A stream opens with the project's current totals, then gets a `pledge`
+event for every new pledge and a `totals` event whenever the totals
+change. Comment lines keep idle connections alive. A client that
+reconnects with Last-Event-ID is sent what it missed, as long as it is
+younger than EVENTS_RETENTION seconds.
+
+Writes publish events through the backend in settings.EVENTS_BACKEND,
+in the writing transaction. DatabaseBackend, the default, stores them
+in the ProjectEvent table. Each ASGI worker runs one Broadcaster. It
+polls the backend every EVENTS_POLL_INTERVAL seconds for the projects
+its clients watch and hands the events to their queues. The database
+cost is therefore one query per worker per interval, however many
+clients are connected. An idle client costs a coroutine and a queue.
+Any worker process can publish, including WSGI ones and task workers.
+
+Streams are served by crowdfunding.asgi in front of Django; Django 3.0
+has no async views. Under WSGI the path is not routed.
+"""
+import asyncio
+import json
+import logging
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections
+from django.db.models import Max, Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
+from django.utils.module_loading import import_string
+
+from tasks.queue import task
+from .models import Pledge, Project, ProjectEvent, project_being_deleted
+
+logger = logging.getLogger(__name__)
+
+TOTALS = ('goal', 'amount_raised', 'pledge_count', 'unique_supporter_count')
+
+
+class DatabaseBackend:
+    """ events in the ProjectEvent table, for any number of processes on one database """
+
+    def publish(self, project_id, events):
+        ProjectEvent.objects.bulk_create(
+            ProjectEvent(project_id=project_id, event=event, data=json.dumps(data))
+            for event, data in events
+        )
+
+    def latest(self):
+        return ProjectEvent.objects.aggregate(latest=Max('id'))['latest'] or 0
+
+    def read(self, project_ids, after, settle=0, limit=1000):
+        """
+        (id, project id, event, data) after the id `after`, and those
+        created in the last `settle` seconds, which may have committed
+        after a higher id was read
+        """
+        recent = Q(id__gt=after)
+        if settle:
+            recent |= Q(created_at__gte=timezone.now() - timedelta(seconds=settle))
+        return list(
+            ProjectEvent.objects.filter(recent, project_id__in=project_ids)
+            .order_by('id').values_list('id', 'project_id', 'event', 'data')[:limit]
+        )
+
+    def replay(self, project_id, after, until):
+        return list(
+            ProjectEvent.objects.filter(project_id=project_id, id__gt=after, id__lte=until)
+            .order_by('id').values_list('id', 'project_id', 'event', 'data')
+        )
+
+    def purge(self, before):
+        ProjectEvent.objects.filter(created_at__lt=before).delete()
+
+
+backend = SimpleLazyObject(lambda: import_string(settings.EVENTS_BACKEND)())
+
+
+# Publishing, from synchronous code
+
+def totals(project_id):
+    return Project.objects.filter(pk=project_id).values(*TOTALS).first()
+
+
+def publish_totals(project_ids):
+    for project_id in project_ids:
+        current = totals(project_id)
+        if current is not None:
+            backend.publish(project_id, [('totals', current)])
+
+
+@receiver(post_save, sender=Pledge)
+def pledge_created(sender, instance, created, **kwargs):
+    if not created:
+        return
+    pledge = {
+        'id': instance.pk, 'amount': instance.amount, 'comment': instance.comment,
+        'anonymous': instance.anonymous, 'supporter': instance.supporter_id,
+    }
+    backend.publish(instance.project_id, [('pledge', pledge), ('totals', totals(instance.project_id))])
+
+@receiver(post_delete, sender=Pledge)
+def pledge_deleted(sender, instance, **kwargs):
+    if project_being_deleted(instance.project_id):
+        return
+    publish_totals([instance.project_id])
+
+@receiver(post_save, sender=Project)
+def project_saved(sender, instance, **kwargs):
+    publish_totals([instance.pk])
+
+@task
+def purge():
+    backend.purge(timezone.now() - timedelta(seconds=settings.EVENTS_RETENTION))
+
+
+# Streaming, on the ASGI event loop
+
+def _database(function):
+    """ `function` run off the event loop, with the connection handling of a request """
+    def run(*args):
+        close_old_connections()
+        try:
+            return function(*args)
+        finally:
+            close_old_connections()
+    return sync_to_async(run, thread_sensitive=True)
+
+
+class Broadcaster:
+    """ one per process: polls the backend while anyone listens and fans out to their queues """
+
+    def __init__(self):
+        self.clients = defaultdict(set)
+        self.last_id = 0
+        self.delivered = {}
+        self.poller = None
+
+    async def subscribe(self, project_id):
+        """ a queue of this project's events after the returned id """
+        if self.poller is None:
+            last_id = await _database(backend.latest)()
+            if self.poller is None:
+                self.last_id = last_id
+                self.delivered = {}
+                self.poller = asyncio.ensure_future(self.poll())
+        queue = asyncio.Queue(settings.EVENTS_CLIENT_BUFFER)
+        self.clients[project_id].add(queue)
+        return queue, self.last_id
+
+    def unsubscribe(self, project_id, queue):
+        self.clients[project_id].discard(queue)
+        if not self.clients[project_id]:
+            del self.clients[project_id]
+        if not self.clients and self.poller is not None:
+            self.poller.cancel()
+            self.poller = None
+
+    async def poll(self):
+        while True:
+            await asyncio.sleep(settings.EVENTS_POLL_INTERVAL)
+            try:
+                rows = await _database(backend.read)(
+                    list(self.clients), self.last_id, settings.EVENTS_SETTLE
+                )
+            except DatabaseError:
+                logger.exception('Could not read project events')
+                continue
+            now = time.monotonic()
+            for row in rows:
+                if row[0] in self.delivered:
+                    continue
+                self.delivered[row[0]] = now
+                self.last_id = max(self.last_id, row[0])
+                self.deliver(row)
+            # ids only need remembering while a late commit could still show them again
+            self.delivered = {
+                event_id: seen for event_id, seen in self.delivered.items()
+                if now - seen < settings.EVENTS_SETTLE + settings.EVENTS_POLL_INTERVAL
+            }
+
+    def deliver(self, row):
+        for queue in list(self.clients.get(row[1], ())):
+            try:
+                queue.put_nowait(row)
+            except asyncio.QueueFull:
+                # too slow to keep up, end its stream, it resumes from Last-Event-ID
+                self.unsubscribe(row[1], queue)
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+
+
+broadcaster = Broadcaster()
+
+
+def _message(event, data, event_id=None):
+    lines = ['event: %s' % event, 'data: %s' % data]
+    if event_id is not None:
+        lines.insert(0, 'id: %d' % event_id)
+    return ('\n'.join(lines) + '\n\n').encode()
+
+
+async def _respond(send, status, body, content_type='application/json'):
+    await send({'type': 'http.response.start', 'status': status, 'headers': [
+        (b'content-type', content_type.encode()),
+    ]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _disconnected(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def stream(scope, receive, send, project_id):
+    """ the ASGI application for one /projects/<pk>/events/ connection """
+    if scope['method'] != 'GET':
+        return await _respond(send, 405, b'{"detail": "Method not allowed."}')
+    headers = dict(scope['headers'])
+    try:
+        last_event_id = int(headers.get(b'last-event-id', b'0'))
+    except ValueError:
+        last_event_id = 0
+
+    # subscribe before reading the totals, so no change falls in between
+    queue, subscribed_at = await broadcaster.subscribe(project_id)
+    disconnected = asyncio.ensure_future(_disconnected(receive))
+    try:
+        current = await _database(totals)(project_id)
+        if current is None:
+            return await _respond(send, 404, b'{"detail": "Not found."}')
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+            (b'access-control-allow-origin', b'*'),
+        ]})
+        body = _message('totals', json.dumps(current))
+        missed = []
+        if last_event_id:
+            missed = await _database(backend.replay)(project_id, last_event_id, subscribed_at)
+        for event_id, _, event, data in missed:
+            body += _message(event, data, event_id)
+        replayed = {event_id for event_id, _, _, _ in missed}
+        await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+
+        while True:
+            get = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait(
+                {get, disconnected}, timeout=settings.EVENTS_KEEPALIVE,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            if disconnected in done:
+                get.cancel()
+                break
+            if get not in done:
+                get.cancel()
+                await send({'type': 'http.response.body', 'body': b': keepalive\n\n', 'more_body': True})
+                continue
+            row = get.result()
+            if row is None:
+                break
+            event_id, _, event, data = row
+            if event_id in replayed:
+                continue
+            await send({'type': 'http.response.body', 'body': _message(event, data, event_id), 'more_body': True})
+        if not disconnected.done():
+            await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        disconnected.cancel()
+        broadcaster.unsubscribe(project_id, queue)
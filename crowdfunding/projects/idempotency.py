@@ -0,0 +1,99 @@
+"""
+Idempotency-Key support for creating views.
+
+A client that may retry a POST sends an Idempotency-Key header, any
+string of up to MAX_KEY_LENGTH characters unique to that attempt. The
+first request with a key stores its response together with the write in
+one transaction. Retries with the same key and body get that response
+back, marked with an Idempotent-Replayed header, and write nothing.
+Reusing a key with a different body is answered 422.
+
+Keys are per user and kept for settings.IDEMPOTENCY_KEY_TTL seconds,
+stored as a hash of user and key next to a hash of the request body.
+Only successful responses are stored; a request that failed validation
+can be retried with the same key. Expired keys are deleted by the
+purge_expired task, which `manage.py run_workers` enqueues hourly.
+"""
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import ParseError
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from tasks.queue import task
+from .models import IdempotencyKey
+
+MAX_KEY_LENGTH = 255
+
+
+def _digest(value):
+    return hashlib.sha256(value.encode()).hexdigest()
+
+
+def _expired_before():
+    return timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+
+
+def _claim(key, fingerprint):
+    """ store `key` for this request, False when another request has it """
+    IdempotencyKey.objects.filter(key=key, created_at__lt=_expired_before()).delete()
+    try:
+        # a savepoint, so losing the race leaves the transaction usable
+        with transaction.atomic():
+            IdempotencyKey.objects.create(key=key, fingerprint=fingerprint)
+        return True
+    except IntegrityError:
+        return False
+
+
+def _replay(key, fingerprint):
+    stored = IdempotencyKey.objects.get(key=key)
+    if stored.fingerprint != fingerprint:
+        return Response(
+            {'detail': 'This Idempotency-Key was already used for a different request.'},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+    response = Response(json.loads(stored.body), status=stored.status)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(request, create):
+    """
+    create() inside a transaction, or the response it gave the first time
+    the request's Idempotency-Key was seen.
+    """
+    key = request.META.get('HTTP_IDEMPOTENCY_KEY')
+    if key is None:
+        with transaction.atomic():
+            return create()
+    if not 0 < len(key) <= MAX_KEY_LENGTH:
+        raise ParseError('Idempotency-Key must be 1 to %d characters' % MAX_KEY_LENGTH)
+
+    key = _digest('%s:%s' % (request.user.pk, key))
+    fingerprint = _digest(json.dumps(request.data, sort_keys=True, cls=JSONEncoder))
+    with transaction.atomic():
+        if _claim(key, fingerprint):
+            response = create()
+            if response.status_code >= 400:
+                # nothing to replay, release the key
+                transaction.set_rollback(True)
+                return response
+            IdempotencyKey.objects.filter(key=key).update(
+                status=response.status_code, body=json.dumps(response.data, cls=JSONEncoder)
+            )
+            return response
+    return _replay(key, fingerprint)
+
+
+@task
+def purge_expired():
+    """ delete keys older than IDEMPOTENCY_KEY_TTL, returns how many """
+    deleted, _ = IdempotencyKey.objects.filter(created_at__lt=_expired_before()).delete()
+    return deleted
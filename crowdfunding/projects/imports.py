@@ -0,0 +1,142 @@
+import csv
+import json
+from itertools import islice
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+
+from .cache import bump_versions
+from .models import Pledge, Project
+from .serializers import PledgeSerializer
+from .events import publish_totals
+from .recommendations import refresh_projects, refresh_users
+from .trending import count_pledges
+
+FORMATS = ('csv', 'ndjson')
+
+
+# stands in for a row that was not valid UTF-8
+UNDECODABLE = object()
+
+
+def _decode(lines, undecodable):
+    """ text lines from byte lines, numbering those that are not UTF-8 in `undecodable` """
+    for number, line in enumerate(lines, start=1):
+        if isinstance(line, bytes):
+            try:
+                line = line.decode('utf-8')
+            except UnicodeDecodeError:
+                undecodable.add(number)
+                line = line.decode('utf-8', 'replace')
+        yield line
+
+
+def read_rows(lines, fmt):
+    """
+    Parse an iterable of text or UTF-8 byte lines into pledge dicts. Lines
+    that are not valid NDJSON come through as strings and rows that are
+    not valid UTF-8 as UNDECODABLE, so they are reported per row.
+    """
+    undecodable = set()
+    lines = _decode(lines, undecodable)
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        # a row can span several lines when a field is quoted
+        start = 1
+        for row in reader:
+            end = reader.line_num
+            yield UNDECODABLE if any(start < number <= end for number in undecodable) else row
+            start = end
+        return
+    for number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if number in undecodable:
+            yield UNDECODABLE
+        elif not line:
+            continue
+        else:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield line
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def import_pledges(rows, supporter=None, chunk_size=1000):
+    """
+    Validate and insert pledges `chunk_size` rows at a time. Each chunk is
+    one transaction with a bulk INSERT and a single totals update for the
+    projects it touched. Rows that fail validation are reported, not fatal.
+
+    With `supporter` every pledge belongs to that user, otherwise each row
+    names its supporter by id.
+    """
+    created = 0
+    errors = []
+    for chunk in _chunks(enumerate(rows, start=1), chunk_size):
+        candidates = []
+        for number, row in chunk:
+            if row is UNDECODABLE:
+                errors.append({'row': number, 'errors': {'non_field_errors': ['Not valid UTF-8.']}})
+                continue
+            if not isinstance(row, dict):
+                errors.append({'row': number, 'errors': {'non_field_errors': ['Not a JSON object.']}})
+                continue
+            serializer = PledgeSerializer(data=row)
+            if not serializer.is_valid():
+                errors.append({'row': number, 'errors': serializer.errors})
+                continue
+            supporter_id = supporter.pk if supporter is not None else row.get('supporter')
+            candidates.append((number, serializer.validated_data, supporter_id))
+
+        project_ids = set(
+            Project.objects.filter(pk__in={data['project_id'] for _, data, _ in candidates})
+            .values_list('pk', flat=True)
+        )
+        if supporter is None:
+            supporter_ids = set(
+                get_user_model().objects.filter(
+                    pk__in={str(pk) for _, _, pk in candidates if str(pk).isdigit()}
+                ).values_list('pk', flat=True)
+            )
+        pledges = []
+        for number, data, supporter_id in candidates:
+            if data['project_id'] not in project_ids:
+                errors.append({'row': number, 'errors': {'project_id': ['Project does not exist.']}})
+                continue
+            if supporter is None:
+                if not str(supporter_id).isdigit() or int(supporter_id) not in supporter_ids:
+                    errors.append({'row': number, 'errors': {'supporter': ['User does not exist.']}})
+                    continue
+                supporter_id = int(supporter_id)
+            pledges.append(Pledge(supporter_id=supporter_id, **data))
+
+        if not pledges:
+            continue
+        touched = {pledge.project_id for pledge in pledges}
+        with transaction.atomic():
+            Pledge.objects.bulk_create(pledges)
+            # bulk_create skips the pledge signals, so do their work once per chunk
+            Project.objects.filter(pk__in=touched).recalculate_totals()
+            count_pledges(pledges)
+            publish_totals(touched)
+            # the pledge signals also rescore recommendations
+            supporters = {pledge.supporter_id for pledge in pledges}
+            for supporter_id in supporters:
+                refresh_users.enqueue(supporter_id)
+            for project_id in touched:
+                refresh_projects.enqueue(project_id)
+        bump_versions(
+            'projects', *('project:%d' % pk for pk in touched),
+            'pledges', 'users', *('user:%d' % pk for pk in supporters)
+        )
+        created += len(pledges)
+    return {'created': created, 'errors': errors}
@@ -0,0 +1,258 @@
+"""
+End-to-end load generation against a running deployment.
+
+Traffic comes from `processes` worker processes with `threads` threads
+each, every thread on its own keep-alive connection. A thread repeatedly
+picks a scenario by weight:
+
+    browse    anonymous project lists, details, shelters, search
+    login     POST api-token-auth/ as a seeded user
+    pledge    an authenticated supporter pledging to an open project
+    owner     a shelter owner reading and editing one of their projects
+
+Closed loop by default: each thread starts its next scenario as soon as
+the previous one finished. With `rps` set the load is open loop instead:
+scenarios start at a fixed overall rate and the first request of each is
+timed from its scheduled start, so a saturated server shows up as growing
+latency rather than as a quietly lower request rate.
+
+The users, projects and passwords come from seed_perf_data.
+"""
+import http.client
+import json
+import multiprocessing
+import random
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import quote, urlsplit
+
+from . import perfdata
+
+SCENARIOS = ('browse', 'login', 'pledge', 'owner')
+DEFAULT_MIX = {'browse': 70, 'login': 5, 'pledge': 15, 'owner': 10}
+SEARCH_TERMS = ['rescue', 'dog', 'vet', 'winter food', 'kitten care', 'sanctuary']
+
+
+def parse_mix(text):
+    """ 'browse=70,pledge=30' -> {'browse': 70, 'pledge': 30} """
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name not in SCENARIOS:
+            raise ValueError('Unknown scenario %r, expected one of %s' % (name, ', '.join(SCENARIOS)))
+        try:
+            mix[name] = int(weight)
+        except ValueError:
+            raise ValueError('Weight of %s must be an integer' % name)
+    if not any(mix.values()):
+        raise ValueError('The mix needs at least one scenario with a positive weight')
+    return mix
+
+
+class Client:
+    """ one keep-alive HTTP connection that records every request it makes """
+
+    def __init__(self, base_url, samples, timeout=30):
+        parts = urlsplit(base_url)
+        connection_class = (
+            http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        )
+        self.connection = connection_class(parts.netloc, timeout=timeout)
+        self.prefix = parts.path.rstrip('/')
+        self.samples = samples
+        self.token = None
+        self.tokens = {}
+        self.scheduled = None
+
+    def request(self, method, path, label, body=None):
+        headers = {'Accept': 'application/json'}
+        if body is not None:
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        if self.token:
+            headers['Authorization'] = 'Token %s' % self.token
+        # in fixed rate mode the wait for a free thread counts as latency
+        start = self.scheduled or time.perf_counter()
+        self.scheduled = None
+        try:
+            self.connection.request(method, self.prefix + path, body=body, headers=headers)
+            response = self.connection.getresponse()
+            content = response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            content, status = b'', 0
+        self.samples.append(('%s %s' % (method, label), status, time.perf_counter() - start))
+        if status and content and response.getheader('Content-Type', '').startswith('application/json'):
+            return status, json.loads(content)
+        return status, None
+
+    def login(self, email):
+        self.token = None
+        status, data = self.request(
+            'POST', '/api-token-auth/', 'api-token-auth/',
+            {'username': email, 'password': perfdata.PASSWORD}
+        )
+        if status == 200:
+            self.token = self.tokens[email] = data['token']
+        return self.token
+
+    def act_as(self, email):
+        """ use the token this thread already has for `email`, logging in if needed """
+        self.token = self.tokens.get(email)
+        return self.token or self.login(email)
+
+
+def browse(client, targets, rng):
+    client.token = None
+    client.request('GET', '/projects/?page_size=50', 'projects/')
+    client.request('GET', '/projects/%d/' % rng.choice(targets['projects']), 'projects/<pk>/')
+    if rng.random() < 0.3:
+        client.request('GET', '/shelters/', 'shelters/')
+    if rng.random() < 0.3:
+        client.request('GET', '/search/?q=%s' % quote(rng.choice(SEARCH_TERMS)), 'search/')
+
+
+def login(client, targets, rng):
+    client.login(rng.choice(targets['users']))
+
+
+def pledge(client, targets, rng):
+    if not client.act_as(rng.choice(targets['users'])):
+        return
+    project_id = rng.choice(targets['open_projects'] or targets['projects'])
+    client.request('GET', '/projects/%d/' % project_id, 'projects/<pk>/')
+    client.request('POST', '/pledges/', 'pledges/', {
+        'amount': rng.randrange(5, 200, 5), 'comment': 'Load test pledge',
+        'anonymous': rng.random() < 0.2, 'project_id': project_id,
+    })
+
+
+def owner(client, targets, rng):
+    email = rng.choice(sorted(targets['owned']))
+    if not client.act_as(email):
+        return
+    project_id, species = rng.choice(targets['owned'][email])
+    client.request('GET', '/projects/%d/' % project_id, 'projects/<pk>/')
+    client.request('PUT', '/projects/%d/' % project_id, 'projects/<pk>/', {
+        'goal': rng.randrange(100, 20000, 50), 'species': species,
+    })
+
+
+def discover(base_url):
+    """ the seeded users and projects the scenarios pick from, read through the API """
+    client = Client(base_url, [])
+    status, projects = client.request('GET', '/projects/?page_size=500', 'projects/')
+    if status != 200:
+        raise RuntimeError('GET /projects/ answered %s' % status)
+    projects = projects['results']
+    status, users = client.request('GET', '/users/?page_size=500', 'users/')
+    if status != 200:
+        raise RuntimeError('GET /users/ answered %s' % status)
+    owned = defaultdict(list)
+    for project in projects:
+        if project['owner'].startswith(perfdata.EMAIL_PREFIX):
+            owned[project['owner']].append((project['id'], project['species']))
+    targets = {
+        'users': [user['email'] for user in users['results'] if user['email'].startswith(perfdata.EMAIL_PREFIX)],
+        'projects': [project['id'] for project in projects],
+        'open_projects': [project['id'] for project in projects if project['is_open']],
+        'owned': dict(owned),
+    }
+    if not (targets['users'] and targets['projects'] and targets['owned']):
+        raise RuntimeError('No seeded data found, run seed_perf_data against the same database')
+    return targets
+
+
+def _thread(base_url, targets, mix, deadline, interval, seed, samples):
+    rng = random.Random(seed)
+    client = Client(base_url, samples)
+    names = [name for name in mix if mix[name]]
+    weights = [mix[name] for name in names]
+    scenarios = {'browse': browse, 'login': login, 'pledge': pledge, 'owner': owner}
+    next_at = time.perf_counter()
+    while time.perf_counter() < deadline:
+        if interval:
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            client.scheduled = next_at
+            next_at += interval
+        scenarios[rng.choices(names, weights)[0]](client, targets, rng)
+
+
+def _process(base_url, targets, mix, duration, threads, interval, seed, results):
+    samples = []
+    deadline = time.perf_counter() + duration
+    workers = [
+        threading.Thread(
+            target=_thread, args=(base_url, targets, mix, deadline, interval, seed * 1000 + i, samples)
+        )
+        for i in range(threads)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    results.put(samples)
+
+
+def percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def summarize(samples, elapsed):
+    by_endpoint = defaultdict(list)
+    for endpoint, status, seconds in samples:
+        by_endpoint[endpoint].append((status, seconds))
+    by_endpoint['total'] = [(status, seconds) for _, status, seconds in samples]
+
+    report = {}
+    for endpoint, rows in by_endpoint.items():
+        latencies = sorted(seconds * 1000 for _, seconds in rows)
+        errors = sum(1 for status, _ in rows if not status or status >= 400)
+        report[endpoint] = {
+            'requests': len(rows),
+            'errors': errors,
+            'error_rate': round(errors / len(rows), 4) if rows else 0,
+            'rps': round(len(rows) / elapsed, 2) if elapsed else 0,
+            'p50_ms': round(percentile(latencies, 0.5), 2) if rows else 0,
+            'p90_ms': round(percentile(latencies, 0.9), 2) if rows else 0,
+            'p99_ms': round(percentile(latencies, 0.99), 2) if rows else 0,
+            'max_ms': round(latencies[-1], 2) if rows else 0,
+        }
+    return report
+
+
+def run(base_url, mix=DEFAULT_MIX, duration=30, processes=4, threads=8, rps=None, seed=0):
+    """ drive traffic for `duration` seconds, returns the per endpoint summary """
+    targets = discover(base_url)
+    total_threads = processes * threads
+    interval = total_threads / rps if rps else None
+    results = multiprocessing.Queue()
+    workers = [
+        multiprocessing.Process(
+            target=_process,
+            args=(base_url, targets, mix, duration, threads, interval, seed + i, results)
+        )
+        for i in range(processes)
+    ]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    samples = []
+    for _ in workers:
+        samples.extend(results.get())
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    return {
+        'url': base_url,
+        'mix': mix,
+        'duration': round(elapsed, 2),
+        'processes': processes,
+        'threads': threads,
+        'target_rps': rps,
+        'endpoints': summarize(samples, elapsed),
+    }
@@ -0,0 +1,200 @@
+"""
+Time views and serializers in process against seeded data.
+
+    manage.py seed_perf_data
+    manage.py bench --output bench.json
+    manage.py bench --baseline bench.json --tolerance 0.2 --thresholds ci/bench-thresholds.json
+
+Each case runs `--warmup` times untimed and `--iterations` times timed.
+Unless --warm is given the cache is cleared before every run, so views
+are measured doing their work rather than answering from the response
+cache. The queries reported are those of the last timed run.
+
+--baseline fails when a case got slower than the baseline p50 by more
+than the tolerance, or runs more queries. --thresholds is a JSON file of
+{"case": {"p95_ms": 40, "queries": 6}} limits. Any failure exits with an
+error after the results are written.
+"""
+import json
+import platform
+import statistics
+import time
+
+import django
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.utils import timezone
+
+from crowdfunding.querybudget import QueryRecorder
+from projects import perfdata
+from projects.models import PetTag, Pledge, Project, Shelter
+from projects.serializers import PledgeSerializer, ProjectSerializer, ShelterSerializer
+from users.authentication import token_cache
+from users.models import CustomUser
+from users.serializers import UserSerializer
+
+PAGE = 50
+
+
+def view_cases(client, project, shelter, user):
+    def get(path):
+        def run():
+            response = client.get(path)
+            if response.status_code != 200:
+                raise CommandError('GET %s answered %d' % (path, response.status_code))
+            if response.streaming:
+                b''.join(response.streaming_content)
+        return run
+
+    return {
+        'view:projects': get('/projects/'),
+        'view:projects-page': get('/projects/?page_size=%d' % PAGE),
+        'view:projects-filtered': get('/projects/?is_open=true&species=dog&ordering=-date_created'),
+        'view:projects-stream': get('/projects/?stream=true'),
+        'view:project-detail': get('/projects/%d/' % project.pk),
+        'view:shelters': get('/shelters/'),
+        'view:shelter-detail': get('/shelters/%d/' % shelter.pk),
+        'view:shelter-projects': get('/%d/shelter-projects/' % shelter.pk),
+        'view:pledges-page': get('/pledges/?page_size=%d' % PAGE),
+        'view:user-pledges': get('/%d/pledges/' % user.pk),
+        'view:recommended': get('/%d/recommended/' % user.pk),
+        'view:supported-projects': get('/%d/supported-projects/' % user.pk),
+        'view:users-page': get('/users/?page_size=%d' % PAGE),
+        'view:user-detail': get('/users/%d/' % user.pk),
+        'view:petcategories': get('/petcategories/'),
+        'view:search': get('/search/?q=rescue'),
+    }
+
+
+def serializer_cases():
+    def serialize(serializer_class, queryset):
+        def run():
+            serializer_class(queryset()[:PAGE], many=True).data
+        return run
+
+    return {
+        'serializer:project': serialize(ProjectSerializer, Project.objects.with_related),
+        'serializer:pledge': serialize(
+            PledgeSerializer, lambda: Pledge.objects.select_related('supporter__profile')
+        ),
+        'serializer:shelter': serialize(
+            ShelterSerializer, lambda: Shelter.objects.select_related('owner').prefetch_related('species')
+        ),
+        'serializer:user': serialize(UserSerializer, CustomUser.objects.with_profile),
+    }
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def measure(run, iterations, warmup, warm):
+    for _ in range(warmup):
+        run()
+    timings = []
+    for _ in range(iterations):
+        if not warm:
+            cache.clear()
+            token_cache.clear()
+        with QueryRecorder() as queries:
+            start = time.perf_counter()
+            run()
+            timings.append((time.perf_counter() - start) * 1000)
+    return {
+        'iterations': iterations,
+        'queries': queries.count,
+        'min_ms': round(min(timings), 3),
+        'mean_ms': round(statistics.mean(timings), 3),
+        'p50_ms': round(percentile(timings, 0.5), 3),
+        'p95_ms': round(percentile(timings, 0.95), 3),
+        'max_ms': round(max(timings), 3),
+    }
+
+
+def regressions(results, baseline, tolerance, thresholds):
+    failures = []
+    for name, result in sorted(results.items()):
+        before = baseline.get(name)
+        if before:
+            if result['p50_ms'] > before['p50_ms'] * (1 + tolerance):
+                failures.append('%s: p50 %.3fms, baseline %.3fms' % (name, result['p50_ms'], before['p50_ms']))
+            if result['queries'] > before['queries']:
+                failures.append('%s: %d queries, baseline %d' % (name, result['queries'], before['queries']))
+        for metric, limit in thresholds.get(name, {}).items():
+            if result[metric] > limit:
+                failures.append('%s: %s %s over the limit of %s' % (name, metric, result[metric], limit))
+    return failures
+
+
+class Command(BaseCommand):
+    help = 'Time views and serializers against seed_perf_data rows and write the results as JSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument('--warm', action='store_true', help='Keep caches between runs.')
+        parser.add_argument('--only', help='Run the cases whose name contains this.')
+        parser.add_argument('--output', help='File for the JSON results, stdout by default.')
+        parser.add_argument('--baseline', help='Results of an earlier run to compare with.')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Allowed p50 slowdown against the baseline, as a fraction.')
+        parser.add_argument('--thresholds', help='JSON file of per case limits.')
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError('--iterations must be at least 1')
+        user = perfdata.seeded_users().filter(supporter_pledges__isnull=False).order_by('pk').first()
+        project = Project.objects.filter(owner__email__startswith=perfdata.EMAIL_PREFIX).order_by('pk').first()
+        shelter = Shelter.objects.filter(owner__email__startswith=perfdata.EMAIL_PREFIX).order_by('pk').first()
+        if not (user and project and shelter):
+            raise CommandError('No seeded data, run seed_perf_data first')
+
+        cases = view_cases(Client(), project, shelter, user)
+        cases.update(serializer_cases())
+        if options['only']:
+            cases = {name: run for name, run in cases.items() if options['only'] in name}
+
+        results = {}
+        for name, run in cases.items():
+            results[name] = measure(run, options['iterations'], options['warmup'], options['warm'])
+            if options['output']:
+                self.stdout.write('%-28s p50 %8.3fms  p95 %8.3fms  %3d queries' % (
+                    name, results[name]['p50_ms'], results[name]['p95_ms'], results[name]['queries']
+                ))
+
+        report = {
+            'created': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'warm': options['warm'],
+            'rows': {
+                'users': CustomUser.objects.count(),
+                'shelters': Shelter.objects.count(),
+                'projects': Project.objects.count(),
+                'pledges': Pledge.objects.count(),
+                'pettags': PetTag.objects.count(),
+            },
+            'results': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2, sort_keys=True)
+        else:
+            self.stdout.write(json.dumps(report, indent=2, sort_keys=True))
+
+        baseline = thresholds = {}
+        if options['baseline']:
+            with open(options['baseline']) as source:
+                baseline = json.load(source)['results']
+        if options['thresholds']:
+            with open(options['thresholds']) as source:
+                thresholds = json.load(source)
+        failures = regressions(results, baseline, options['tolerance'], thresholds)
+        for failure in failures:
+            self.stderr.write(failure)
+        if failures:
+            raise CommandError('%d benchmark checks failed' % len(failures))
@@ -0,0 +1,47 @@
+import sys
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from projects.imports import FORMATS, import_pledges, read_rows
+
+
+class Command(BaseCommand):
+    help = 'Bulk load pledges from a CSV or NDJSON file ("-" reads stdin).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=FORMATS, help='Defaults to the file extension.')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument(
+            '--supporter',
+            help='Email of the user every pledge belongs to, otherwise rows carry a supporter id.'
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or path.rsplit('.', 1)[-1]
+        if fmt not in FORMATS:
+            raise CommandError('Cannot tell the format of %s, pass --format' % path)
+
+        supporter = None
+        if options['supporter']:
+            try:
+                supporter = get_user_model().objects.get(email=options['supporter'])
+            except get_user_model().DoesNotExist:
+                raise CommandError('No user with email %s' % options['supporter'])
+
+        source = sys.stdin.buffer if path == '-' else open(path, 'rb')
+        try:
+            report = import_pledges(
+                read_rows(source, fmt), supporter=supporter, chunk_size=options['chunk_size']
+            )
+        finally:
+            if source is not sys.stdin.buffer:
+                source.close()
+
+        for error in report['errors']:
+            self.stderr.write('row %(row)d: %(errors)s' % error)
+        self.stdout.write(self.style.SUCCESS(
+            'Imported %d pledges, %d rows rejected' % (report['created'], len(report['errors']))
+        ))
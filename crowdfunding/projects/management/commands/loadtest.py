@@ -0,0 +1,110 @@
+import json
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import time
+from urllib.error import URLError
+from urllib.request import urlopen
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from projects import loadgen
+
+PROCFILE = os.path.join(os.path.dirname(settings.BASE_DIR), 'Procfile')
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive mixed traffic at the API from several processes and report throughput, '
+        'errors and latency per endpoint. Needs seed_perf_data rows.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', help='Deployment to load, otherwise gunicorn is started locally.')
+        parser.add_argument('--port', type=int, default=8765, help='Port for the local gunicorn.')
+        parser.add_argument('--server-workers', type=int, default=4, help='gunicorn --workers.')
+        parser.add_argument('--duration', type=float, default=30, help='Seconds of traffic.')
+        parser.add_argument('--processes', type=int, default=4)
+        parser.add_argument('--threads', type=int, default=8, help='Concurrent clients per process.')
+        parser.add_argument(
+            '--mix', default=','.join('%s=%d' % item for item in loadgen.DEFAULT_MIX.items()),
+            help='Scenario weights, from %s.' % ', '.join(loadgen.SCENARIOS)
+        )
+        parser.add_argument(
+            '--rps', type=float,
+            help='Start scenarios at this fixed rate instead of as fast as possible.'
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Also write the report as JSON to this file.')
+
+    def handle(self, *args, **options):
+        try:
+            mix = loadgen.parse_mix(options['mix'])
+        except ValueError as error:
+            raise CommandError(error)
+
+        server = None
+        url = options['url']
+        if not url:
+            url = 'http://127.0.0.1:%d' % options['port']
+            server = self.start_gunicorn(options['port'], options['server_workers'])
+        try:
+            self.wait_until_up(url, server)
+            report = loadgen.run(
+                url, mix=mix, duration=options['duration'], processes=options['processes'],
+                threads=options['threads'], rps=options['rps'], seed=options['seed']
+            )
+        except RuntimeError as error:
+            raise CommandError(error)
+        finally:
+            if server:
+                server.terminate()
+                server.wait()
+
+        self.stdout.write('%-28s %8s %7s %8s %9s %9s %9s %9s' % (
+            'endpoint', 'requests', 'errors', 'rps', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms'
+        ))
+        for endpoint, row in sorted(report['endpoints'].items(), key=lambda item: item[0] == 'total'):
+            self.stdout.write('%-28s %8d %6.2f%% %8.1f %9.1f %9.1f %9.1f %9.1f' % (
+                endpoint, row['requests'], row['error_rate'] * 100, row['rps'],
+                row['p50_ms'], row['p90_ms'], row['p99_ms'], row['max_ms']
+            ))
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2, sort_keys=True)
+
+    def web_command(self):
+        """ the web process from the Procfile, as arguments """
+        with open(PROCFILE) as procfile:
+            for line in procfile:
+                name, _, command = line.partition(':')
+                if name.strip() == 'web':
+                    return shlex.split(command)
+        raise CommandError('%s has no web process' % PROCFILE)
+
+    def start_gunicorn(self, port, workers):
+        # the web process from the Procfile, bound locally, later options win
+        command = self.web_command()
+        if not shutil.which(command[0]):
+            raise CommandError('%s is not installed, install it or pass --url' % command[0])
+        return subprocess.Popen(
+            command + [
+                '--bind', '127.0.0.1:%d' % port, '--workers', str(workers), '--log-level', 'warning',
+            ],
+            cwd=os.path.dirname(PROCFILE), env=dict(os.environ, DJANGO_DEBUG='False'), stdout=sys.stderr,
+        )
+
+    def wait_until_up(self, url, server, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if server and server.poll() is not None:
+                raise CommandError('gunicorn exited with status %d' % server.returncode)
+            try:
+                urlopen(url + '/petcategories/', timeout=2).close()
+                return
+            except (URLError, OSError):
+                time.sleep(0.2)
+        raise CommandError('%s did not answer within %d seconds' % (url, timeout))
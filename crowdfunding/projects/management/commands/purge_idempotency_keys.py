@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from projects.idempotency import purge_expired
+
+
+class Command(BaseCommand):
+    help = 'Delete Idempotency-Key records older than IDEMPOTENCY_KEY_TTL.'
+
+    def handle(self, *args, **options):
+        deleted = purge_expired()
+        self.stdout.write(self.style.SUCCESS('Deleted %d expired idempotency keys' % deleted))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from projects.recommendations import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Recompute the precomputed project recommendations of every user.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Number of users scored together.'
+        )
+
+    def handle(self, *args, **options):
+        users = rebuild(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('Rebuilt recommendations for %d users' % users))
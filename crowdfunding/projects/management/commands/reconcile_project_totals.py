@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from projects.models import Project
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the denormalized pledge totals stored on each project.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Number of projects updated per statement.'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = 0
+        updated = 0
+        while True:
+            ids = list(
+                Project.objects.filter(pk__gt=last_id)
+                .order_by('pk')
+                .values_list('pk', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            with transaction.atomic():
+                updated += Project.objects.filter(pk__in=ids).recalculate_totals()
+            last_id = ids[-1]
+        self.stdout.write(self.style.SUCCESS('Reconciled totals for %d projects' % updated))
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from projects.trending import update_rankings
+
+
+class Command(BaseCommand):
+    help = 'Compact pledge buckets and recompute the trending and leaderboard rankings.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=float,
+            help='Keep running, refreshing every this many seconds.'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            update_rankings()
+            self.stdout.write(self.style.SUCCESS('Refreshed rankings'))
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
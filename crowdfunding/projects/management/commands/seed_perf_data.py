@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from projects import perfdata
+
+
+class Command(BaseCommand):
+    help = (
+        'Bulk generate users, shelters, projects and pledges for benchmarks. '
+        'Seeded users log in as perf-user-<n>@example.com with password "%s".' % perfdata.PASSWORD
+    )
+
+    def add_arguments(self, parser):
+        for name, default in perfdata.DEFAULT_SIZES.items():
+            parser.add_argument('--%s' % name, type=int, default=default)
+        parser.add_argument('--seed', type=int, default=0, help='Same seed, same data.')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument(
+            '--clear', action='store_true',
+            help='Delete previously seeded data first, otherwise refuse to run when it exists.'
+        )
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            self.stdout.write('Deleted %d rows' % perfdata.clear())
+        elif perfdata.seeded_users().exists():
+            raise CommandError('Seeded data already exists, pass --clear to replace it')
+
+        try:
+            created = perfdata.seed(
+                options['users'], options['shelters'], options['projects'], options['pledges'],
+                seed=options['seed'], chunk_size=options['chunk_size'],
+                log=lambda step: self.stdout.write('Seeding %s' % step)
+            )
+        except ValueError as error:
+            raise CommandError(error)
+        self.stdout.write(self.style.SUCCESS(
+            'Seeded %(users)d users, %(shelters)d shelters, %(projects)d projects '
+            'and %(pledges)d pledges' % created
+        ))
@@ -0,0 +1,44 @@
+# Generated by Django 3.0.8 on 2026-10-18 06:43
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def backfill_totals(apps, schema_editor):
+    Project = apps.get_model('projects', 'Project')
+    Pledge = apps.get_model('projects', 'Pledge')
+    pledges = Pledge.objects.filter(project=OuterRef('pk')).order_by().values('project')
+    Project.objects.update(
+        amount_raised=Coalesce(Subquery(pledges.annotate(total=Sum('amount')).values('total')), 0),
+        pledge_count=Coalesce(Subquery(pledges.annotate(total=Count('pk')).values('total')), 0),
+        unique_supporter_count=Coalesce(Subquery(
+            pledges.annotate(total=Count('supporter', distinct=True)).values('total')
+        ), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0003_shelter_species'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='amount_raised',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='pledge_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='unique_supporter_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_totals, migrations.RunPython.noop),
+    ]
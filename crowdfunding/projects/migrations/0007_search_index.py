@@ -0,0 +1,47 @@
+# Generated by Django 3.0.8 on 2026-10-18 07:10
+
+from django.db import migrations
+
+# rows are keyed by object_id * 2 + kind, 0 for projects and 1 for shelters
+
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE projects_search USING fts5(title, body, prefix='2 3')",
+    "INSERT INTO projects_search (rowid, title, body) "
+    "SELECT id * 2, title, description FROM projects_project",
+    "INSERT INTO projects_search (rowid, title, body) "
+    "SELECT id * 2 + 1, name, description || ' ' || address FROM projects_shelter",
+]
+
+POSTGRES_FORWARD = [
+    "CREATE TABLE projects_search (id bigint PRIMARY KEY, title text NOT NULL, document tsvector NOT NULL)",
+    "CREATE INDEX projects_search_document ON projects_search USING GIN (document)",
+    "INSERT INTO projects_search (id, title, document) "
+    "SELECT id * 2, title, setweight(to_tsvector('english', title), 'A') "
+    "|| setweight(to_tsvector('english', description), 'B') FROM projects_project",
+    "INSERT INTO projects_search (id, title, document) "
+    "SELECT id * 2 + 1, name, setweight(to_tsvector('english', name), 'A') "
+    "|| setweight(to_tsvector('english', description || ' ' || address), 'B') FROM projects_shelter",
+]
+
+
+def create_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    statements = {'sqlite': SQLITE_FORWARD, 'postgresql': POSTGRES_FORWARD}.get(vendor, [])
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor in ('sqlite', 'postgresql'):
+        schema_editor.execute('DROP TABLE projects_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0006_recommendation'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
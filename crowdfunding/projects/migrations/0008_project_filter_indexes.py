@@ -0,0 +1,28 @@
+# Generated by Django 3.0.8 on 2026-10-18 06:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0007_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(fields=['is_open', 'date_created'], name='project_open_created'),
+        ),
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(fields=['owner', 'date_created'], name='project_owner_created'),
+        ),
+        # the auto-created through table only indexes (project_id, pettag_id);
+        # this one serves species filters without touching the project rows
+        migrations.RunSQL(
+            'CREATE INDEX project_species_pettag_project '
+            'ON projects_project_species (pettag_id, project_id)',
+            'DROP INDEX project_species_pettag_project',
+        ),
+    ]
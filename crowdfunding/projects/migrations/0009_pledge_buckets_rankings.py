@@ -0,0 +1,49 @@
+# Generated by Django 3.0.8 on 2026-10-18 07:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0008_project_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Ranking',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=20)),
+                ('window', models.CharField(max_length=20)),
+                ('rank', models.IntegerField()),
+                ('object_id', models.IntegerField()),
+                ('amount', models.BigIntegerField()),
+                ('pledges', models.IntegerField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'unique_together': {('kind', 'window', 'rank')},
+            },
+        ),
+        migrations.CreateModel(
+            name='PledgeBucket',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.DateTimeField()),
+                ('width', models.IntegerField()),
+                ('amount', models.BigIntegerField(default=0)),
+                ('pledges', models.IntegerField(default=0)),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pledge_buckets', to='projects.Project')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='pledgebucket',
+            index=models.Index(fields=['start'], name='pledgebucket_start'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='pledgebucket',
+            unique_together={('project', 'start', 'width')},
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.0.8 on 2026-10-18 07:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0010_idempotency_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProjectEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('project_id', models.IntegerField()),
+                ('event', models.CharField(max_length=20)),
+                ('data', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='projectevent',
+            index=models.Index(fields=['project_id', 'id'], name='projectevent_project'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.8 on 2026-10-18 08:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0011_project_events'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='shelter',
+            name='charityregister',
+            field=models.BigIntegerField(),
+        ),
+    ]
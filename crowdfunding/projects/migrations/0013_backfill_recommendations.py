@@ -0,0 +1,31 @@
+# Generated by Django 3.0.8 on 2026-10-18 08:30
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, migrations
+
+
+def queue_rebuild(apps, schema_editor):
+    # 0006 created the table empty; the task workers fill it with the current scoring code
+    from projects.recommendations import rebuild
+
+    if schema_editor.connection.alias != DEFAULT_DB_ALIAS:
+        # the queue, like the rows it rebuilds, lives on the primary
+        return
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    if not User.objects.exists():
+        return
+    # through the queue, so a rebuild already waiting absorbs this one
+    rebuild.enqueue()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('projects', '0012_shelter_charityregister'),
+        ('tasks', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(queue_rebuild, migrations.RunPython.noop),
+    ]
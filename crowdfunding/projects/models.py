@@ -1,5 +1,14 @@
+import threading
+from contextlib import contextmanager
+
 from django.contrib.auth import get_user_model
 from django.db import models
+from django.db.models import Count, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from .cache import bump_versions
 # from users.models import get_shelter
 
 
@@ -25,10 +34,43 @@ class Shelter(models.Model):
         on_delete=models.CASCADE,
         related_name='shelter'
     )
-    
+    updated_at = models.DateTimeField(auto_now=True)
+
     def __str__(self):
         return self.name
 
+class ProjectQuerySet(models.QuerySet):
+
+    def with_related(self):
+        """ load everything ProjectSerializer reads in a fixed number of queries """
+        return self.select_related('owner__shelter').prefetch_related(
+            'species',
+            models.Prefetch(
+                'pledges',
+                queryset=Pledge.objects.select_related('supporter__profile')
+            )
+        )
+
+    def recalculate_totals(self):
+        """ rebuild the denormalized pledge totals from the pledges table """
+        pledges = Pledge.objects.filter(project=OuterRef('pk')).order_by().values('project')
+        return self.update(
+            amount_raised=Coalesce(Subquery(
+                pledges.annotate(total=Sum('amount')).values('total')
+            ), 0),
+            pledge_count=Coalesce(Subquery(
+                pledges.annotate(total=Count('pk')).values('total')
+            ), 0),
+            unique_supporter_count=Coalesce(Subquery(
+                pledges.annotate(total=Count('supporter', distinct=True)).values('total')
+            ), 0),
+            updated_at=timezone.now(),
+        )
+
+    def delete(self):
+        with deleting():
+            return super().delete()
+
 class Project(models.Model):
     title = models.CharField(max_length=200)
     description = models.TextField()
@@ -46,6 +88,24 @@ class Project(models.Model):
         related_name = "projects",
         related_query_name = "project"
     )
+    # denormalized from pledges, kept current by the signals below
+    amount_raised = models.BigIntegerField(default=0, editable=False)
+    pledge_count = models.IntegerField(default=0, editable=False)
+    unique_supporter_count = models.IntegerField(default=0, editable=False)
+    # also touched when pledges, the owner's shelter or a species tag change
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = ProjectQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['is_open', 'date_created'], name='project_open_created'),
+            models.Index(fields=['owner', 'date_created'], name='project_owner_created'),
+        ]
+
+    def delete(self, *args, **kwargs):
+        with deleting():
+            return super().delete(*args, **kwargs)
 
 class Pledge(models.Model):
     amount = models.IntegerField()
@@ -60,4 +120,255 @@ class Pledge(models.Model):
         get_user_model(),
         on_delete=models.CASCADE,
         related_name='supporter_pledges'
-    )
\ No newline at end of file
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+
+class Recommendation(models.Model):
+    # precomputed by projects.recommendations, read by RecommendedProjects
+    user = models.ForeignKey(
+        get_user_model(),
+        on_delete=models.CASCADE,
+        related_name='recommendations'
+    )
+    project = models.ForeignKey(
+        'Project',
+        on_delete=models.CASCADE,
+        related_name='recommendations'
+    )
+    score = models.FloatField()
+
+    class Meta:
+        unique_together = ('user', 'project')
+        indexes = [models.Index(fields=['user', '-score'], name='recommendation_user_score')]
+
+class PledgeBucket(models.Model):
+    # pledges to a project within [start, start + width seconds), see projects.trending
+    project = models.ForeignKey(
+        'Project',
+        on_delete=models.CASCADE,
+        related_name='pledge_buckets'
+    )
+    start = models.DateTimeField()
+    width = models.IntegerField()
+    amount = models.BigIntegerField(default=0)
+    pledges = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('project', 'start', 'width')
+        indexes = [models.Index(fields=['start'], name='pledgebucket_start')]
+
+class Ranking(models.Model):
+    # top projects and shelters by pledges per window, refreshed by projects.trending
+    kind = models.CharField(max_length=20)
+    window = models.CharField(max_length=20)
+    rank = models.IntegerField()
+    object_id = models.IntegerField()
+    amount = models.BigIntegerField()
+    pledges = models.IntegerField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('kind', 'window', 'rank')
+
+class IdempotencyKey(models.Model):
+    # the response to a request sent with an Idempotency-Key, see projects.idempotency
+    key = models.CharField(max_length=64, unique=True)
+    fingerprint = models.CharField(max_length=64)
+    status = models.PositiveSmallIntegerField(null=True)
+    body = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+class ProjectEvent(models.Model):
+    # a live update for /projects/<pk>/events/, see projects.events
+    project_id = models.IntegerField()
+    event = models.CharField(max_length=20)
+    data = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['project_id', 'id'], name='projectevent_project')]
+
+
+def _supporter_has_other_pledges(pledge):
+    return Pledge.objects.filter(
+        project_id=pledge.project_id,
+        supporter_id=pledge.supporter_id
+    ).exclude(pk=pledge.pk).exists()
+
+@receiver(post_save, sender=Pledge)
+def add_pledge_to_totals(sender, instance, created, **kwargs):
+    if not created:
+        return
+    new_supporter = 0 if _supporter_has_other_pledges(instance) else 1
+    Project.objects.filter(pk=instance.project_id).update(
+        amount_raised=F('amount_raised') + instance.amount,
+        pledge_count=F('pledge_count') + 1,
+        unique_supporter_count=F('unique_supporter_count') + new_supporter,
+        updated_at=timezone.now()
+    )
+
+# projects and supporters being deleted, whose pledges go with them
+_deleting = threading.local()
+
+def _deletions():
+    if not hasattr(_deleting, 'projects'):
+        _deleting.projects, _deleting.supporters, _deleting.recalculate = set(), set(), set()
+        _deleting.depth = 0
+    return _deleting
+
+@contextmanager
+def deleting():
+    """
+    Wrap a delete that can cascade to projects or supporters. A delete that
+    fails never sends the post_delete that drops its markers, so they are
+    dropped here once the outermost delete ends, whichever way it ends.
+    """
+    deletions = _deletions()
+    deletions.depth += 1
+    try:
+        yield
+    finally:
+        deletions.depth -= 1
+        if not deletions.depth:
+            deletions.projects.clear()
+            deletions.supporters.clear()
+            deletions.recalculate.clear()
+
+def project_being_deleted(project_id):
+    return project_id in _deletions().projects
+
+@receiver(pre_delete, sender=Project)
+def start_project_delete(sender, instance, **kwargs):
+    _deletions().projects.add(instance.pk)
+
+@receiver(post_delete, sender=Project)
+def end_project_delete(sender, instance, **kwargs):
+    _deletions().projects.discard(instance.pk)
+
+@receiver(pre_delete, sender=get_user_model())
+def start_supporter_delete(sender, instance, **kwargs):
+    _deletions().supporters.add(instance.pk)
+
+@receiver(post_delete, sender=get_user_model())
+def end_supporter_delete(sender, instance, **kwargs):
+    deletions = _deletions()
+    deletions.supporters.discard(instance.pk)
+    if not deletions.supporters and deletions.recalculate:
+        # once for every project the deleted supporters had pledged to
+        Project.objects.filter(pk__in=deletions.recalculate).recalculate_totals()
+        deletions.recalculate.clear()
+
+@receiver(post_delete, sender=Pledge)
+def remove_pledge_from_totals(sender, instance, **kwargs):
+    deletions = _deletions()
+    if project_being_deleted(instance.project_id):
+        return
+    if instance.supporter_id in deletions.supporters:
+        deletions.recalculate.add(instance.project_id)
+        return
+    lost_supporter = 0 if _supporter_has_other_pledges(instance) else 1
+    Project.objects.filter(pk=instance.project_id).update(
+        amount_raised=F('amount_raised') - instance.amount,
+        pledge_count=F('pledge_count') - 1,
+        unique_supporter_count=F('unique_supporter_count') - lost_supporter,
+        updated_at=timezone.now()
+    )
+
+
+# Keep updated_at honest for payloads that embed other models
+
+@receiver(post_save, sender=Shelter)
+@receiver(post_delete, sender=Shelter)
+def touch_shelter_projects(sender, instance, **kwargs):
+    Project.objects.filter(owner_id=instance.owner_id).update(updated_at=timezone.now())
+
+@receiver(post_save, sender='users.Profile')
+def touch_supported_projects(sender, instance, created, **kwargs):
+    # pledges show the supporter's preferred name
+    if created:
+        return
+    Project.objects.filter(pledges__supporter_id=instance.user_id).update(updated_at=timezone.now())
+
+@receiver(post_save, sender=get_user_model())
+def touch_owned_projects(sender, instance, created, update_fields=None, **kwargs):
+    # projects show the owner's email
+    if created or (update_fields is not None and 'email' not in update_fields):
+        return
+    Project.objects.filter(owner_id=instance.pk).update(updated_at=timezone.now())
+
+@receiver(post_save, sender=PetTag)
+@receiver(pre_delete, sender=PetTag)
+def touch_tagged_objects(sender, instance, created=False, **kwargs):
+    if created:
+        return
+    Project.objects.filter(species=instance).update(updated_at=timezone.now())
+    Shelter.objects.filter(species=instance).update(updated_at=timezone.now())
+
+
+# Response cache invalidation
+
+@receiver(post_save, sender=Project)
+@receiver(post_delete, sender=Project)
+def expire_project_responses(sender, instance, **kwargs):
+    bump_versions('projects', 'project:%d' % instance.pk)
+
+@receiver(post_save, sender=Pledge)
+@receiver(post_delete, sender=Pledge)
+def expire_pledge_responses(sender, instance, **kwargs):
+    bump_versions(
+        'projects', 'project:%d' % instance.project_id,
+        'pledges', 'users', 'user:%d' % instance.supporter_id
+    )
+
+@receiver(post_save, sender=Shelter)
+@receiver(post_delete, sender=Shelter)
+def expire_shelter_responses(sender, instance, **kwargs):
+    # project payloads embed the owner's shelter, and users show is_owner
+    project_ids = Project.objects.filter(owner_id=instance.owner_id).values_list('pk', flat=True)
+    bump_versions(
+        'shelters', 'projects', *('project:%d' % pk for pk in project_ids),
+        'users', 'user:%d' % instance.owner_id
+    )
+
+@receiver(post_save, sender='users.Profile')
+def expire_supporter_responses(sender, instance, created, **kwargs):
+    bump_versions('users', 'user:%d' % instance.user_id)
+    if created:
+        return
+    # pledges show the supporter's preferred name, in project payloads too
+    project_ids = Pledge.objects.filter(supporter_id=instance.user_id).values_list('project_id', flat=True)
+    project_ids = set(project_ids)
+    if project_ids:
+        bump_versions('pledges', 'projects', *('project:%d' % pk for pk in project_ids))
+
+@receiver(post_save, sender=get_user_model())
+@receiver(post_delete, sender=get_user_model())
+def expire_user_responses(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        # a login changes nothing a payload shows
+        return
+    bump_versions('users', 'user:%d' % instance.pk)
+
+@receiver(post_save, sender=get_user_model())
+def expire_owner_responses(sender, instance, created, update_fields=None, **kwargs):
+    # project payloads show the owner's email
+    if created or (update_fields is not None and 'email' not in update_fields):
+        return
+    project_ids = list(Project.objects.filter(owner_id=instance.pk).values_list('pk', flat=True))
+    if project_ids:
+        bump_versions('projects', *('project:%d' % pk for pk in project_ids))
+
+@receiver(post_save, sender=PetTag)
+@receiver(pre_delete, sender=PetTag)
+def expire_pettag_responses(sender, instance, created=False, **kwargs):
+    if created:
+        # nothing refers to a brand new tag yet
+        bump_versions('petcategories')
+        return
+    project_ids = instance.projects.values_list('pk', flat=True)
+    user_ids = instance.liked_by.values_list('user_id', flat=True)
+    bump_versions(
+        'petcategories', 'shelters', 'projects',
+        *('project:%d' % pk for pk in project_ids),
+        'users', *('user:%d' % pk for pk in user_ids)
+    )
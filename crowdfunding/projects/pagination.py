@@ -0,0 +1,24 @@
+from rest_framework.pagination import CursorPagination
+
+
+class OptInCursorPagination(CursorPagination):
+    """
+    Keyset pagination on the primary key. Clients opt in by sending
+    `?page_size=` or following a `?cursor=` link; requests without either
+    still get the plain, unpaginated list.
+    """
+    ordering = 'id'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if self.cursor_query_param not in params and self.page_size_query_param not in params:
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+
+class RecommendationPagination(OptInCursorPagination):
+    # RecommendedProjects annotates each project with its score
+    ordering = ('-score', 'id')
@@ -0,0 +1,168 @@
+"""
+Synthetic data for benchmarks and load tests.
+
+seed() bulk inserts users with profiles, shelters, projects and pledges
+from a seeded random generator, so the same options always produce the
+same rows. Every seeded user is `perf-user-<n>@example.com` with the
+password PASSWORD, which is how the benchmark and load generator log in.
+
+bulk_create skips signals, so the totals, search index, recommendations
+and cached responses are brought up to date at the end.
+"""
+import random
+from datetime import datetime, timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+
+from users.models import CustomUser, Profile
+from .cache import bump_versions
+from .models import PetTag, Pledge, Project, Shelter
+from .recommendations import refresh_for_users
+from .search import index_object
+
+PASSWORD = 'perf-password'
+EMAIL = 'perf-user-%d@example.com'
+EMAIL_PREFIX = 'perf-user-'
+SPECIES = ['dog', 'cat', 'rabbit', 'bird', 'horse', 'guinea pig', 'ferret', 'turtle']
+WORDS = (
+    'rescue shelter foster home food vet surgery kennel care adoption senior puppy kitten '
+    'transport medicine winter blankets vaccination desexing rehabilitation sanctuary'
+).split()
+# fixed so that seeded rows do not depend on the day they were created
+EPOCH = timezone.make_aware(datetime(2020, 7, 1))
+
+DEFAULT_SIZES = {'users': 1000, 'shelters': 50, 'projects': 500, 'pledges': 10000}
+
+
+def _text(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def _chunks(total, size):
+    for start in range(0, total, size):
+        yield range(start, min(start + size, total))
+
+
+def seeded_users():
+    return CustomUser.objects.filter(email__startswith=EMAIL_PREFIX)
+
+
+def clear():
+    """ delete previously seeded users; everything else they own cascades """
+    return seeded_users().delete()[0]
+
+
+def seed(users, shelters, projects, pledges, seed=0, chunk_size=1000, log=None):
+    """ insert the requested number of rows, returns the counts created """
+    if shelters > users:
+        raise ValueError('Every shelter needs its own owner, so shelters <= users')
+    if projects and not shelters:
+        raise ValueError('Projects need at least one shelter to own them')
+    rng = random.Random(seed)
+    log = log or (lambda message: None)
+    password = make_password(PASSWORD)
+
+    with transaction.atomic():
+        tags = [PetTag.objects.get_or_create(petspecies=name)[0] for name in SPECIES]
+
+        log('users')
+        CustomUser.objects.bulk_create(
+            (CustomUser(email=EMAIL % i, password=password, date_joined=EPOCH) for i in range(users))
+        )
+        user_ids = list(seeded_users().order_by('pk').values_list('pk', flat=True))
+        Profile.objects.bulk_create(
+            (
+                Profile(
+                    user_id=user_id, preferredname='Perf %d' % i, bio=_text(rng, 8),
+                    profile_pic='https://example.com/users/%d.png' % i
+                )
+                for i, user_id in enumerate(user_ids)
+            )
+        )
+        profile_ids = Profile.objects.filter(
+            user__email__startswith=EMAIL_PREFIX
+        ).order_by('pk').values_list('pk', flat=True)
+        Profile.petlikes.through.objects.bulk_create(
+            (
+                Profile.petlikes.through(profile_id=profile_id, pettag=tag)
+                for profile_id in profile_ids
+                for tag in rng.sample(tags, rng.randint(0, 3))
+            )
+        )
+
+        log('shelters')
+        owner_ids = user_ids[:shelters]
+        Shelter.objects.bulk_create(
+            (
+                Shelter(
+                    name='%s shelter %d' % (rng.choice(WORDS).title(), i), description=_text(rng, 20),
+                    address='%d Example Street' % i, charityregister=100000 + i,
+                    is_approved=rng.random() < 0.8, owner_id=owner_id
+                )
+                for i, owner_id in enumerate(owner_ids)
+            )
+        )
+        seeded_shelters = list(Shelter.objects.filter(owner_id__in=owner_ids).order_by('pk'))
+        Shelter.species.through.objects.bulk_create(
+            (
+                Shelter.species.through(shelter=shelter, pettag=tag)
+                for shelter in seeded_shelters
+                for tag in rng.sample(tags, rng.randint(1, 3))
+            )
+        )
+
+        log('projects')
+        Project.objects.bulk_create(
+            (
+                Project(
+                    title='%s for %s' % (_text(rng, 3).capitalize(), rng.choice(SPECIES)),
+                    description=_text(rng, 40), goal=rng.randrange(100, 20000, 50),
+                    image='https://example.com/projects/%d.png' % i, is_open=rng.random() < 0.7,
+                    date_created=EPOCH - timedelta(minutes=rng.randrange(365 * 24 * 60)),
+                    owner_id=rng.choice(owner_ids)
+                )
+                for i in range(projects)
+            )
+        )
+        seeded_projects = list(Project.objects.filter(owner_id__in=owner_ids).order_by('pk'))
+        Project.species.through.objects.bulk_create(
+            (
+                Project.species.through(project=project, pettag=tag)
+                for project in seeded_projects
+                for tag in rng.sample(tags, rng.randint(1, 2))
+            )
+        )
+
+        log('pledges')
+        project_ids = [project.pk for project in seeded_projects]
+        for chunk in _chunks(pledges if project_ids else 0, chunk_size):
+            Pledge.objects.bulk_create(
+                Pledge(
+                    amount=rng.randrange(5, 500, 5), comment=_text(rng, 5),
+                    anonymous=rng.random() < 0.2, project_id=rng.choice(project_ids),
+                    supporter_id=rng.choice(user_ids)
+                )
+                for _ in chunk
+            )
+
+        log('totals and search index')
+        seeded = Project.objects.filter(owner_id__in=owner_ids)
+        seeded.recalculate_totals()
+        for project in seeded.iterator():
+            index_object(project)
+        for shelter in seeded_shelters:
+            index_object(shelter)
+
+    log('recommendations')
+    for start in range(0, len(user_ids), 500):
+        refresh_for_users(user_ids[start:start + 500])
+    bump_versions(
+        'projects', 'shelters', 'pledges', 'users', 'petcategories', 'rankings',
+        *('project:%d' % pk for pk in project_ids)
+    )
+    return {
+        'users': len(user_ids), 'shelters': len(seeded_shelters),
+        'projects': len(project_ids), 'pledges': pledges if project_ids else 0,
+    }
@@ -0,0 +1,92 @@
+"""
+An in-process snapshot of the PetTag table.
+
+Species names are submitted with every shelter, project and user write
+and listed by GET /petcategories/. The table is tiny and nearly never
+changes, so each process keeps all of it in memory and resolves names
+from there instead of running a query per name.
+
+The snapshot is tagged with the 'petcategories' response cache version,
+which the PetTag signal receivers in models.py bump on every change, so
+it is reloaded on the first use after a tag is added, renamed or
+deleted. A name it does not know is still looked up in the database
+before it is rejected, in case the tag is newer than the version this
+process has seen; a hit there drops the snapshot.
+"""
+from collections import namedtuple
+
+from rest_framework import serializers
+from rest_framework.relations import MANY_RELATION_KWARGS
+
+from .cache import get_versions
+from .models import PetTag
+
+RESOURCE = 'petcategories'
+
+Snapshot = namedtuple('Snapshot', 'version rows by_slug')
+
+_snapshot = None
+
+
+def snapshot():
+    """ the current Snapshot, one cache read, and one query after a change """
+    global _snapshot
+    version, = get_versions([RESOURCE])
+    current = _snapshot
+    if current is None or current.version != version:
+        rows = list(PetTag.objects.order_by('pk').values('id', 'petspecies'))
+        by_slug = {}
+        for row in rows:
+            by_slug.setdefault(row['petspecies'], []).append(row['id'])
+        # replaced whole, so a thread never sees a half built snapshot
+        current = _snapshot = Snapshot(version, rows, by_slug)
+    return current
+
+
+def forget():
+    global _snapshot
+    _snapshot = None
+
+
+class CachedManyRelatedField(serializers.ManyRelatedField):
+    """ resolves every name in a list against a single snapshot """
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+        current = snapshot()
+        return [self.child_relation.resolve(current, item) for item in data]
+
+
+class CachedSlugRelatedField(serializers.SlugRelatedField):
+    """ SlugRelatedField for PetTag.petspecies that reads the snapshot instead of the database """
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('slug_field', 'petspecies')
+        kwargs.setdefault('queryset', PetTag.objects.all())
+        super().__init__(**kwargs)
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return CachedManyRelatedField(**list_kwargs)
+
+    def to_internal_value(self, data):
+        return self.resolve(snapshot(), data)
+
+    def resolve(self, current, data):
+        ids = current.by_slug.get(data) if isinstance(data, str) else None
+        if ids is None:
+            # raises for an unknown name, anything found is newer than the snapshot
+            tag = super().to_internal_value(data)
+            forget()
+            return tag
+        if len(ids) > 1:
+            # as SlugRelatedField does for a name that matches several rows
+            self.fail('invalid')
+        return PetTag(pk=ids[0], petspecies=data)
@@ -0,0 +1,180 @@
+"""
+Ranked project recommendations, precomputed into the Recommendation table.
+
+A project is a candidate for a user when it is open and shares at least
+one species with the user's pet likes. Its score adds up:
+
+  * the number of shared species,
+  * how close the project is to its funding goal,
+  * how recently it was created,
+  * how much the user has pledged to projects with the same species.
+
+The signals at the bottom keep the table current as profiles, projects
+and pledges change, through batched tasks run by `manage.py run_workers`;
+`manage.py rebuild_recommendations` recomputes it, and migration 0013
+queues the same rebuild for databases that had users before the table.
+"""
+from collections import Counter, defaultdict
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from tasks.queue import task
+from users.models import Profile
+from .models import Pledge, Project, Recommendation
+
+OVERLAP_WEIGHT = 1.0
+PROGRESS_WEIGHT = 0.5
+RECENCY_WEIGHT = 0.5
+HISTORY_WEIGHT = 1.0
+# days after which the recency bonus has halved
+RECENCY_HALF_LIFE = 30
+
+
+def progress(amount_raised, goal):
+    if goal <= 0:
+        return 1.0
+    return min(amount_raised / goal, 1.0)
+
+
+def score(liked, history, species, amount_raised, goal, date_created, now):
+    age_days = max((now - date_created).total_seconds(), 0) / 86400
+    pledged_total = sum(history.values())
+    return (
+        OVERLAP_WEIGHT * len(species & liked)
+        + PROGRESS_WEIGHT * progress(amount_raised, goal)
+        + RECENCY_WEIGHT / (1 + age_days / RECENCY_HALF_LIFE)
+        + HISTORY_WEIGHT * sum(history[tag] for tag in species) / (1 + pledged_total)
+    )
+
+
+def _compute(user_ids, project_ids=None):
+    """ Recommendation rows for `user_ids`, optionally limited to `project_ids` """
+    likes = defaultdict(set)
+    for user_id, tag_id in Profile.petlikes.through.objects.filter(
+        profile__user_id__in=user_ids
+    ).values_list('profile__user_id', 'pettag_id'):
+        likes[user_id].add(tag_id)
+    if not likes:
+        return []
+
+    history = defaultdict(Counter)
+    for user_id, tag_id in Pledge.objects.filter(
+        supporter_id__in=likes, project__species__isnull=False
+    ).values_list('supporter_id', 'project__species'):
+        history[user_id][tag_id] += 1
+
+    all_liked = set().union(*likes.values())
+    candidates = Project.objects.filter(is_open=True, species__in=all_liked)
+    if project_ids is not None:
+        candidates = candidates.filter(pk__in=project_ids)
+    projects = {
+        row['pk']: row for row in candidates.distinct().values(
+            'pk', 'goal', 'amount_raised', 'date_created'
+        )
+    }
+    species = defaultdict(set)
+    for project_id, tag_id in Project.species.through.objects.filter(
+        project_id__in=projects
+    ).values_list('project_id', 'pettag_id'):
+        species[project_id].add(tag_id)
+
+    now = timezone.now()
+    rows = []
+    for user_id, liked in likes.items():
+        for project_id, project in projects.items():
+            if not species[project_id] & liked:
+                continue
+            rows.append(Recommendation(
+                user_id=user_id,
+                project_id=project_id,
+                score=score(
+                    liked, history[user_id], species[project_id],
+                    project['amount_raised'], project['goal'], project['date_created'], now
+                )
+            ))
+    return rows
+
+
+def refresh_for_users(user_ids):
+    user_ids = list(user_ids)
+    rows = _compute(user_ids)
+    with transaction.atomic():
+        Recommendation.objects.filter(user_id__in=user_ids).delete()
+        Recommendation.objects.bulk_create(rows)
+
+
+def refresh_for_projects(project_ids):
+    project_ids = list(project_ids)
+    user_ids = Profile.objects.filter(
+        petlikes__project__in=project_ids
+    ).values_list('user_id', flat=True).distinct()
+    rows = _compute(list(user_ids), project_ids)
+    with transaction.atomic():
+        Recommendation.objects.filter(project_id__in=project_ids).delete()
+        Recommendation.objects.bulk_create(rows)
+
+
+@task
+def rebuild(batch_size=500):
+    """ recompute every user's recommendations, `batch_size` users at a time """
+    last_id = 0
+    users = 0
+    while True:
+        ids = list(
+            get_user_model().objects.filter(pk__gt=last_id)
+            .order_by('pk')
+            .values_list('pk', flat=True)[:batch_size]
+        )
+        if not ids:
+            return users
+        refresh_for_users(ids)
+        users += len(ids)
+        last_id = ids[-1]
+
+
+# Keep the table current
+
+@task(batch=True)
+def refresh_users(calls):
+    refresh_for_users({user_id for user_id, in calls})
+
+@task(batch=True)
+def refresh_projects(calls):
+    refresh_for_projects({project_id for project_id, in calls})
+
+@receiver(m2m_changed, sender=Profile.petlikes.through)
+def petlikes_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        refresh_users.enqueue(instance.user_id)
+    elif pk_set:
+        for user_id in Profile.objects.filter(pk__in=pk_set).values_list('user_id', flat=True):
+            refresh_users.enqueue(user_id)
+
+@receiver(post_save, sender=Project)
+def project_saved(sender, instance, **kwargs):
+    refresh_projects.enqueue(instance.pk)
+
+@receiver(m2m_changed, sender=Project.species.through)
+def project_species_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        refresh_projects.enqueue(instance.pk)
+    elif pk_set:
+        for project_id in pk_set:
+            refresh_projects.enqueue(project_id)
+
+@receiver(post_save, sender=Pledge)
+def pledge_saved(sender, instance, created, **kwargs):
+    if not created:
+        return
+    # the project's progress moved for everyone, once per project however many pledges come in
+    refresh_projects.enqueue(instance.project_id)
+    # the supporter's history changed, rescore everything for them
+    refresh_users.enqueue(instance.supporter_id)
@@ -0,0 +1,141 @@
+"""
+Full-text search over projects and shelters.
+
+The index lives in the `projects_search` table created by migration
+0007: an FTS5 virtual table on SQLite, a tsvector column with a GIN
+index on PostgreSQL. Each row is keyed by `object_id * 2 + kind`, so a
+project and a shelter never collide and a row is replaced by key.
+
+Saves and deletes reach the index through the batched `reindex` task.
+"""
+import re
+
+from django.db import connection
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from tasks.queue import task
+from .models import Project, Shelter
+
+PROJECT, SHELTER = 0, 1
+KINDS = {'project': PROJECT, 'shelter': SHELTER}
+KIND_NAMES = {PROJECT: 'project', SHELTER: 'shelter'}
+
+
+class SearchUnavailable(Exception):
+    pass
+
+
+def _key(kind, object_id):
+    return object_id * 2 + kind
+
+
+def _document(instance):
+    if isinstance(instance, Project):
+        return PROJECT, instance.title, instance.description
+    return SHELTER, instance.name, '%s %s' % (instance.description, instance.address)
+
+
+def index_object(instance):
+    kind, title, body = _document(instance)
+    key = _key(kind, instance.pk)
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('DELETE FROM projects_search WHERE rowid = %s', [key])
+            cursor.execute(
+                'INSERT INTO projects_search (rowid, title, body) VALUES (%s, %s, %s)',
+                [key, title, body]
+            )
+        elif connection.vendor == 'postgresql':
+            cursor.execute(
+                "INSERT INTO projects_search (id, title, document) VALUES "
+                "(%s, %s, setweight(to_tsvector('english', %s), 'A') "
+                "|| setweight(to_tsvector('english', %s), 'B')) "
+                "ON CONFLICT (id) DO UPDATE SET title = EXCLUDED.title, document = EXCLUDED.document",
+                [key, title, title, body]
+            )
+
+
+def remove_object(instance):
+    kind, _, _ = _document(instance)
+    _remove(kind, instance.pk)
+
+
+def _remove(kind, object_id):
+    if connection.vendor not in ('sqlite', 'postgresql'):
+        return
+    key_column = 'rowid' if connection.vendor == 'sqlite' else 'id'
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'DELETE FROM projects_search WHERE %s = %%s' % key_column,
+            [_key(kind, object_id)]
+        )
+
+
+def _terms(query):
+    return re.findall(r'\w+', query.lower())
+
+
+def search(query, kind=None, limit=20, offset=0):
+    """
+    Ranked matches for `query`, every term matching as a prefix. Returns
+    dicts with type, id, title and rank (higher is better).
+    """
+    terms = _terms(query)
+    if not terms:
+        return []
+    kind_filter = ''
+    params = []
+    if connection.vendor == 'sqlite':
+        # the phrase quotes keep FTS5 operators in user input literal
+        params.append(' '.join('"%s"*' % term for term in terms))
+        if kind is not None:
+            kind_filter = 'AND rowid %% 2 = %d' % KINDS[kind]
+        sql = (
+            'SELECT rowid, title, -bm25(projects_search, 10.0, 1.0) AS score '
+            'FROM projects_search WHERE projects_search MATCH %%s %s '
+            'ORDER BY score DESC, rowid LIMIT %%s OFFSET %%s' % kind_filter
+        )
+    elif connection.vendor == 'postgresql':
+        params.append(' & '.join('%s:*' % term for term in terms))
+        if kind is not None:
+            kind_filter = 'AND id %% 2 = %d' % KINDS[kind]
+        sql = (
+            "SELECT id, title, ts_rank(document, query) AS score "
+            "FROM projects_search, to_tsquery('english', %%s) query "
+            "WHERE document @@ query %s "
+            "ORDER BY score DESC, id LIMIT %%s OFFSET %%s" % kind_filter
+        )
+    else:
+        raise SearchUnavailable('Search needs SQLite or PostgreSQL')
+    params += [limit, offset]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+    return [
+        {'type': KIND_NAMES[key % 2], 'id': key // 2, 'title': title, 'rank': score}
+        for key, title, score in rows
+    ]
+
+
+# Keep the index in sync
+
+@task(batch=True)
+def reindex(calls):
+    """ index the (kind, object id) pairs as they are now, dropping deleted ones """
+    for kind, model in ((PROJECT, Project), (SHELTER, Shelter)):
+        ids = {object_id for call_kind, object_id in calls if call_kind == kind}
+        found = model.objects.in_bulk(ids)
+        for object_id in ids:
+            if object_id in found:
+                index_object(found[object_id])
+            else:
+                _remove(kind, object_id)
+
+@receiver(post_save, sender=Project)
+@receiver(post_save, sender=Shelter)
+@receiver(post_delete, sender=Project)
+@receiver(post_delete, sender=Shelter)
+def reindex_changed(sender, instance, **kwargs):
+    kind, _, _ = _document(instance)
+    reindex.enqueue(kind, instance.pk)
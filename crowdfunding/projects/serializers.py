@@ -1,14 +1,18 @@
+from django.db import transaction
+from django.utils import timezone
 from rest_framework import serializers
+from crowdfunding.metrics import TimedSerializerMixin
 from .models import Project, Pledge, PetTag, Shelter
+from .pettags import CachedSlugRelatedField
 
 
-class ShelterSerializer(serializers.Serializer):
+class ShelterSerializer(TimedSerializerMixin, serializers.Serializer):
     id = serializers.ReadOnlyField()
     name = serializers.CharField(max_length=200)
     description = serializers.CharField(max_length=500)
     address = serializers.CharField(max_length=200)
     charityregister = serializers.IntegerField()
-    species = serializers.SlugRelatedField(many=True, slug_field="petspecies", queryset=PetTag.objects.all())
+    species = CachedSlugRelatedField(many=True)
     is_approved = serializers.BooleanField()
     owner_id = serializers.ReadOnlyField(source='owner.id')
     def create(self, validated_data):
@@ -31,7 +35,7 @@ class ShelterDetailSerializer(ShelterSerializer):
         return instance
 
 
-class PledgeSerializer(serializers.Serializer):
+class PledgeSerializer(TimedSerializerMixin, serializers.Serializer):
     id = serializers.ReadOnlyField()
     amount = serializers.IntegerField()
     comment = serializers.CharField(max_length=200)
@@ -40,10 +44,18 @@ class PledgeSerializer(serializers.Serializer):
     supporter_name = serializers.ReadOnlyField(source='supporter.profile.preferredname')
     project_id = serializers.IntegerField()
     def create(self, validated_data):
-        return Pledge.objects.create(**validated_data)
+        # the project totals are updated by a post_save signal, keep both in one transaction
+        with transaction.atomic():
+            # lock the project row first, so concurrent pledges to it queue up here and
+            # each one counts its supporter as new only if no earlier pledge did. An
+            # update rather than select_for_update, SQLite only serializes writes.
+            locked = Project.objects.filter(pk=validated_data['project_id']).update(updated_at=timezone.now())
+            if not locked:
+                raise serializers.ValidationError({'project_id': ['No such project.']})
+            return Pledge.objects.create(**validated_data)
 
 
-class ProjectSerializer(serializers.Serializer):
+class ProjectSerializer(TimedSerializerMixin, serializers.Serializer):
     id = serializers.ReadOnlyField()
     title = serializers.CharField(max_length=200)
     description = serializers.CharField(max_length=200)
@@ -56,7 +68,10 @@ class ProjectSerializer(serializers.Serializer):
     shelter = serializers.ReadOnlyField(source='owner.shelter.name')
     shelter_id = serializers.ReadOnlyField(source='owner.shelter.id')
     is_approved = serializers.ReadOnlyField(source='owner.shelter.is_approved')
-    species = serializers.SlugRelatedField(many=True, slug_field="petspecies", queryset=PetTag.objects.all())
+    species = CachedSlugRelatedField(many=True)
+    amount_raised = serializers.ReadOnlyField()
+    pledge_count = serializers.ReadOnlyField()
+    unique_supporter_count = serializers.ReadOnlyField()
     pledges = PledgeSerializer(many=True, read_only=True)
 
     def create(self, validated_data):
@@ -82,7 +97,7 @@ class ProjectDetailSerializer(ProjectSerializer):
         return instance
 
 
-class PetsSerializer(serializers.Serializer):
+class PetsSerializer(TimedSerializerMixin, serializers.Serializer):
     id = serializers.ReadOnlyField()
     petspecies = serializers.CharField(max_length=200)
 
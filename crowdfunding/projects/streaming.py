@@ -0,0 +1,76 @@
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from rest_framework.utils.encoders import JSONEncoder
+
+
+def wants_stream(request):
+    """ streaming is opt-in with ?stream=true """
+    return request.query_params.get('stream') == 'true'
+
+
+def _ordering(queryset):
+    """ (field, descending) pairs of the queryset's ordering, ending with the pk """
+    ordering = []
+    for name in queryset.query.order_by or queryset.model._meta.ordering:
+        descending = name.startswith('-')
+        name = name.lstrip('-')
+        ordering.append(('pk' if name == queryset.model._meta.pk.name else name, descending))
+        if ordering[-1][0] == 'pk':
+            return ordering
+    return ordering + [('pk', False)]
+
+
+def _after(ordering, item):
+    """ rows that come after `item` in `ordering` """
+    after = Q()
+    equal = Q()
+    for name, descending in ordering:
+        # model instances, or RowEncoder rows which start with the pk
+        if name == 'pk':
+            value = item[0] if isinstance(item, tuple) else item.pk
+        else:
+            value = getattr(item, name)
+        after |= equal & Q(**{'%s__%s' % (name, 'lt' if descending else 'gt'): value})
+        equal &= Q(**{name: value})
+    return after
+
+
+def iterate_in_chunks(queryset, chunk_size):
+    """
+    Walk a queryset in its own ordering, `chunk_size` rows at a time.
+
+    QuerySet.iterator() would drop prefetch_related, so each chunk is a
+    separate keyset query on the ordering fields plus the pk, and the
+    prefetches run once per chunk. The ordering fields must be non-null
+    columns of the rows.
+    """
+    ordering = _ordering(queryset)
+    queryset = queryset.order_by(*('-' + name if descending else name for name, descending in ordering))
+    last = None
+    while True:
+        chunk = queryset if last is None else queryset.filter(_after(ordering, last))
+        chunk = list(chunk[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last = chunk[-1]
+
+
+def stream_json_list(queryset, serializer_class=None, chunk_size=500, rows=None):
+    """
+    serialize a queryset into a JSON array without holding it all in memory,
+    with a RowEncoder as `rows` the queryset comes from rows.rows()
+    """
+    encoder = JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+    encode = rows.encode if rows else lambda chunk: serializer_class(chunk, many=True).data
+
+    def generate():
+        yield '['
+        separator = ''
+        for chunk in iterate_in_chunks(queryset, chunk_size):
+            data = encode(chunk)
+            yield separator + ','.join(encoder.encode(item) for item in data)
+            separator = ','
+        yield ']'
+
+    return StreamingHttpResponse(generate(), content_type='application/json')
@@ -1,3 +1,1463 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import StringIO
+from importlib import import_module
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.testing import ApplicationCommunicator
+
+from django.apps import apps
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, connections, transaction
+from django.db.models.signals import post_delete
+from django.http import StreamingHttpResponse
+from django.test import Client, LiveServerTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from crowdfunding import checks, metrics, replicas
+from crowdfunding.asgi import application
+from crowdfunding.querybudget import QueryBudgetExceeded, QueryBudgetMiddleware, QueryRecorder, normalize
+from users.authentication import token_cache
+from tasks.models import Task
+from tasks.queue import run_until_empty
+from users.models import CustomUser
+from . import events, idempotency, loadgen, perfdata, pettags, trending
+from .management.commands import loadtest
+from .models import (
+    IdempotencyKey, Project, ProjectEvent, Pledge, PledgeBucket, PetTag, Ranking, Recommendation, Shelter,
+    project_being_deleted
+)
+from .cache import bump_versions, get_versions, response_cache_stats
+from .filters import ProjectFilter
+from .imports import import_pledges
+from .pagination import OptInCursorPagination
+from .recommendations import refresh_for_users
+from .serializers import PledgeSerializer, ProjectSerializer, ShelterSerializer
+from .streaming import iterate_in_chunks
+from .views import ProjectDetail, ProjectList
+
+
+def make_catalog(size):
+    """ create `size` projects for one shelter, each with a species and a pledge """
+    # bulk_create skips the signals that expire cached responses
+    cache.clear()
+    owner = CustomUser.objects.create_user(email='owner@example.com', password='pw')
+    supporter = CustomUser.objects.create_user(email='supporter@example.com', password='pw')
+    dog = PetTag.objects.create(petspecies='dog')
+    supporter.profile.petlikes.add(dog)
+    shelter = Shelter.objects.create(
+        name='Shelter', description='', address='', charityregister=1,
+        is_approved=True, owner=owner
+    )
+    Project.objects.bulk_create(
+        Project(
+            title='Project %d' % i, description='', goal=100,
+            image='https://example.com/%d.png' % i, is_open=True,
+            date_created=timezone.now(), owner=owner
+        )
+        for i in range(size)
+    )
+    projects = list(Project.objects.all())
+    Project.species.through.objects.bulk_create(
+        Project.species.through(project=project, pettag=dog)
+        for project in projects
+    )
+    Pledge.objects.bulk_create(
+        Pledge(amount=5, comment='', anonymous=False, project=project, supporter=supporter)
+        for project in projects
+    )
+    refresh_for_users([supporter.pk])
+    return shelter, supporter, projects
+
+
+class ProjectQueryCountTest(TestCase):
+    sizes = (10, 100, 1000)
+
+    def assert_constant_queries(self, num, url_for):
+        for size in self.sizes:
+            with self.subTest(size=size):
+                shelter, supporter, projects = make_catalog(size)
+                try:
+                    url = url_for(shelter, supporter, projects)
+                    with self.assertNumQueries(num):
+                        response = self.client.get(url)
+                    self.assertEqual(response.status_code, 200)
+                    if isinstance(response.json(), list):
+                        self.assertEqual(len(response.json()), size)
+                finally:
+                    # tear down for the next size, we are inside a single transaction
+                    CustomUser.objects.all().delete()
+                    PetTag.objects.all().delete()
+
+    def test_project_list(self):
+        self.assert_constant_queries(3, lambda shelter, supporter, projects: '/projects/')
+
+    def test_project_detail(self):
+        self.assert_constant_queries(
+            4, lambda shelter, supporter, projects: '/projects/%d/' % projects[-1].pk
+        )
+
+    def test_shelters_projects(self):
+        self.assert_constant_queries(
+            5, lambda shelter, supporter, projects: '/%d/shelter-projects/' % shelter.pk
+        )
+
+    def test_recommended_projects(self):
+        self.assert_constant_queries(
+            3, lambda shelter, supporter, projects: '/%d/recommended/' % supporter.pk
+        )
+
+    def test_supported_projects(self):
+        self.assert_constant_queries(
+            4, lambda shelter, supporter, projects: '/%d/supported-projects/' % supporter.pk
+        )
+
+
+class CursorPaginationTest(TestCase):
+
+    def setUp(self):
+        self.shelter, self.supporter, self.projects = make_catalog(7)
+
+    def test_unpaginated_by_default(self):
+        response = self.client.get('/projects/')
+        self.assertEqual(len(response.json()), 7)
+
+    def test_follows_cursors(self):
+        response = self.client.get('/projects/', {'page_size': 3})
+        body = response.json()
+        self.assertEqual([p['id'] for p in body['results']], [p.pk for p in self.projects[:3]])
+        self.assertIsNone(body['previous'])
+        self.assertNotIn('count', body)
+
+        seen = []
+        url = '/projects/?page_size=3'
+        while url:
+            body = self.client.get(url).json()
+            seen.extend(p['id'] for p in body['results'])
+            url = body['next']
+        self.assertEqual(seen, [p.pk for p in self.projects])
+
+    def test_page_size_is_capped(self):
+        request = Request(APIRequestFactory().get('/pledges/', {'page_size': 10000}))
+        paginator = OptInCursorPagination()
+        self.assertEqual(paginator.get_page_size(request), paginator.max_page_size)
+
+
+class ProjectTotalsTest(TestCase):
+
+    def setUp(self):
+        self.shelter, self.supporter, self.projects = make_catalog(2)
+        self.project = self.projects[0]
+
+    def pledge(self, user, amount):
+        self.client.force_login(user)
+        response = self.client.post('/pledges/', {
+            'amount': amount, 'comment': 'Good luck', 'anonymous': False,
+            'project_id': self.project.pk,
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        return Pledge.objects.get(pk=response.json()['id'])
+
+    def assert_totals(self, amount_raised, pledge_count, unique_supporter_count):
+        self.project.refresh_from_db()
+        self.assertEqual(
+            (self.project.amount_raised, self.project.pledge_count, self.project.unique_supporter_count),
+            (amount_raised, pledge_count, unique_supporter_count)
+        )
+
+    def test_pledges_update_totals(self):
+        self.project = Project.objects.create(
+            title='Fresh', description='', goal=100, image='https://example.com/x.png',
+            is_open=True, date_created=timezone.now(), owner=self.shelter.owner
+        )
+        other = CustomUser.objects.create_user(email='other@example.com', password='pw')
+        first = self.pledge(self.supporter, 10)
+        self.pledge(self.supporter, 15)
+        self.pledge(other, 20)
+        self.assert_totals(45, 3, 2)
+
+        first.delete()
+        self.assert_totals(35, 2, 2)
+
+    def test_deleting_a_supporter_recalculates_once(self):
+        other = CustomUser.objects.create_user(email='other@example.com', password='pw')
+        for _ in range(3):
+            self.pledge(other, 10)
+        self.pledge(self.supporter, 5)
+        # the bulk created catalog pledge is not counted until recalculated
+        self.assert_totals(35, 4, 1)
+        with CaptureQueriesContext(connection) as deleted:
+            other.delete()
+        self.assert_totals(10, 2, 1)
+        self.assertEqual(
+            len([query for query in deleted if query['sql'].startswith('UPDATE "projects_project" SET "amount_raised"')]), 1
+        )
+
+    def test_deleting_a_project_skips_its_totals(self):
+        self.pledge(self.supporter, 5)
+        with CaptureQueriesContext(connection) as deleted:
+            self.project.delete()
+        self.assertFalse([
+            query for query in deleted if query['sql'].startswith('UPDATE "projects_project" SET "amount_raised"')
+        ])
+        self.assertFalse(ProjectEvent.objects.filter(project_id=self.project.pk, event='totals').exists())
+
+    def test_failed_delete_leaves_no_marker(self):
+        def fail(**kwargs):
+            raise IntegrityError('no luck')
+        post_delete.connect(fail, sender=Pledge)
+        self.addCleanup(post_delete.disconnect, fail, sender=Pledge)
+        for delete in (self.project.delete, self.supporter.delete,
+                       CustomUser.objects.filter(pk=self.supporter.pk).delete):
+            with self.subTest(delete=delete):
+                with self.assertRaises(IntegrityError), transaction.atomic():
+                    delete()
+                self.assertFalse(project_being_deleted(self.project.pk))
+        post_delete.disconnect(fail, sender=Pledge)
+        self.pledge(self.supporter, 5)
+        self.assert_totals(5, 1, 0)
+        Pledge.objects.latest('pk').delete()
+        self.assert_totals(0, 0, 0)
+
+    def test_reconcile_command(self):
+        # make_catalog bulk inserts its pledges, so no signal has run yet
+        self.assert_totals(0, 0, 0)
+        call_command('reconcile_project_totals', batch_size=1, stdout=StringIO())
+        self.assert_totals(5, 1, 1)
+        self.assertEqual(Project.objects.get(pk=self.projects[1].pk).amount_raised, 5)
+
+
+class StreamingTest(TestCase):
+
+    def setUp(self):
+        make_catalog(12)
+
+    def test_stream_matches_buffered_response(self):
+        for url in ('/projects/', '/pledges/', '/users/'):
+            with self.subTest(url=url):
+                buffered = self.client.get(url)
+                streamed = self.client.get(url, {'stream': 'true'})
+                self.assertTrue(streamed.streaming)
+                body = b''.join(streamed.streaming_content)
+                self.assertEqual(json.loads(body), buffered.json())
+
+    def test_chunks_keep_prefetches(self):
+        with self.assertNumQueries(3 * 3 + 1):
+            chunks = list(iterate_in_chunks(Project.objects.with_related(), 5))
+        self.assertEqual([len(chunk) for chunk in chunks], [5, 5, 2])
+
+    def test_stream_keeps_the_requested_ordering(self):
+        # ties on goal, so the chunks have to continue by pk within a goal
+        for i, project in enumerate(Project.objects.order_by('pk')):
+            Project.objects.filter(pk=project.pk).update(goal=100 * (i % 4))
+        ordered = Project.objects.order_by('-goal', 'pk')
+        chunks = list(iterate_in_chunks(Project.objects.order_by('-goal'), 5))
+        self.assertEqual([project.pk for chunk in chunks for project in chunk], [project.pk for project in ordered])
+        for ordering in ('-goal', 'title'):
+            with self.subTest(ordering=ordering):
+                buffered = self.client.get('/projects/', {'ordering': ordering})
+                streamed = self.client.get('/projects/', {'ordering': ordering, 'stream': 'true'})
+                self.assertEqual(json.loads(b''.join(streamed.streaming_content)), buffered.json())
+
+
+class ResponseCacheTest(TestCase):
+
+    def setUp(self):
+        self.shelter, self.supporter, self.projects = make_catalog(3)
+
+    def test_repeat_get_is_served_from_cache(self):
+        before = response_cache_stats()
+        self.assertEqual(self.client.get('/projects/')['X-Cache'], 'MISS')
+        # the ETag and the response both come from the cache
+        with self.assertNumQueries(0):
+            response = self.client.get('/projects/')
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(len(response.json()), 3)
+        after = response_cache_stats()
+        self.assertEqual(after['hits'] - before['hits'], 1)
+        self.assertEqual(after['misses'] - before['misses'], 1)
+
+    def test_pledge_expires_only_its_project(self):
+        pledged, untouched = self.projects[0], self.projects[1]
+        for url in ('/projects/', '/projects/%d/' % pledged.pk, '/projects/%d/' % untouched.pk):
+            self.client.get(url)
+        Pledge.objects.create(
+            amount=7, comment='Go', anonymous=False, project=pledged, supporter=self.supporter
+        )
+        self.assertEqual(self.client.get('/projects/')['X-Cache'], 'MISS')
+        response = self.client.get('/projects/%d/' % pledged.pk)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(len(response.json()['pledges']), 2)
+        self.assertEqual(self.client.get('/projects/%d/' % untouched.pk)['X-Cache'], 'HIT')
+
+    def test_supporter_and_owner_changes_expire_projects(self):
+        url = '/projects/%d/' % self.projects[0].pk
+        self.client.get(url)
+        self.supporter.profile.preferredname = 'Sam'
+        self.supporter.profile.save()
+        pledges = self.client.get(url).json()['pledges']
+        self.assertEqual(pledges[0]['supporter_name'], 'Sam')
+        owner = self.shelter.owner
+        owner.email = 'renamed@example.com'
+        owner.save()
+        self.assertEqual(self.client.get(url).json()['owner'], 'renamed@example.com')
+
+    def test_versions_bump_again_on_commit(self):
+        # TestCase never commits, so run the callback by hand
+        pending = len(connection.run_on_commit)
+        bump_versions('projects')
+        callbacks = [callback for _, callback in connection.run_on_commit[pending:]]
+        self.assertEqual(len(callbacks), 1)
+        version = get_versions(['projects'])
+        callbacks[0]()
+        self.assertNotEqual(get_versions(['projects']), version)
+
+    def test_new_pet_tag_expires_category_list(self):
+        self.client.get('/petcategories/')
+        PetTag.objects.create(petspecies='cat')
+        response = self.client.get('/petcategories/')
+        self.assertEqual([tag['petspecies'] for tag in response.json()], ['dog', 'cat'])
+
+    def test_shelter_change_expires_its_projects(self):
+        self.client.get('/projects/%d/' % self.projects[0].pk)
+        self.shelter.name = 'Renamed'
+        self.shelter.save()
+        response = self.client.get('/projects/%d/' % self.projects[0].pk)
+        self.assertEqual(response.json()['shelter'], 'Renamed')
+
+
+class ConditionalGetTest(TestCase):
+
+    def setUp(self):
+        self.shelter, self.supporter, self.projects = make_catalog(3)
+
+    def assert_not_modified(self, url, queries=1):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(queries):
+            repeat = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(repeat.status_code, 304)
+        if queries:
+            # only details read a row, and send its updated_at
+            repeat = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+            self.assertEqual(repeat.status_code, 304)
+        return response['ETag']
+
+    def test_lists_and_details_answer_304(self):
+        for url in ('/projects/%d/' % self.projects[0].pk, '/shelters/%d/' % self.shelter.pk):
+            with self.subTest(url=url):
+                self.assert_not_modified(url)
+        # lists take their ETag from the response cache versions
+        for url in ('/projects/', '/shelters/', '/pledges/', '/projects/trending/', '/shelters/leaderboard/'):
+            with self.subTest(url=url):
+                self.assert_not_modified(url, queries=0)
+
+    def test_pledge_changes_project_etag(self):
+        url = '/projects/%d/' % self.projects[0].pk
+        etag = self.assert_not_modified(url)
+        list_etag = self.client.get('/projects/')['ETag']
+        Pledge.objects.create(
+            amount=7, comment='Go', anonymous=False, project=self.projects[0], supporter=self.supporter
+        )
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertEqual(self.client.get('/projects/', HTTP_IF_NONE_MATCH=list_etag).status_code, 200)
+
+    def test_shelter_change_changes_project_etag(self):
+        etag = self.client.get('/projects/')['ETag']
+        self.shelter.is_approved = False
+        self.shelter.save()
+        self.assertNotEqual(self.client.get('/projects/')['ETag'], etag)
+
+    def test_supporter_rename_changes_pledge_list_etag(self):
+        etag = self.client.get('/pledges/')['ETag']
+        self.supporter.profile.preferredname = 'Sam'
+        self.supporter.profile.save()
+        response = self.client.get('/pledges/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['supporter_name'], 'Sam')
+
+    def test_embedded_user_changes_change_project_etag(self):
+        url = '/projects/%d/' % self.projects[0].pk
+        owner = self.shelter.owner
+
+        def supporter_renamed():
+            self.supporter.profile.preferredname = 'Sam'
+            self.supporter.profile.save()
+
+        def owner_renamed():
+            owner.email = 'renamed@example.com'
+            owner.save()
+
+        for change in (supporter_renamed, owner_renamed, self.shelter.delete):
+            with self.subTest(change=change.__name__):
+                etag = self.client.get(url)['ETag']
+                change()
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class PledgeImportTest(TestCase):
+
+    def setUp(self):
+        self.shelter, self.supporter, self.projects = make_catalog(2)
+        self.project = self.projects[0]
+
+    def test_csv_upload_reports_bad_rows(self):
+        body = (
+            'amount,comment,anonymous,project_id\n'
+            '10,Event,false,%(pk)d\n'
+            'lots,Event,false,%(pk)d\n'
+            '15,Event,true,999999\n'
+            '20,Event,true,%(pk)d\n'
+        ) % {'pk': self.project.pk}
+        self.client.force_login(self.supporter)
+        response = self.client.post('/pledges/import/', body, content_type='text/csv')
+        report = response.json()
+        self.assertEqual(report['created'], 2)
+        self.assertEqual([error['row'] for error in report['errors']], [2, 3])
+        self.assertIn('amount', report['errors'][0]['errors'])
+
+        self.project.refresh_from_db()
+        # 5 from make_catalog plus the two imported rows
+        self.assertEqual((self.project.amount_raised, self.project.pledge_count), (35, 3))
+        self.assertEqual(self.project.unique_supporter_count, 1)
+
+    def test_rows_that_are_not_utf8_are_reported(self):
+        self.client.force_login(self.supporter)
+        row = '{"amount": 10, "comment": "%s", "anonymous": false, "project_id": ' + str(self.project.pk) + '}\n'
+        for content_type, body in (
+            ('text/csv', b'amount,comment,anonymous,project_id\n10,Caf\xe9,false,1\n20,Cafe,false,1\n'),
+            ('application/x-ndjson', (row % 'Caf\xe9').encode('latin-1') + (row % 'Cafe').encode()),
+        ):
+            with self.subTest(content_type=content_type):
+                body = body.replace(b',1\n', b',%d\n' % self.project.pk)
+                response = self.client.post('/pledges/import/', body, content_type=content_type)
+                self.assertEqual(response.status_code, 200)
+                report = response.json()
+                self.assertEqual(report['created'], 1)
+                self.assertEqual(report['errors'], [{'row': 1, 'errors': {'non_field_errors': ['Not valid UTF-8.']}}])
+
+    def test_rejects_unknown_content_type(self):
+        self.client.force_login(self.supporter)
+        response = self.client.post('/pledges/import/', '{}', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_ndjson_command(self):
+        other = CustomUser.objects.create_user(email='other@example.com', password='pw')
+        lines = [
+            {'amount': 3, 'comment': 'a', 'anonymous': False, 'project_id': self.project.pk, 'supporter': other.pk},
+            {'amount': 4, 'comment': 'b', 'anonymous': False, 'project_id': self.project.pk, 'supporter': 0},
+        ]
+        with tempfile.NamedTemporaryFile('w', suffix='.ndjson') as source:
+            source.write('\n'.join(json.dumps(line) for line in lines) + '\nnot json\n')
+            source.flush()
+            stdout, stderr = StringIO(), StringIO()
+            call_command('import_pledges', source.name, chunk_size=1, stdout=stdout, stderr=stderr)
+        self.assertIn('Imported 1 pledges, 2 rows rejected', stdout.getvalue())
+        self.assertIn('row 2:', stderr.getvalue())
+        self.project.refresh_from_db()
+        self.assertEqual(self.project.unique_supporter_count, 2)
+
+
+class RecommendationTest(TestCase):
+
+    def setUp(self):
+        self.owner = CustomUser.objects.create_user(email='owner@example.com', password='pw')
+        self.user = CustomUser.objects.create_user(email='fan@example.com', password='pw')
+        self.dog = PetTag.objects.create(petspecies='dog')
+        self.cat = PetTag.objects.create(petspecies='cat')
+        self.bird = PetTag.objects.create(petspecies='bird')
+
+    def project(self, *species, is_open=True):
+        project = Project.objects.create(
+            title='Project', description='', goal=100, image='https://example.com/x.png',
+            is_open=is_open, date_created=timezone.now(), owner=self.owner
+        )
+        project.species.set(species)
+        return project
+
+    def recommended_ids(self):
+        return [project['id'] for project in self.client.get('/%d/recommended/' % self.user.pk).json()]
+
+    def test_ranked_by_overlap_without_duplicates(self):
+        both = self.project(self.dog, self.cat)
+        dog_only = self.project(self.dog)
+        self.project(self.dog, is_open=False)
+        self.project(self.bird)
+        self.user.profile.petlikes.add(self.dog, self.cat)
+        self.assertEqual(self.recommended_ids(), [both.pk, dog_only.pk])
+
+    def test_follows_petlikes_and_new_projects(self):
+        self.user.profile.petlikes.add(self.dog)
+        dog_project = self.project(self.dog)
+        cat_project = self.project(self.cat)
+        self.assertEqual(self.recommended_ids(), [dog_project.pk])
+
+        self.user.profile.petlikes.set([self.cat])
+        self.assertEqual(self.recommended_ids(), [cat_project.pk])
+
+    def test_pledges_lift_score(self):
+        self.user.profile.petlikes.add(self.dog)
+        first, second = self.project(self.dog), self.project(self.dog)
+        before = Recommendation.objects.get(user=self.user, project=second).score
+        Pledge.objects.create(amount=50, comment='Go', anonymous=False, project=second, supporter=self.owner)
+        after = Recommendation.objects.get(user=self.user, project=second).score
+        self.assertAlmostEqual(after - before, 0.25)
+        self.assertEqual(self.recommended_ids()[0], second.pk)
+
+    def test_rebuild_command(self):
+        self.user.profile.petlikes.add(self.dog)
+        project = self.project(self.dog)
+        Recommendation.objects.all().delete()
+        call_command('rebuild_recommendations', stdout=StringIO())
+        self.assertEqual(self.recommended_ids(), [project.pk])
+
+    @override_settings(TASKS_EAGER=False)
+    def test_migration_queues_a_rebuild(self):
+        backfill = import_module('projects.migrations.0013_backfill_recommendations')
+        schema_editor = mock.Mock(connection=connection)
+        backfill.queue_rebuild(apps, schema_editor)
+        backfill.queue_rebuild(apps, schema_editor)
+        self.assertEqual(list(Task.objects.values_list('name', flat=True)), ['projects.recommendations.rebuild'])
+        self.user.profile.petlikes.add(self.dog)
+        project = self.project(self.dog)
+        Recommendation.objects.all().delete()
+        run_until_empty()
+        self.assertEqual(self.recommended_ids(), [project.pk])
+
+    def test_imported_pledges_rescore(self):
+        self.user.profile.petlikes.add(self.dog, self.cat)
+        dog_project, cat_project = self.project(self.dog), self.project(self.cat)
+        self.assertAlmostEqual(
+            Recommendation.objects.get(user=self.user, project=dog_project).score,
+            Recommendation.objects.get(user=self.user, project=cat_project).score
+        )
+        rows = [{'amount': 50, 'comment': 'Go', 'anonymous': False, 'project_id': dog_project.pk}]
+        import_pledges(rows, supporter=self.user)
+        # the pledge history and the progress term both favour the dog project now
+        self.assertGreater(
+            Recommendation.objects.get(user=self.user, project=dog_project).score,
+            Recommendation.objects.get(user=self.user, project=cat_project).score
+        )
+
+
+class SearchTest(TestCase):
+
+    def setUp(self):
+        owner = CustomUser.objects.create_user(email='owner@example.com', password='pw')
+        self.shelter = Shelter.objects.create(
+            name='Paws Rescue', description='Rehoming cats', address='Kittenville',
+            charityregister=1, is_approved=True, owner=owner
+        )
+        self.kennel = self.project(owner, 'Kennel roof', 'A new roof for the dog kennels')
+        self.vet = self.project(owner, 'Vet bills', 'Surgery for a rescued dog and kennel cough treatment')
+
+    def project(self, owner, title, description):
+        return Project.objects.create(
+            title=title, description=description, goal=100, image='https://example.com/x.png',
+            is_open=True, date_created=timezone.now(), owner=owner
+        )
+
+    def search(self, **params):
+        return self.client.get('/search/', params).json()
+
+    def test_ranks_title_matches_first(self):
+        results = self.search(q='kennel')['results']
+        self.assertEqual([(r['type'], r['id']) for r in results], [
+            ('project', self.kennel.pk), ('project', self.vet.pk)
+        ])
+
+    def test_prefix_and_type_filter(self):
+        results = self.search(q='kitt')['results']
+        self.assertEqual([(r['type'], r['id'], r['title']) for r in results], [
+            ('shelter', self.shelter.pk, 'Paws Rescue')
+        ])
+        self.assertEqual(self.search(q='resc', type='project')['results'][0]['id'], self.vet.pk)
+
+    def test_index_follows_saves_and_deletes(self):
+        self.kennel.title = 'Cattery heating'
+        self.kennel.save()
+        self.assertEqual([r['id'] for r in self.search(q='cattery')['results']], [self.kennel.pk])
+        self.kennel.delete()
+        self.assertEqual(self.search(q='cattery')['results'], [])
+
+    def test_paginates(self):
+        first = self.search(q='dog', limit=1)
+        self.assertEqual(len(first['results']), 1)
+        second = self.client.get(first['next']).json()
+        self.assertEqual(len(second['results']), 1)
+        self.assertIsNone(second['next'])
+        self.assertNotEqual(first['results'][0]['id'], second['results'][0]['id'])
+
+    def test_limit_is_at_least_one(self):
+        for limit in (0, -5):
+            with self.subTest(limit=limit):
+                page = self.search(q='dog', limit=limit)
+                self.assertEqual(len(page['results']), 1)
+                self.assertIn('offset=1', page['next'])
+
+    def test_operators_are_literal(self):
+        self.assertEqual(self.search(q='"kennel" OR NEAR(')['results'], [])
+
+
+class ProjectFilterTest(TestCase):
+
+    def setUp(self):
+        self.owner = CustomUser.objects.create_user(email='owner@example.com', password='pw')
+        self.shelter = Shelter.objects.create(
+            name='Shelter', description='', address='', charityregister=1,
+            is_approved=True, owner=self.owner
+        )
+        self.dog = PetTag.objects.create(petspecies='dog')
+        self.cat = PetTag.objects.create(petspecies='cat')
+        now = timezone.now()
+        self.old_dog = self.project(goal=50, is_open=True, created=now - timedelta(days=10), species=[self.dog])
+        self.new_both = self.project(goal=500, is_open=True, created=now, species=[self.dog, self.cat])
+        self.closed_cat = self.project(goal=5000, is_open=False, created=now - timedelta(days=5), species=[self.cat])
+
+    def project(self, goal, is_open, created, species):
+        project = Project.objects.create(
+            title='Project', description='', goal=goal, image='https://example.com/x.png',
+            is_open=is_open, date_created=created, owner=self.owner
+        )
+        project.species.set(species)
+        return project
+
+    def ids(self, **params):
+        response = self.client.get('/projects/', params)
+        self.assertEqual(response.status_code, 200)
+        return [project['id'] for project in response.json()]
+
+    def test_filters(self):
+        self.assertEqual(self.ids(is_open='true', species='dog', ordering='-date_created'),
+                         [self.new_both.pk, self.old_dog.pk])
+        self.assertEqual(self.ids(species='dog,cat'),
+                         [self.old_dog.pk, self.new_both.pk, self.closed_cat.pk])
+        self.assertEqual(self.ids(is_open='false'), [self.closed_cat.pk])
+        self.assertEqual(self.ids(goal_min=100, goal_max=1000), [self.new_both.pk])
+        self.assertEqual(self.ids(shelter=self.shelter.pk, ordering='-goal'),
+                         [self.closed_cat.pk, self.new_both.pk, self.old_dog.pk])
+        yesterday = (timezone.now() - timedelta(days=1)).date().isoformat()
+        self.assertEqual(self.ids(created_after=yesterday), [self.new_both.pk])
+        self.assertEqual(self.ids(created_before=yesterday), [self.old_dog.pk, self.closed_cat.pk])
+
+    def test_bad_values_are_rejected(self):
+        for params in ({'is_open': 'maybe'}, {'goal_min': 'x'}, {'created_after': '2020-13-45'}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get('/projects/', params).status_code, 400)
+
+    def test_filters_use_indexes(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('plan assertions are written against SQLite')
+
+        def plan(**params):
+            request = Request(APIRequestFactory().get('/projects/', params))
+            return ProjectFilter().filter_queryset(request, Project.objects.all(), None)
+
+        self.assertIn('project_open_created',
+                      plan(is_open='true').order_by('-date_created').explain())
+        # ?shelter= reaches the owner through the shelter join
+        self.assertIn('project_owner_created',
+                      plan(shelter=str(self.shelter.pk)).order_by('-date_created').explain())
+        self.assertIn('project_species_pettag_project', plan(species='dog').explain())
+
+
+class QueryBudgetTest(TestCase):
+
+    def setUp(self):
+        make_catalog(6)
+
+    def test_normalize_collapses_literals_and_in_lists(self):
+        self.assertEqual(
+            normalize("SELECT a FROM t WHERE id IN (%s, %s, %s) AND name = 'x'  AND n = 10"),
+            'SELECT a FROM t WHERE id IN (...) AND name = ? AND n = ?'
+        )
+
+    def test_flags_n_plus_one_with_its_field(self):
+        with QueryRecorder(n_plus_one_threshold=5) as queries:
+            PledgeSerializer(Pledge.objects.all(), many=True).data
+        fields = {field for _, times, field in queries.n_plus_one()}
+        self.assertEqual(fields, {'PledgeSerializer.supporter', 'PledgeSerializer.supporter_name'})
+
+        with QueryRecorder(n_plus_one_threshold=5) as queries:
+            PledgeSerializer(Pledge.objects.select_related('supporter__profile'), many=True).data
+        self.assertEqual(queries.count, 1)
+        self.assertEqual(queries.n_plus_one(), [])
+
+    @override_settings(QUERY_BUDGET_RAISE=True)
+    def test_over_budget_raises(self):
+        with mock.patch.object(ProjectList, 'query_budget', {'GET': 1}):
+            with self.assertRaisesMessage(QueryBudgetExceeded, 'ProjectList ran over its query budget of 1'):
+                self.client.get('/projects/')
+
+    @override_settings(QUERY_BUDGET_RAISE=True)
+    def test_streamed_chunks_are_held_to_the_budget(self):
+        class View:
+            query_budget = 2
+
+        def chunk(queries):
+            for _ in range(queries):
+                list(Project.objects.all())
+            return b'[]'
+
+        def respond(request):
+            request._query_budget_view = View
+            return StreamingHttpResponse(chunk(queries) for queries in (2, 2, 3))
+
+        response = QueryBudgetMiddleware(respond)(APIRequestFactory().get('/'))
+        content = iter(response.streaming_content)
+        self.assertEqual([next(content), next(content)], [b'[]', b'[]'])
+        with self.assertRaisesMessage(QueryBudgetExceeded, 'View (streamed chunk) ran over its query budget of 2'):
+            next(content)
+
+    @override_settings(QUERY_BUDGET_RAISE=False)
+    def test_over_budget_logs_outside_tests(self):
+        with mock.patch.object(ProjectList, 'query_budget', 1):
+            with self.assertLogs('crowdfunding.querybudget', 'ERROR'):
+                response = self.client.get('/projects/')
+        self.assertEqual(response.status_code, 200)
+
+
+class MetricsTest(TestCase):
+
+    def setUp(self):
+        make_catalog(3)
+        self.staff = CustomUser.objects.create_user(email='staff@example.com', password='pw', is_staff=True)
+
+    def scrape(self):
+        self.client.force_login(self.staff)
+        response = self.client.get('/metrics/')
+        self.client.logout()
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_staff_only(self):
+        self.assertIn(self.client.get('/metrics/').status_code, (401, 403))
+
+    def test_records_requests_per_route(self):
+        before = metrics.snapshot()['series'].get('GET projects/', {}).get('requests', 0)
+        self.client.get('/projects/')
+        self.client.get('/projects/')
+        series = metrics.snapshot()['series']['GET projects/']
+        self.assertEqual(series['requests'], before + 2)
+        self.assertGreater(series['sql_queries'], 0)
+        self.assertGreater(series['serializer_seconds'], 0)
+        self.assertIn('http_requests_total{route="projects/",method="GET"} %d' % (before + 2), self.scrape())
+
+    def test_adds_up_worker_files(self):
+        worker = metrics._new_series()
+        worker['requests'] = 1000
+        worker['latency_buckets'][0] = 1000
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            self.client.get('/projects/')
+            with open('%s/metrics-1-1.json' % directory, 'w') as output:
+                json.dump({'series': {'GET other/': worker}, 'counters': {'token_cache_hits': 7}}, output)
+            text = self.scrape()
+        self.assertIn('http_requests_total{route="other/",method="GET"} 1000', text)
+        self.assertIn('http_request_duration_seconds_bucket{route="other/",method="GET",le="+Inf"} 1000', text)
+        # this process's own numbers are included too
+        self.assertIn('http_requests_total{route="projects/",method="GET"}', text)
+
+    def test_quantile_estimate(self):
+        buckets = [0] * (len(metrics.LATENCY_BUCKETS) + 1)
+        buckets[0] = 50     # <= 5ms
+        buckets[4] = 50     # 50ms - 100ms
+        self.assertAlmostEqual(metrics._quantile(0.5, buckets), 0.005)
+        self.assertAlmostEqual(metrics._quantile(0.99, buckets), 0.099)
+
+
+class BenchmarkTest(TestCase):
+    sizes = {'users': 20, 'shelters': 4, 'projects': 12, 'pledges': 60}
+
+    def seed(self):
+        call_command('seed_perf_data', stdout=StringIO(), **self.sizes)
+
+    def test_seed_is_deterministic(self):
+        self.seed()
+        first = list(Project.objects.order_by('pk').values_list('title', 'goal', 'amount_raised'))
+        self.assertEqual(len(first), 12)
+        self.assertEqual(Pledge.objects.count(), 60)
+        self.assertTrue(self.client.login(email=perfdata.EMAIL % 0, password=perfdata.PASSWORD))
+
+        call_command('seed_perf_data', clear=True, stdout=StringIO(), **self.sizes)
+        self.assertEqual(list(Project.objects.order_by('pk').values_list('title', 'goal', 'amount_raised')), first)
+        with self.assertRaises(CommandError):
+            self.seed()
+
+    def test_seed_expires_cached_responses(self):
+        for url in ('/projects/', '/shelters/'):
+            self.client.get(url)
+        self.seed()
+        for url in ('/projects/', '/shelters/'):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response['X-Cache'], 'MISS')
+                self.assertTrue(response.json())
+        self.assertEqual(len(self.client.get('/petcategories/').json()), len(perfdata.SPECIES))
+
+    def test_bench_writes_results_and_checks_thresholds(self):
+        self.seed()
+        with tempfile.TemporaryDirectory() as directory:
+            results = '%s/results.json' % directory
+            call_command('bench', iterations=2, warmup=0, output=results, stdout=StringIO())
+            with open(results) as source:
+                report = json.load(source)
+            self.assertEqual(report['rows']['projects'], 12)
+            self.assertLessEqual(report['results']['view:shelters']['queries'], 4)
+            self.assertLessEqual(report['results']['view:projects']['queries'], 4)
+
+            thresholds = '%s/thresholds.json' % directory
+            with open(thresholds, 'w') as output:
+                json.dump({'view:shelters': {'queries': 0}}, output)
+            with self.assertRaisesMessage(CommandError, '1 benchmark checks failed'):
+                call_command(
+                    'bench', iterations=1, warmup=0, only='view:shelters', output=results,
+                    baseline=results, tolerance=100, thresholds=thresholds,
+                    stdout=StringIO(), stderr=StringIO()
+                )
+
+
+class LoadGeneratorTest(LiveServerTestCase):
+
+    def test_mixed_traffic_against_live_server(self):
+        call_command('seed_perf_data', users=10, shelters=2, projects=6, pledges=20, stdout=StringIO())
+        # one client: the live server shares a single in-memory SQLite connection between threads
+        report = loadgen.run(self.live_server_url, duration=1, processes=1, threads=1)
+        endpoints = report['endpoints']
+        self.assertGreater(endpoints['total']['requests'], 0)
+        self.assertEqual(endpoints['total']['errors'], 0, endpoints)
+        self.assertIn('GET projects/<pk>/', endpoints)
+
+    def test_local_server_runs_the_procfile_web_process(self):
+        command = loadtest.Command()
+        with mock.patch('shutil.which', return_value='/usr/bin/gunicorn'), \
+                mock.patch('subprocess.Popen') as popen:
+            command.start_gunicorn(8765, 2)
+        arguments = popen.call_args[0][0]
+        self.assertEqual(arguments[:len(command.web_command())], command.web_command())
+        self.assertIn('crowdfunding.asgi:application', arguments)
+        self.assertEqual(arguments[-6:], ['--bind', '127.0.0.1:8765', '--workers', '2', '--log-level', 'warning'])
+
+    def test_parse_mix(self):
+        self.assertEqual(loadgen.parse_mix('browse=3,pledge=1'), {'browse': 3, 'pledge': 1})
+        for mix in ('browse=x', 'shopping=1', 'browse=0'):
+            with self.assertRaises(ValueError):
+                loadgen.parse_mix(mix)
+
+
+class FastListRenderingTest(TestCase):
+
+    def setUp(self):
+        call_command('seed_perf_data', users=30, shelters=4, projects=25, pledges=120, stdout=StringIO())
+        # a project whose owner has no shelter renders nulls
+        Project.objects.create(
+            title='Ünïcode', description='', goal=10, image='https://example.com/x.png',
+            is_open=True, date_created=timezone.now(), owner=CustomUser.objects.create_user(email='plain@example.com')
+        )
+
+    def assert_same_bytes(self, url, serializer_class, queryset):
+        response = self.client.get(url)
+        data = response.json()
+        if isinstance(data, dict):
+            # a page: compare the rows against the ids the page holds
+            expected = serializer_class(queryset.filter(pk__in=[row['id'] for row in data['results']]), many=True)
+            self.assertEqual(JSONRenderer().render(data['results']), JSONRenderer().render(expected.data))
+        else:
+            self.assertEqual(response.content, JSONRenderer().render(serializer_class(queryset, many=True).data))
+
+    def test_byte_for_byte_identical_to_serializers(self):
+        projects = Project.objects.with_related()
+        self.assert_same_bytes('/projects/', ProjectSerializer, projects.order_by('id'))
+        self.assert_same_bytes('/projects/?ordering=-goal,id&page_size=7', ProjectSerializer, projects.order_by('-goal', 'id'))
+        self.assert_same_bytes('/pledges/', PledgeSerializer, Pledge.objects.select_related('supporter__profile'))
+        self.assert_same_bytes('/pledges/?page_size=9', PledgeSerializer, Pledge.objects.order_by('id'))
+        self.assert_same_bytes('/shelters/', ShelterSerializer, Shelter.objects.all())
+
+
+class SparseFieldsetTest(TestCase):
+
+    def setUp(self):
+        self.shelter, self.supporter, self.projects = make_catalog(6)
+
+    def test_fields_select_columns_and_relations(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/projects/', {'fields': 'title,image,amount_raised,goal'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 6)
+        for project in response.json():
+            self.assertEqual(list(project), ['title', 'goal', 'image', 'amount_raised'])
+        sql = ' '.join(query['sql'] for query in queries.captured_queries)
+        self.assertNotIn('"description"', sql)
+        self.assertNotIn('projects_pledge', sql)
+        self.assertNotIn('projects_shelter', sql)
+        self.assertNotIn('projects_project_species', sql)
+
+    def test_expand_pledges(self):
+        full = self.client.get('/projects/').json()
+        sparse = self.client.get('/projects/', {'fields': 'id', 'expand': 'pledges'}).json()
+        self.assertEqual(sparse, [{'id': project['id'], 'pledges': project['pledges']} for project in full])
+        # ?expand alone is every plain field plus the expansion
+        self.assertEqual(self.client.get('/projects/', {'expand': 'pledges'}).json(), full)
+        self.assertNotIn('pledges', self.client.get('/projects/', {'expand': ''}).json()[0])
+
+    def test_paginated_and_detail(self):
+        response = self.client.get('/projects/', {'fields': 'title', 'ordering': '-goal,id', 'page_size': 4})
+        self.assertEqual(len(response.json()['results']), 4)
+        second = self.client.get(response.json()['next']).json()
+        self.assertEqual(len(second['results']), 2)
+
+        project = self.projects[0]
+        response = self.client.get('/projects/%d/' % project.pk, {'fields': 'title,species'})
+        self.assertEqual(response.json(), {'title': project.title, 'species': ['dog']})
+        self.assertEqual(self.client.get('/projects/0/', {'fields': 'title'}).status_code, 404)
+
+    def test_unknown_fields_are_rejected(self):
+        self.assertEqual(self.client.get('/projects/', {'fields': 'title,secret'}).status_code, 400)
+        self.assertEqual(self.client.get('/projects/', {'fields': 'pledges'}).status_code, 400)
+        self.assertEqual(self.client.get('/projects/', {'expand': 'owner'}).status_code, 400)
+
+
+class BatchTest(TestCase):
+
+    def setUp(self):
+        self.shelter, self.supporter, self.projects = make_catalog(5)
+        self.token = Token.objects.create(user=self.supporter)
+
+    def test_ids_filter(self):
+        wanted = sorted([self.projects[1].pk, self.projects[3].pk])
+        with self.assertNumQueries(3):
+            response = self.client.get('/projects/', {'ids': '%d,%d,0' % tuple(wanted)})
+        self.assertEqual([project['id'] for project in response.json()], wanted)
+        self.assertEqual(self.client.get('/projects/', {'ids': '1,x'}).status_code, 400)
+
+    def test_dashboard_in_one_call(self):
+        ids = ','.join(str(project.pk) for project in self.projects[:3])
+        urls = [
+            '/projects/?ids=%s&fields=id,title,amount_raised' % ids,
+            '/%d/pledges/' % self.supporter.pk,
+            '/%d/recommended/' % self.supporter.pk,
+            '/%d/shelter/' % self.shelter.owner_id,
+            '/users/%d/' % self.supporter.pk,
+        ]
+        auth = {'HTTP_AUTHORIZATION': 'Token %s' % self.token.key}
+        token_cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/batch/', {'requests': urls}, content_type='application/json', **auth)
+        self.assertEqual(response.status_code, 200)
+        auth_queries = [query for query in queries.captured_queries if 'authtoken_token' in query['sql']]
+        self.assertEqual(len(auth_queries), 1)
+
+        for url, result in zip(urls, response.json()['responses']):
+            self.assertEqual(result['url'], url)
+            self.assertEqual(result['status'], 200)
+            self.assertEqual(result['body'], self.client.get(url, **auth).json())
+
+    def test_runs_as_the_batch_user(self):
+        project = self.projects[0]
+        url = '/projects/%d/' % project.pk
+        response = self.client.post('/batch/', {'requests': [url]}, content_type='application/json')
+        self.assertEqual(response.json()['responses'][0]['body']['title'], project.title)
+
+    def test_bad_requests(self):
+        def batch(requests):
+            return self.client.post('/batch/', {'requests': requests}, content_type='application/json')
+
+        statuses = [result['status'] for result in batch([
+            '/nowhere/', 'https://example.com/projects/', '/batch/', '/admin/', '/projects/?stream=true',
+            '/projects/0/',
+        ]).json()['responses']]
+        self.assertEqual(statuses, [404, 400, 400, 400, 400, 404])
+        self.assertEqual(batch('/projects/').status_code, 400)
+        self.assertEqual(batch(['/projects/'] * 21).status_code, 400)
+
+    def test_failing_sub_requests_get_their_own_status(self):
+        staff = CustomUser.objects.create_user(email='staff@example.com', password='pw', is_staff=True)
+        self.client.force_login(staff)
+        url = '/projects/%d/' % self.projects[0].pk
+        with mock.patch.object(ProjectDetail, 'get', side_effect=ValueError('boom')):
+            with self.assertLogs('crowdfunding.batch', 'ERROR'):
+                response = self.client.post('/batch/', {
+                    'requests': ['/999999/pledges/', url, '/metrics/', '/projects/'],
+                }, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['responses']
+        self.assertEqual([result['status'] for result in results], [404, 500, 400, 200])
+        self.assertEqual(results[2]['body']['detail'], 'Only JSON API responses can be batched.')
+
+
+class TrendingTest(TestCase):
+
+    def setUp(self):
+        self.shelter, self.supporter, self.projects = make_catalog(3)
+        self.other = CustomUser.objects.create_user(email='other@example.com', password='pw')
+        self.other_shelter = Shelter.objects.create(
+            name='Other', description='', address='', charityregister=2,
+            is_approved=True, owner=self.other
+        )
+        self.other_project = Project.objects.create(
+            title='Other project', description='', goal=100, image='', is_open=True,
+            date_created=timezone.now(), owner=self.other
+        )
+
+    def pledge(self, project, amount):
+        return Pledge.objects.create(
+            amount=amount, comment='', anonymous=False, project=project, supporter=self.supporter
+        )
+
+    def test_pledges_fill_buckets(self):
+        self.pledge(self.projects[0], 10)
+        self.pledge(self.projects[0], 15)
+        bucket = PledgeBucket.objects.get(project=self.projects[0])
+        self.assertEqual((bucket.amount, bucket.pledges, bucket.width), (25, 2, trending.BUCKET_WIDTH))
+
+    def test_trending_projects(self):
+        self.pledge(self.projects[0], 10)
+        self.pledge(self.projects[2], 30)
+        self.pledge(self.projects[2], 5)
+        # an old pledge only counts for the longer windows
+        PledgeBucket.objects.create(
+            project=self.projects[1], start=timezone.now() - timedelta(hours=5),
+            width=trending.BUCKET_WIDTH, amount=100, pledges=1
+        )
+        trending.refresh_rankings()
+
+        with self.assertNumQueries(3):
+            body = self.client.get('/projects/trending/', {'window': 'hour'}).json()
+        self.assertEqual(
+            [(row['rank'], row['project']['id'], row['amount'], row['pledges']) for row in body],
+            [(1, self.projects[2].pk, 35, 2), (2, self.projects[0].pk, 10, 1)]
+        )
+        self.assertNotIn('pledges', body[0]['project'])
+        self.assertEqual(body[0]['project']['title'], self.projects[2].title)
+
+        body = self.client.get('/projects/trending/', {'fields': 'id,title'}).json()
+        self.assertEqual(body[0]['project'], {'id': self.projects[1].pk, 'title': self.projects[1].title})
+        self.assertEqual(self.client.get('/projects/trending/', {'window': 'year'}).status_code, 400)
+
+    def test_shelter_leaderboard(self):
+        self.pledge(self.projects[0], 10)
+        self.pledge(self.projects[1], 10)
+        self.pledge(self.other_project, 15)
+        trending.refresh_rankings()
+        body = self.client.get('/shelters/leaderboard/').json()
+        self.assertEqual(
+            [(row['shelter']['id'], row['amount']) for row in body],
+            [(self.shelter.pk, 20), (self.other_shelter.pk, 15)]
+        )
+
+    def test_rankings_expire_cached_responses(self):
+        self.assertEqual(self.client.get('/projects/trending/').json(), [])
+        self.pledge(self.projects[0], 10)
+        trending.refresh_rankings()
+        self.assertEqual(len(self.client.get('/projects/trending/').json()), 1)
+
+    def test_compact(self):
+        now = timezone.now()
+        start = trending.bucket_start(now - timedelta(days=2), trending.COMPACTED_WIDTH)
+        for minutes in (0, 5, 10):
+            PledgeBucket.objects.create(
+                project=self.projects[0], start=start + timedelta(minutes=minutes),
+                width=trending.BUCKET_WIDTH, amount=10, pledges=1
+            )
+        PledgeBucket.objects.create(
+            project=self.projects[0], start=now - timedelta(weeks=2),
+            width=trending.COMPACTED_WIDTH, amount=10, pledges=1
+        )
+        trending.compact(now)
+        self.assertEqual(
+            list(PledgeBucket.objects.values_list('start', 'width', 'amount', 'pledges')),
+            [(start, trending.COMPACTED_WIDTH, 30, 3)]
+        )
+        trending.refresh_rankings(now)
+        self.assertEqual(
+            list(Ranking.objects.filter(kind='project').values_list('window', 'amount')),
+            [('week', 30)]
+        )
+
+
+class ReplicaTest(TestCase):
+
+    def setUp(self):
+        self.shelter, self.supporter, self.projects = make_catalog(1)
+        self.token = Token.objects.create(user=self.supporter)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.add_database('replica1', os.path.join(directory.name, 'replica1.sqlite3'))
+        self.add_database('broken', os.path.join(directory.name, 'missing', 'broken.sqlite3'))
+        call_command('migrate', database='replica1', verbosity=0)
+        # the supporter and their token, and a project only the replica has,
+        # bulk_create so no signal writes to the primary
+        CustomUser.objects.using('replica1').bulk_create([
+            CustomUser(pk=self.supporter.pk, email=self.supporter.email),
+            CustomUser(pk=1000, email='replica@example.com'),
+        ])
+        Token.objects.using('replica1').bulk_create([Token(key=self.token.key, user_id=self.supporter.pk)])
+        Project.objects.using('replica1').bulk_create([Project(
+            pk=1000, title='Replica only', description='', goal=1, image='', is_open=True,
+            date_created=timezone.now(), owner_id=1000
+        )])
+        replicas._health.clear()
+        self.addCleanup(replicas._health.clear)
+
+    def add_database(self, alias, name):
+        connections.databases[alias] = dict(connections.databases['default'], NAME=name, TEST={})
+
+        def remove():
+            connections[alias].close()
+            del connections.databases[alias]
+            delattr(connections._connections, alias)
+        self.addCleanup(remove)
+
+    def get(self, url, **headers):
+        # a new query string each time, so no cached response is served
+        self.requests = getattr(self, 'requests', 0) + 1
+        return self.client.get(url, {'request': self.requests}, **headers).status_code
+
+    @override_settings(DATABASE_REPLICAS=['replica1'])
+    def test_reads_from_the_replica_until_the_client_writes(self):
+        auth = {'HTTP_AUTHORIZATION': 'Token %s' % self.token.key}
+        self.assertEqual(self.get('/projects/1000/', **auth), 200)
+        self.assertEqual(self.get('/projects/%d/' % self.projects[0].pk, **auth), 404)
+
+        response = self.client.post('/pledges/', {
+            'amount': 5, 'comment': 'Good luck', 'anonymous': False, 'project_id': self.projects[0].pk,
+        }, content_type='application/json', **auth)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.get('/projects/1000/', **auth), 404)
+        self.assertEqual(self.get('/projects/%d/' % self.projects[0].pk, **auth), 200)
+        # other clients still read from the replica
+        self.assertEqual(self.get('/projects/1000/'), 200)
+
+    @override_settings(DATABASE_REPLICAS=['replica1'])
+    def test_credentials_are_read_from_the_primary(self):
+        # neither the user nor a token or session of theirs has reached the replica
+        user = CustomUser.objects.create_user(email='new@example.com', password='pw')
+        response = self.client.post('/api-token-auth/', {'username': user.email, 'password': 'pw'})
+        auth = {'HTTP_AUTHORIZATION': 'Token %s' % response.json()['token']}
+        self.assertEqual(self.get('/projects/1000/', **auth), 200)
+
+        self.client.force_login(user)
+        with CaptureQueriesContext(connections['replica1']) as queries:
+            self.assertEqual(self.get('/projects/1000/'), 200)
+        tables = ('FROM "django_session"', 'FROM "users_customuser"')
+        self.assertFalse([query for query in queries if query['sql'].split(' WHERE')[0].endswith(tables)])
+        self.assertTrue(queries)
+
+    @override_settings(DATABASE_REPLICAS=['replica1'])
+    def test_replica_reads_are_not_cached(self):
+        for _ in range(2):
+            response = self.client.get('/projects/1000/')
+            self.assertEqual((response.status_code, response['X-Cache']), (200, 'MISS'))
+        with override_settings(DATABASE_REPLICAS=[]):
+            self.client.get('/projects/%d/' % self.projects[0].pk)
+            self.assertEqual(self.client.get('/projects/%d/' % self.projects[0].pk)['X-Cache'], 'HIT')
+
+    def test_replicas_need_a_shared_cache(self):
+        with override_settings(DATABASE_REPLICAS=['replica1']):
+            self.assertEqual([error.id for error in checks.check_replica_pins(None)], ['crowdfunding.E001'])
+        with override_settings(
+            DATABASE_REPLICAS=['replica1'],
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'cache'}},
+        ):
+            self.assertEqual(checks.check_replica_pins(None), [])
+
+    @override_settings(DATABASE_REPLICAS=['broken', 'replica1'])
+    def test_unhealthy_replicas_leave_the_rotation(self):
+        with mock.patch.object(replicas, '_check', wraps=replicas._check) as check, \
+                self.assertLogs('crowdfunding.replicas', 'WARNING'):
+            picked = {replicas.pick_replica() for _ in range(4)}
+        self.assertEqual(picked, {'replica1'})
+        # each checked once, then remembered
+        self.assertEqual(sorted(call.args[0] for call in check.call_args_list), ['broken', 'replica1'])
+
+    @override_settings(DATABASE_REPLICAS=['broken'])
+    def test_falls_back_to_the_primary(self):
+        with self.assertLogs('crowdfunding.replicas', 'WARNING'):
+            self.assertEqual(self.get('/projects/%d/' % self.projects[0].pk), 200)
+
+
+class IdempotencyTest(TestCase):
+
+    def setUp(self):
+        self.shelter, self.supporter, self.projects = make_catalog(1)
+        self.project = self.projects[0]
+        self.client.force_login(self.supporter)
+
+    def pledge(self, key=None, amount=10, project_id=None):
+        headers = {'HTTP_IDEMPOTENCY_KEY': key} if key is not None else {}
+        return self.client.post('/pledges/', {
+            'amount': amount, 'comment': 'Good luck', 'anonymous': False,
+            'project_id': project_id or self.project.pk,
+        }, content_type='application/json', **headers)
+
+    def test_retries_replay_the_first_response(self):
+        first = self.pledge('attempt-1')
+        retry = self.pledge('attempt-1')
+        self.assertEqual((first.status_code, retry.status_code), (201, 201))
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertFalse(first.has_header('Idempotent-Replayed'))
+        self.assertEqual(self.pledge('attempt-2').status_code, 201)
+
+        self.project.refresh_from_db()
+        # make_catalog's bulk created pledge is not in the totals
+        self.assertEqual((self.project.pledge_count, self.project.amount_raised), (2, 20))
+
+    def test_keys_belong_to_a_user(self):
+        self.pledge('attempt-1')
+        other = CustomUser.objects.create_user(email='other@example.com', password='pw')
+        self.client.force_login(other)
+        self.assertFalse(self.pledge('attempt-1').has_header('Idempotent-Replayed'))
+        self.assertEqual(Pledge.objects.filter(project=self.project).count(), 3)
+
+    def test_reused_key_with_another_body(self):
+        self.pledge('attempt-1')
+        self.assertEqual(self.pledge('attempt-1', amount=20).status_code, 422)
+        self.assertEqual(self.pledge('x' * 256).status_code, 400)
+
+    def test_failures_are_not_stored(self):
+        self.assertEqual(self.pledge('attempt-1', project_id=10 ** 6).status_code, 400)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertEqual(self.pledge('attempt-1').status_code, 201)
+
+    @override_settings(IDEMPOTENCY_KEY_TTL=60)
+    def test_expiry(self):
+        self.pledge('attempt-1')
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(minutes=2))
+        self.assertFalse(self.pledge('attempt-1').has_header('Idempotent-Replayed'))
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(minutes=2))
+        self.assertEqual(idempotency.purge_expired(), 1)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'runs on a SQLite file database')
+class ConcurrentPledgeTest(TestCase):
+    # The in-memory test database fails a second writer instead of making it
+    # wait, so the pledges go to a SQLite file, which queues writers like a
+    # deployed database does. Each thread swaps in its own connection to it.
+    threads = 8
+    pledges_per_supporter = 5
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.database = dict(
+            connections.databases['default'], NAME=os.path.join(directory.name, 'db.sqlite3'), TEST={}
+        )
+        self.on_file_database(call_command, 'migrate', verbosity=0)
+        self.shelter, self.supporter, self.projects = self.on_file_database(make_catalog, 1)
+        self.supporters = self.on_file_database(lambda: [
+            CustomUser.objects.create_user(email='supporter-%d@example.com' % i, password='pw')
+            for i in range(self.threads)
+        ])
+        self.project = self.projects[0]
+
+    def on_file_database(self, function, *args, **kwargs):
+        def run():
+            connections._connections.default = type(connections['default'])(self.database)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                connections['default'].close()
+        with ThreadPoolExecutor(1) as pool:
+            return pool.submit(run).result()
+
+    def parallel(self, calls):
+        with ThreadPoolExecutor(self.threads) as pool:
+            futures = [pool.submit(self.on_file_database, *call) for call in calls]
+            return [future.result() for future in futures]
+
+    def pledge(self, supporter, amount, key=None):
+        client = Client()
+        client.force_login(supporter)
+        headers = {'HTTP_IDEMPOTENCY_KEY': key} if key else {}
+        response = client.post('/pledges/', {
+            'amount': amount, 'comment': 'Good luck', 'anonymous': False, 'project_id': self.project.pk,
+        }, content_type='application/json', **headers)
+        return response.status_code, response.json()
+
+    def totals(self):
+        project = Project.objects.get(pk=self.project.pk)
+        return project.amount_raised, project.pledge_count, project.unique_supporter_count
+
+    def test_totals_stay_exact(self):
+        calls = [
+            (self.pledge, supporter, amount)
+            for amount in range(1, self.pledges_per_supporter + 1)
+            for supporter in self.supporters
+        ]
+        results = self.parallel(calls)
+        self.assertEqual({code for code, _ in results}, {201})
+
+        amount = sum(amount for _, _, amount in calls)
+        self.assertEqual(self.on_file_database(self.totals), (amount, len(calls), self.threads))
+
+    def test_concurrent_retries_pledge_once(self):
+        supporter = self.supporters[0]
+        results = self.parallel([(self.pledge, supporter, 10, 'attempt-1')] * self.threads)
+        self.assertEqual({code for code, _ in results}, {201})
+        self.assertEqual(len({body['id'] for _, body in results}), 1)
+        self.assertEqual(self.on_file_database(self.totals), (10, 1, 1))
+
+
+@override_settings(EVENTS_POLL_INTERVAL=0.01)
+class LiveEventsTest(TestCase):
+
+    def setUp(self):
+        self.shelter, self.supporter, self.projects = make_catalog(1)
+        self.project = self.projects[0]
+
+    def connect(self, project_id=None, last_event_id=None):
+        headers = [(b'last-event-id', str(last_event_id).encode())] if last_event_id else []
+        communicator = ApplicationCommunicator(application, {
+            'type': 'http', 'method': 'GET', 'path': '/projects/%d/events/' % (project_id or self.project.pk),
+            'query_string': b'', 'headers': headers,
+        })
+        return communicator
+
+    async def open(self, communicator):
+        await communicator.send_input({'type': 'http.request'})
+        start = await communicator.receive_output(1)
+        body = await communicator.receive_output(1)
+        return start, body['body'].decode()
+
+    async def close(self, communicator):
+        await communicator.send_input({'type': 'http.disconnect'})
+        await communicator.wait(1)
+
+    def pledge(self, amount):
+        return Pledge.objects.create(
+            amount=amount, comment='Go!', anonymous=False, project=self.project, supporter=self.supporter
+        )
+
+    def test_streams_pledges_and_totals(self):
+        async def scenario():
+            communicator = self.connect()
+            start, body = await self.open(communicator)
+            self.assertEqual(start['status'], 200)
+            self.assertIn((b'content-type', b'text/event-stream'), start['headers'])
+            self.assertTrue(body.startswith('event: totals\ndata: '))
+            self.assertEqual(json.loads(body.split('data: ')[1])['amount_raised'], 0)
+
+            pledge = await sync_to_async(self.pledge, thread_sensitive=True)(20)
+            pledged = (await communicator.receive_output(1))['body'].decode()
+            totals = (await communicator.receive_output(1))['body'].decode()
+            self.assertIn('event: pledge\n', pledged)
+            self.assertEqual(json.loads(pledged.split('data: ')[1])['id'], pledge.pk)
+            self.assertIn('event: totals\n', totals)
+            self.assertEqual(json.loads(totals.split('data: ')[1])['amount_raised'], 20)
+            await self.close(communicator)
+        async_to_sync(scenario)()
+        # the last client gone, the broadcaster stops polling
+        self.assertEqual((dict(events.broadcaster.clients), events.broadcaster.poller), ({}, None))
+
+    def test_fan_out(self):
+        async def scenario():
+            communicators = [self.connect() for _ in range(50)]
+            for communicator in communicators:
+                await self.open(communicator)
+            await sync_to_async(self.pledge, thread_sensitive=True)(5)
+            for communicator in communicators:
+                self.assertIn(b'event: pledge', (await communicator.receive_output(1))['body'])
+                await self.close(communicator)
+        with mock.patch.object(events.DatabaseBackend, 'read', autospec=True, side_effect=events.DatabaseBackend.read) as read:
+            async_to_sync(scenario)()
+        # one query per poll for every client, never one per client
+        self.assertLess(read.call_count, 50)
+
+    def test_resumes_from_last_event_id(self):
+        self.pledge(5)
+        seen = ProjectEvent.objects.latest('id').pk
+        self.pledge(7)
+
+        async def scenario():
+            communicator = self.connect(last_event_id=seen)
+            _, body = await self.open(communicator)
+            await self.close(communicator)
+            return body
+        body = async_to_sync(scenario)()
+        self.assertEqual(body.count('event: pledge'), 1)
+        self.assertIn('"amount": 7', body)
+        self.assertIn('id: %d\n' % (seen + 1), body)
+
+    @override_settings(EVENTS_KEEPALIVE=0.01)
+    def test_keepalive(self):
+        async def scenario():
+            communicator = self.connect()
+            await self.open(communicator)
+            self.assertEqual((await communicator.receive_output(1))['body'], b': keepalive\n\n')
+            await self.close(communicator)
+        async_to_sync(scenario)()
+
+    def test_unknown_project(self):
+        async def scenario():
+            communicator = self.connect(project_id=10 ** 6)
+            await communicator.send_input({'type': 'http.request'})
+            return await communicator.receive_output(1)
+        self.assertEqual(async_to_sync(scenario)()['status'], 404)
+
+    def test_other_paths_reach_django(self):
+        async def scenario():
+            communicator = ApplicationCommunicator(application, {
+                'type': 'http', 'method': 'GET', 'path': '/projects/%d/' % self.project.pk,
+                'query_string': b'', 'headers': [],
+            })
+            await communicator.send_input({'type': 'http.request'})
+            return await communicator.receive_output(5)
+        self.assertEqual(async_to_sync(scenario)()['status'], 200)
+
+
+class PetTagSnapshotTest(TestCase):
+
+    def setUp(self):
+        self.shelter, self.supporter, self.projects = make_catalog(1)
+        PetTag.objects.create(petspecies='cat')
+        PetTag.objects.create(petspecies='rabbit')
+        self.data = {
+            'title': 'Hops', 'description': 'A hutch', 'goal': 100, 'image': 'https://example.com/h.png',
+            'is_open': True, 'date_created': timezone.now(), 'species': ['dog', 'cat', 'rabbit'],
+        }
+
+    def test_resolves_species_without_queries(self):
+        pettags.snapshot()
+        serializer = ProjectSerializer(data=self.data)
+        with self.assertNumQueries(0):
+            self.assertTrue(serializer.is_valid(), serializer.errors)
+        self.assertEqual(
+            [tag.petspecies for tag in serializer.validated_data['species']], ['dog', 'cat', 'rabbit']
+        )
+        project = serializer.save(owner=self.shelter.owner)
+        self.assertEqual(sorted(project.species.values_list('petspecies', flat=True)), ['cat', 'dog', 'rabbit'])
+
+    def test_unknown_species_is_rejected(self):
+        serializer = ProjectSerializer(data=dict(self.data, species=['dog', 'dragon']))
+        self.assertFalse(serializer.is_valid())
+        self.assertIn('dragon', str(serializer.errors['species']))
+
+    def test_new_category_is_served_and_resolved(self):
+        admin = CustomUser.objects.create_superuser(email='admin@example.com', password='pw')
+        self.client.force_login(admin)
+        self.client.get('/petcategories/')
+        self.assertEqual(self.client.post('/petcategories/', {'petspecies': 'ferret'}).status_code, 201)
+        self.client.logout()
+        response = self.client.get('/petcategories/')
+        self.assertEqual(response.json()[-1]['petspecies'], 'ferret')
+        with self.assertNumQueries(0):
+            self.client.get('/petcategories/')
+        self.assertTrue(ProjectSerializer(data=dict(self.data, species=['ferret'])).is_valid())
+
+    def test_tag_the_snapshot_has_not_seen_is_found(self):
+        pettags.snapshot()
+        # bulk_create sends no signal, so the snapshot version stays
+        PetTag.objects.bulk_create([PetTag(petspecies='ferret')])
+        serializer = ProjectSerializer(data=dict(self.data, species=['ferret']))
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        self.assertIn('ferret', [tag['petspecies'] for tag in pettags.snapshot().rows])
@@ -0,0 +1,132 @@
+"""
+Pledge velocity per project and shelter over the last hour, day and week.
+
+Every new pledge adds its amount to its project's PledgeBucket for the
+current five minutes, so nothing ever scans Pledge. compact() folds
+buckets older than a day into hourly ones and drops those older than the
+longest window. refresh_rankings() sums the buckets inside each window
+and stores the top RANKING_SIZE projects and shelters as Ranking rows,
+which is all the trending and leaderboard endpoints read.
+
+The update_rankings task does both, `manage.py run_workers` enqueues it
+every minute; `manage.py refresh_rankings` runs it by hand. Deleted
+pledges are not taken back out: the windows count pledges as they were
+made.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from tasks.queue import task
+from .cache import bump_versions
+from .models import Pledge, PledgeBucket, Ranking
+
+BUCKET_WIDTH = 5 * 60
+COMPACTED_WIDTH = 60 * 60
+# fine buckets older than this are folded into hourly ones
+COMPACT_AFTER = timedelta(days=1)
+WINDOWS = {
+    'hour': timedelta(hours=1),
+    'day': timedelta(days=1),
+    'week': timedelta(weeks=1),
+}
+KINDS = ('project', 'shelter')
+
+
+def bucket_start(moment, width):
+    return datetime.fromtimestamp(int(moment.timestamp()) // width * width, timezone.utc)
+
+
+def add_to_bucket(project_id, start, width, amount, pledges=1):
+    counts = {'amount': F('amount') + amount, 'pledges': F('pledges') + pledges}
+    bucket = PledgeBucket.objects.filter(project_id=project_id, start=start, width=width)
+    if bucket.update(**counts):
+        return
+    try:
+        # a savepoint, so losing the race to insert leaves the transaction usable
+        with transaction.atomic():
+            PledgeBucket.objects.create(
+                project_id=project_id, start=start, width=width, amount=amount, pledges=pledges
+            )
+    except IntegrityError:
+        bucket.update(**counts)
+
+
+def compact(now=None):
+    """ fold old five minute buckets into hourly ones, drop what no window reaches """
+    now = now or timezone.now()
+    cutoff = bucket_start(now - COMPACT_AFTER, COMPACTED_WIDTH)
+    old = PledgeBucket.objects.filter(width=BUCKET_WIDTH, start__lt=cutoff)
+    with transaction.atomic():
+        merged = defaultdict(lambda: [0, 0])
+        for project_id, start, amount, pledges in old.values_list('project_id', 'start', 'amount', 'pledges'):
+            totals = merged[project_id, bucket_start(start, COMPACTED_WIDTH)]
+            totals[0] += amount
+            totals[1] += pledges
+        for (project_id, start), (amount, pledges) in merged.items():
+            add_to_bucket(project_id, start, COMPACTED_WIDTH, amount, pledges)
+        old.delete()
+        oldest = now - max(WINDOWS.values()) - timedelta(seconds=COMPACTED_WIDTH)
+        PledgeBucket.objects.filter(start__lt=oldest).delete()
+
+
+def top(kind, window, now=None, size=None):
+    """ [(object id, amount, pledges)] of the biggest raisers in the window, computed now """
+    now = now or timezone.now()
+    buckets = PledgeBucket.objects.filter(start__gte=now - WINDOWS[window])
+    if kind == 'shelter':
+        buckets = buckets.filter(project__owner__shelter__isnull=False)
+        key = F('project__owner__shelter')
+    else:
+        key = F('project_id')
+    rows = (
+        buckets.values(object=key)
+        .annotate(total=Sum('amount'), count=Sum('pledges'))
+        .order_by('-total', '-count', 'object')
+    )
+    return [(row['object'], row['total'], row['count']) for row in rows[:size or settings.RANKING_SIZE]]
+
+
+def refresh_rankings(now=None):
+    now = now or timezone.now()
+    with transaction.atomic():
+        for kind in KINDS:
+            for window in WINDOWS:
+                Ranking.objects.filter(kind=kind, window=window).delete()
+                Ranking.objects.bulk_create(
+                    Ranking(
+                        kind=kind, window=window, rank=rank, object_id=object_id,
+                        amount=amount, pledges=pledges
+                    )
+                    for rank, (object_id, amount, pledges) in enumerate(top(kind, window, now), 1)
+                )
+    bump_versions('rankings')
+
+
+@task
+def update_rankings():
+    compact()
+    refresh_rankings()
+
+
+def count_pledges(pledges):
+    """ add just created pledges to the current buckets, for bulk inserts that skip signals """
+    start = bucket_start(timezone.now(), BUCKET_WIDTH)
+    totals = defaultdict(lambda: [0, 0])
+    for pledge in pledges:
+        totals[pledge.project_id][0] += pledge.amount
+        totals[pledge.project_id][1] += 1
+    for project_id, (amount, count) in totals.items():
+        add_to_bucket(project_id, start, BUCKET_WIDTH, amount, count)
+
+
+@receiver(post_save, sender=Pledge)
+def count_pledge(sender, instance, created, **kwargs):
+    if created:
+        count_pledges([instance])
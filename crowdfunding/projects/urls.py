@@ -4,16 +4,20 @@ from . import views
 
 urlpatterns = [
     path('shelters/', views.ShelterList.as_view()),
+    path('shelters/leaderboard/', views.ShelterLeaderboard.as_view()),
     path('shelters/<int:pk>/', views.ShelterDetail.as_view()),
     path('projects/', views.ProjectList.as_view()),
+    path('projects/trending/', views.TrendingProjects.as_view()),
     path('projects/<int:pk>/', views.ProjectDetail.as_view()),
     path('pledges/', views.PledgeList.as_view()),
+    path('pledges/import/', views.PledgeImport.as_view()),
     path('<int:pk>/pledges/', views.UsersPledges.as_view()),
     path('petcategories/', views.PetCategory.as_view()),
     path('<int:pk>/shelter-projects/', views.SheltersProjects.as_view()),
     path('<int:pk>/recommended/', views.RecommendedProjects.as_view()),
     path('<int:pk>/supported-projects/', views.UsersSupportedProjects.as_view()),
-    path('<int:pk>/shelter/', views.UsersShelters.as_view())
+    path('<int:pk>/shelter/', views.UsersShelters.as_view()),
+    path('search/', views.Search.as_view()),
 ]
 
 urlpatterns = format_suffix_patterns(urlpatterns)
\ No newline at end of file
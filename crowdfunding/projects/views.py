@@ -1,24 +1,49 @@
 from django.http import Http404
 from django.contrib.auth import get_user_model
+from django.db.models import F
 from rest_framework import status, permissions, generics
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.exceptions import ParseError
-from .models import Project, Pledge, PetTag, Shelter
+from rest_framework.exceptions import APIException, ParseError
+from rest_framework.filters import OrderingFilter
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from .models import Project, Pledge, Ranking, Shelter
+from .pagination import RecommendationPagination
 from .serializers import ProjectSerializer, PledgeSerializer, ProjectDetailSerializer, PetsSerializer, ShelterSerializer, ShelterDetailSerializer
+from .cache import cached_response
+from . import pettags
+from .conditional import conditional_get, row_state, version_state
+from .encoders import RowEncoder, sparse_fields
+from .filters import ProjectFilter
+from .idempotency import idempotent
+from .imports import import_pledges, read_rows
 from .permissions import IsOwnerOrReadOnly, IsGetOrIsAdmin
+from .search import KINDS, SearchUnavailable, search
+from .streaming import stream_json_list, wants_stream
+from .trending import WINDOWS
 from users.models import CustomUser, Profile
 
+# read-only fast path for the hot list views, same output as the serializers
+shelter_rows = RowEncoder(ShelterSerializer, Shelter)
+project_rows = RowEncoder(ProjectSerializer, Project)
+pledge_rows = RowEncoder(PledgeSerializer, Pledge)
 
 # Shelters
 
-class ShelterList(APIView):
+class ShelterList(generics.GenericAPIView):
     # Create a new shelter, get list of shelters
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    serializer_class = ShelterSerializer
+    query_budget = {'GET': 5}
+
+    @conditional_get(lambda: version_state('shelters'))
+    @cached_response('shelters')
     def get(self, request):
-        shelters = Shelter.objects.all()
-        serializer = ShelterSerializer(shelters, many=True)
-        return Response(serializer.data)
+        shelters = shelter_rows.rows(Shelter.objects.all())
+        page = self.paginate_queryset(shelters)
+        if page is not None:
+            return self.get_paginated_response(shelter_rows.encode(page))
+        return Response(shelter_rows.encode(shelters))
 
     def post(self, request):
         serializer = ShelterSerializer(data=request.data)
@@ -38,13 +63,15 @@ class ShelterDetail(APIView):
     permission_classes = [permissions.IsAuthenticatedOrReadOnly,
         IsOwnerOrReadOnly
     ]
+    query_budget = {'GET': 6}
 
     def get_object(self, pk):
         try:
-            return Shelter.objects.get(pk=pk)
+            return Shelter.objects.select_related('owner').prefetch_related('species').get(pk=pk)
         except Shelter.DoesNotExist:
             raise Http404
 
+    @conditional_get(lambda pk: row_state(Shelter.objects.all(), pk))
     def get(self, request, pk):
         shelter = self.get_object(pk)
         serializer = ShelterDetailSerializer(shelter)
@@ -84,30 +111,47 @@ class UsersShelters(generics.RetrieveAPIView):
     def get_object(self):
         user_id = self.kwargs['pk']
         try:
-            return Shelter.objects.get(owner=user_id)
+            return Shelter.objects.select_related('owner').prefetch_related('species').get(owner=user_id)
         except Shelter.DoesNotExist:
             raise Http404
 
 
 # Projects
 
-class ProjectList(APIView):
+class ProjectList(generics.GenericAPIView):
     # Create a new project, get list of projects
 
     #this permission allows users logged in to create projects and 
     # non logged in users to read project
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    serializer_class = ProjectSerializer
+    filter_backends = [ProjectFilter, OrderingFilter]
+    ordering_fields = ['id', 'date_created', 'goal', 'amount_raised', 'title']
+    ordering = ['id']
+    query_budget = {'GET': 5}
 
+    @conditional_get(lambda: version_state('projects'))
+    @cached_response('projects')
     def get(self, request):
-        projects = Project.objects.all()
-        serializer = ProjectSerializer(projects, many=True)
-        return Response(serializer.data)
+        rows = project_rows
+        fields = sparse_fields(request, project_rows)
+        if fields is not None:
+            # whatever the client orders by stays readable for the cursor
+            rows = project_rows.only(fields, self.ordering_fields)
+        projects = rows.rows(self.filter_queryset(Project.objects.all()))
+        if wants_stream(request):
+            return stream_json_list(projects, rows=rows)
+        page = self.paginate_queryset(projects)
+        if page is not None:
+            return self.get_paginated_response(rows.encode(page))
+        return Response(rows.encode(projects))
 
     def post(self, request):
         serializer = ProjectSerializer(data=request.data)
         if serializer.is_valid():
             project = serializer.instance
-            if not request.user.shelter.is_approved:
+            # from the database, not the shelter cached with the user
+            if not Shelter.objects.filter(owner_id=request.user.pk, is_approved=True).exists():
                 raise ParseError('Shelter is not approved, can not create projects')
             serializer.save(owner=request.user)
             return Response(
@@ -124,14 +168,24 @@ class ProjectDetail(APIView):
     permission_classes = [permissions.IsAuthenticatedOrReadOnly,
     IsOwnerOrReadOnly
     ]
+    query_budget = {'GET': 6}
 
     def get_object(self, pk):
         try:
-            return Project.objects.get(pk=pk)
+            return Project.objects.with_related().get(pk=pk)
         except Project.DoesNotExist:
             raise Http404
 
+    @conditional_get(lambda pk: row_state(Project.objects.all(), pk))
+    @cached_response('project:{pk}')
     def get(self, request, pk):
+        fields = sparse_fields(request, project_rows)
+        if fields is not None:
+            rows = project_rows.only(fields)
+            data = rows.encode(rows.rows(Project.objects.filter(pk=pk)))
+            if not data:
+                raise Http404
+            return Response(data[0])
         project = self.get_object(pk)
         serializer = ProjectDetailSerializer(project)
         return Response(serializer.data)
@@ -170,44 +224,99 @@ class ProjectDetail(APIView):
 class SheltersProjects(generics.ListAPIView):
     # Get list of all projects associated with shelter in URL
     serializer_class = ProjectSerializer
+    query_budget = 7
 
     def get_queryset(self):
         shelter_id = self.kwargs['pk']
         shelter = Shelter.objects.get(pk=shelter_id)
         user = shelter.owner
-        return Project.objects.filter(owner=user)
+        return Project.objects.with_related().filter(owner=user)
 
 class RecommendedProjects(generics.ListAPIView):
-    # Get list of projects for pets that the current user likes
+    # Get ranked list of open projects for pets that the user likes,
+    # precomputed in projects.recommendations
     serializer_class = ProjectSerializer
+    pagination_class = RecommendationPagination
+    query_budget = 5
 
     def get_queryset(self):
         user_id = self.kwargs['pk']
-        user = CustomUser.objects.get(pk=user_id)
-        liked_list = user.profile.petlikes.all()
-        return Project.objects.filter(species__in=liked_list)
+        return Project.objects.with_related().filter(
+            recommendations__user_id=user_id
+        ).annotate(score=F('recommendations__score')).order_by('-score', 'id')
+
+def ranked(request, kind, encoder):
+    """
+    The precomputed Ranking rows of `kind` for ?window=hour|day|week, each
+    with the ranked object rendered through `encoder` (?fields= applies)
+    """
+    window = request.query_params.get('window', 'day')
+    if window not in WINDOWS:
+        raise ParseError('window must be one of %s' % ', '.join(WINDOWS))
+    rankings = list(
+        Ranking.objects.filter(kind=kind, window=window).order_by('rank')
+        .values_list('object_id', 'rank', 'amount', 'pledges')
+    )
+    fields = sparse_fields(request, encoder) or [
+        name for name in encoder.field_names if name not in encoder.nested
+    ]
+    encoder = encoder.only(fields)
+    rows = list(encoder.rows(encoder.model.objects.filter(pk__in=[ranking[0] for ranking in rankings])))
+    objects = {row[0]: data for row, data in zip(rows, encoder.encode(rows))}
+    # anything deleted since the last refresh is left out
+    return [
+        {'rank': rank, 'amount': amount, 'pledges': pledges, kind: objects[object_id]}
+        for object_id, rank, amount, pledges in rankings if object_id in objects
+    ]
+
+class TrendingProjects(APIView):
+    # Projects raising the most in the last hour, day or week, see projects.trending
+    query_budget = {'GET': 4}
+
+    @conditional_get(lambda: version_state('rankings', 'projects'))
+    @cached_response('rankings', 'projects')
+    def get(self, request):
+        return Response(ranked(request, 'project', project_rows))
+
+class ShelterLeaderboard(APIView):
+    # Shelters raising the most in the last hour, day or week, see projects.trending
+    query_budget = {'GET': 3}
+
+    @conditional_get(lambda: version_state('rankings', 'shelters'))
+    @cached_response('rankings', 'shelters')
+    def get(self, request):
+        return Response(ranked(request, 'shelter', shelter_rows))
 
 class UsersSupportedProjects(generics.ListAPIView):
     # Get list of projects that the current user has supported
     serializer_class = ProjectSerializer
+    query_budget = 6
 
     def get_queryset(self):
         pk = self.kwargs['pk']
         user = CustomUser.objects.get(pk=pk)
-        return Project.objects.filter(pledges__supporter=user)
+        return Project.objects.with_related().filter(pledges__supporter=user)
 
 
 # Pledges
 
-class PledgeList(APIView):
+class PledgeList(generics.GenericAPIView):
     # Create a pledge, return list of pledges
 
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    serializer_class = PledgeSerializer
+    query_budget = {'GET': 3, 'POST': 28}
 
+    @conditional_get(lambda: version_state('pledges'))
     def get(self, request):
-        pledges = Pledge.objects.all()
-        serializer = PledgeSerializer(pledges, many=True)
-        return Response(serializer.data)
+        pledges = Pledge.objects.select_related('supporter__profile')
+        pledges = pledge_rows.rows(pledges)
+        if wants_stream(request):
+            return stream_json_list(pledges, rows=pledge_rows)
+        page = self.paginate_queryset(pledges)
+        if page is not None:
+            return self.get_paginated_response(pledge_rows.encode(page))
+        return Response(pledge_rows.encode(pledges))
 
     def post(self, request):
         serializer = PledgeSerializer(data=request.data)
@@ -215,24 +324,48 @@ class PledgeList(APIView):
         # print(user)
         if serializer.is_valid():
             # serializer.save(supporter=request.user.profile.preferredname)
-            serializer.save(supporter=request.user)
-            return Response(
-                serializer.data,
-                status=status.HTTP_201_CREATED
-            )
+            def create():
+                serializer.save(supporter=request.user)
+                return Response(
+                    serializer.data,
+                    status=status.HTTP_201_CREATED
+                )
+            # retries carrying the same Idempotency-Key get the first response back
+            return idempotent(request, create)
         return Response(
             serializer.errors,
             status=status.HTTP_400_BAD_REQUEST
         )
 
+class PledgeImport(APIView):
+    # Bulk create pledges from a CSV or NDJSON request body
+    # staff may name the supporter of each row, everyone else imports their own pledges
+
+    permission_classes = [permissions.IsAuthenticated]
+    content_types = {
+        'text/csv': 'csv',
+        'application/x-ndjson': 'ndjson',
+    }
+
+    def post(self, request):
+        fmt = self.content_types.get(request.content_type.split(';')[0].strip())
+        if fmt is None:
+            raise ParseError('Send text/csv or application/x-ndjson')
+        # read_rows decodes, reporting rows that are not UTF-8
+        lines = request.stream if request.stream is not None else []
+        supporter = None if request.user.is_staff else request.user
+        report = import_pledges(read_rows(lines, fmt), supporter=supporter)
+        return Response(report)
+
 class UsersPledges(generics.ListAPIView):
     # Get list of pledges that the current user has made
     serializer_class = PledgeSerializer
+    query_budget = 4
 
     def get_queryset(self):
         pk = self.kwargs['pk']
         user = CustomUser.objects.get(pk=pk)
-        return Pledge.objects.filter(supporter=user)
+        return Pledge.objects.select_related('supporter__profile').filter(supporter=user)
     
 
 
@@ -242,6 +375,7 @@ class PetCategory(APIView):
     # Create pet category, return list of all categories
     
     permission_classes = [IsGetOrIsAdmin]
+    query_budget = {'GET': 3}
 
     def post(self, request):
         serializer = PetsSerializer(data=request.data)
@@ -257,6 +391,43 @@ class PetCategory(APIView):
         )
     
     def get(self, request):
-        pets = PetTag.objects.all()
-        serializer = PetsSerializer(pets, many=True)
-        return Response(serializer.data)
\ No newline at end of file
+        # straight from the in-process snapshot, a query only after a tag changed
+        return Response(pettags.snapshot().rows)
+
+
+# Search
+
+class Search(APIView):
+    # Ranked full-text search over projects and shelters
+    # ?q=<terms>, every term matches as a prefix; optional ?type=project|shelter
+    default_limit = 20
+    max_limit = 100
+
+    def get(self, request):
+        query = request.query_params.get('q', '')
+        kind = request.query_params.get('type')
+        if kind is not None and kind not in KINDS:
+            raise ParseError('type must be one of: %s' % ', '.join(KINDS))
+        try:
+            limit = min(max(int(request.query_params.get('limit', self.default_limit)), 1), self.max_limit)
+            offset = max(int(request.query_params.get('offset', 0)), 0)
+        except ValueError:
+            raise ParseError('limit and offset must be integers')
+        try:
+            # one extra row tells us whether there is a next page, without a COUNT
+            results = search(query, kind=kind, limit=limit + 1, offset=offset)
+        except SearchUnavailable as exc:
+            raise APIException(str(exc))
+
+        url = request.build_absolute_uri()
+        next_url = previous_url = None
+        if len(results) > limit:
+            results = results[:limit]
+            next_url = replace_query_param(url, 'offset', offset + limit)
+        if offset > 0:
+            previous_offset = max(offset - limit, 0)
+            previous_url = (
+                replace_query_param(url, 'offset', previous_offset)
+                if previous_offset else remove_query_param(url, 'offset')
+            )
+        return Response({'next': next_url, 'previous': previous_url, 'results': results})
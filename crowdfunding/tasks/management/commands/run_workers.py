@@ -0,0 +1,87 @@
+import logging
+import multiprocessing
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connections
+from django.utils.module_loading import import_string
+
+from crowdfunding import metrics
+from tasks import queue
+
+logger = logging.getLogger(__name__)
+
+
+def _work(batch_size, poll_interval, stop):
+    # the parent handles Ctrl-C and tells every worker through `stop`
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    while not stop.is_set():
+        try:
+            ran = queue.run_once(batch_size)
+        except DatabaseError:
+            logger.exception('Task worker lost its database, reconnecting')
+            connections.close_all()
+            ran = 0
+        metrics.flush()
+        if not ran:
+            stop.wait(poll_interval)
+
+
+class Command(BaseCommand):
+    help = 'Run queued tasks in a pool of worker processes and enqueue the periodic ones.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=2)
+        parser.add_argument('--batch-size', type=int, default=settings.TASKS_BATCH_SIZE)
+        parser.add_argument(
+            '--poll-interval', type=float, default=1.0,
+            help='Seconds an idle worker waits before looking for tasks again.'
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Run every ready task in this process, then exit.'
+        )
+
+    def handle(self, *args, **options):
+        if options['once']:
+            before = queue.queue_stats()
+            queue.run_until_empty()
+            counts = {name: value - before[name] for name, value in queue.queue_stats().items()}
+            self.stdout.write(self.style.SUCCESS(
+                'Ran %(tasks_run)d tasks, %(tasks_retried)d to retry, %(tasks_failed)d failed' % counts
+            ))
+            return
+
+        stop = multiprocessing.Event()
+        # only a flag here, setting `stop` from a handler can deadlock with a wait on it
+        self.stopping = False
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: setattr(self, 'stopping', True))
+        workers = [None] * options['processes']
+        next_run = dict.fromkeys(settings.TASKS_PERIODIC, 0)
+        self.stdout.write('Starting %d task workers' % len(workers))
+
+        while not self.stopping:
+            for i, worker in enumerate(workers):
+                if worker is None or not worker.is_alive():
+                    if worker is not None:
+                        logger.error('Task worker %d exited with %s, restarting', i, worker.exitcode)
+                    # a forked worker must not share this process's connections
+                    connections.close_all()
+                    workers[i] = multiprocessing.Process(
+                        target=_work, args=(options['batch_size'], options['poll_interval'], stop)
+                    )
+                    workers[i].start()
+            now = time.monotonic()
+            for name, interval in settings.TASKS_PERIODIC.items():
+                if now >= next_run[name]:
+                    import_string(name).enqueue()
+                    next_run[name] = now + interval
+            time.sleep(1)
+
+        stop.set()
+        for worker in workers:
+            worker.join()
+        self.stdout.write(self.style.SUCCESS('Task workers stopped'))
@@ -0,0 +1,34 @@
+# Generated by Django 3.0.8 on 2026-10-18 07:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Task',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200)),
+                ('args', models.TextField()),
+                ('key', models.CharField(max_length=40, null=True, unique=True)),
+                ('run_after', models.DateTimeField()),
+                ('attempts', models.IntegerField(default=0)),
+                ('locked_by', models.CharField(blank=True, max_length=32)),
+                ('locked_until', models.DateTimeField(null=True)),
+                ('failed', models.BooleanField(default=False)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['failed', 'run_after'], name='task_ready'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+from django.db import models
+
+
+class Task(models.Model):
+    # a call waiting for `manage.py run_workers`, see tasks.queue
+    name = models.CharField(max_length=200)
+    args = models.TextField()
+    # set while the task waits, so an identical call is coalesced into it
+    key = models.CharField(max_length=40, unique=True, null=True)
+    run_after = models.DateTimeField()
+    attempts = models.IntegerField(default=0)
+    locked_by = models.CharField(max_length=32, blank=True)
+    locked_until = models.DateTimeField(null=True)
+    failed = models.BooleanField(default=False)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['failed', 'run_after'], name='task_ready')]
+
+    def __str__(self):
+        return '%s(%s)' % (self.name, self.args)
@@ -0,0 +1,195 @@
+"""
+A database backed task queue for work that can happen after a response.
+
+    @task(batch=True)
+    def refresh_users(calls):
+        refresh_for_users({user_id for user_id, in calls})
+
+    refresh_users.enqueue(user.pk)
+
+enqueue() stores a Task row in the caller's transaction, so the task
+exists exactly when the write that caused it is committed. An identical
+call (same task, same arguments) still waiting is not stored twice.
+`manage.py run_workers` runs the tasks: each worker claims up to
+TASKS_BATCH_SIZE ready tasks of one name, and a `batch=True` task gets
+all of their arguments in one call, others are called once per task.
+A task that raises is retried with exponential backoff and marked failed
+after TASKS_MAX_ATTEMPTS. A task whose worker died is claimed again once
+its TASKS_LEASE has run out.
+
+Claims are an UPDATE conditioned on the lock, so several workers never
+run the same task, on SQLite as well as PostgreSQL.
+
+With TASKS_EAGER set, as `manage.py test` does, enqueue() runs the task
+right away instead, outside the caller's query budget: a worker would
+run it.
+"""
+import json
+import logging
+import random
+import traceback
+import uuid
+from datetime import timedelta
+from hashlib import sha1
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Min, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from crowdfunding.querybudget import unrecorded
+
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+# per process, read with queue_stats()
+_stats = {'tasks_run': 0, 'tasks_retried': 0, 'tasks_failed': 0}
+
+
+class TaskFunction:
+
+    def __init__(self, function, batch):
+        self.function = function
+        self.batch = batch
+        self.name = '%s.%s' % (function.__module__, function.__name__)
+        self.__doc__ = function.__doc__
+
+    def __call__(self, *args):
+        return self.function(*args)
+
+    def enqueue(self, *args, delay=0):
+        """ run this task with `args`, which must be JSON serializable, after this transaction """
+        encoded = json.dumps(args)
+        if settings.TASKS_EAGER:
+            with unrecorded():
+                self.run([json.loads(encoded)])
+            return
+        try:
+            # a savepoint, so a coalesced call leaves the transaction usable
+            with transaction.atomic():
+                Task.objects.create(
+                    name=self.name, args=encoded,
+                    key=sha1(('%s:%s' % (self.name, encoded)).encode()).hexdigest(),
+                    run_after=timezone.now() + timedelta(seconds=delay)
+                )
+        except IntegrityError:
+            # the same call is already waiting
+            pass
+
+    def run(self, calls):
+        if self.batch:
+            self.function([tuple(args) for args in calls])
+        else:
+            for args in calls:
+                self.function(*args)
+
+
+def task(function=None, *, batch=False):
+    """ make `function` a task, named by its import path """
+    if function is None:
+        return lambda function: TaskFunction(function, batch)
+    return TaskFunction(function, batch)
+
+
+def _ready(now):
+    return Task.objects.filter(failed=False, run_after__lte=now).filter(
+        Q(locked_until__isnull=True) | Q(locked_until__lt=now)
+    )
+
+
+def claim(limit):
+    """ lock up to `limit` ready tasks of one name, oldest first """
+    now = timezone.now()
+    oldest = _ready(now).order_by('run_after').values_list('name', flat=True).first()
+    if oldest is None:
+        return []
+    ids = list(_ready(now).filter(name=oldest).order_by('run_after').values_list('pk', flat=True)[:limit])
+    token = uuid.uuid4().hex
+    # tasks another worker claimed in the meantime no longer match _ready
+    _ready(now).filter(pk__in=ids).update(
+        locked_by=token, locked_until=now + timedelta(seconds=settings.TASKS_LEASE),
+        attempts=F('attempts') + 1, key=None
+    )
+    return list(Task.objects.filter(locked_by=token).order_by('run_after'))
+
+
+def backoff(attempts):
+    """ seconds before retry number `attempts`, doubling, with some jitter """
+    delay = min(settings.TASKS_RETRY_DELAY * 2 ** (attempts - 1), settings.TASKS_MAX_RETRY_DELAY)
+    return delay * random.uniform(1, 1.25)
+
+
+def _run(function, tasks):
+    try:
+        with transaction.atomic():
+            function.run([json.loads(task.args) for task in tasks])
+            Task.objects.filter(pk__in=[task.pk for task in tasks]).delete()
+    except Exception:
+        error = traceback.format_exc()
+        now = timezone.now()
+        for task in tasks:
+            if task.attempts >= settings.TASKS_MAX_ATTEMPTS:
+                logger.error('Task %s failed for good:\n%s', task, error)
+                _stats['tasks_failed'] += 1
+                Task.objects.filter(pk=task.pk).update(failed=True, error=error, locked_until=None)
+            else:
+                logger.warning('Task %s failed, retrying:\n%s', task, error)
+                _stats['tasks_retried'] += 1
+                Task.objects.filter(pk=task.pk).update(
+                    error=error, locked_until=None,
+                    run_after=now + timedelta(seconds=backoff(task.attempts))
+                )
+        return False
+    _stats['tasks_run'] += len(tasks)
+    return True
+
+
+def run_once(limit=None):
+    """ claim and run one batch, returns how many tasks were claimed """
+    tasks = claim(limit or settings.TASKS_BATCH_SIZE)
+    if not tasks:
+        return 0
+    try:
+        function = import_string(tasks[0].name)
+    except ImportError:
+        function = None
+    if not isinstance(function, TaskFunction):
+        logger.error('No task named %s', tasks[0].name)
+        Task.objects.filter(pk__in=[task.pk for task in tasks]).update(
+            failed=True, error='No task named %s' % tasks[0].name, locked_until=None
+        )
+        return len(tasks)
+    if function.batch:
+        _run(function, tasks)
+    else:
+        for task in tasks:
+            _run(function, [task])
+    return len(tasks)
+
+
+def run_until_empty():
+    """ run tasks until none is ready, for tests and one-off drains """
+    while run_once():
+        pass
+
+
+def queue_stats():
+    return dict(_stats)
+
+
+def depth():
+    """ waiting, ready and failed task counts and the seconds the oldest ready task has waited """
+    now = timezone.now()
+    totals = Task.objects.aggregate(
+        waiting=Count('pk', filter=Q(failed=False)),
+        failed=Count('pk', filter=Q(failed=True)),
+    )
+    ready = _ready(now).aggregate(count=Count('pk'), oldest=Min('run_after'))
+    return {
+        'waiting': totals['waiting'],
+        'ready': ready['count'],
+        'failed': totals['failed'],
+        'lag_seconds': (now - ready['oldest']).total_seconds() if ready['oldest'] else 0.0,
+    }
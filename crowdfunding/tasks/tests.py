@@ -0,0 +1,176 @@
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from crowdfunding.querybudget import QueryRecorder
+from projects.models import PetTag, Pledge, Project, Recommendation
+from users.models import CustomUser
+from . import queue
+from .models import Task
+from .queue import task
+
+calls = []
+
+
+@task
+def record(value):
+    calls.append(value)
+
+
+@task(batch=True)
+def record_batch(batch):
+    calls.append(sorted(value for value, in batch))
+
+
+@task
+def count_tags():
+    calls.append(PetTag.objects.count())
+
+
+@task
+def fail():
+    raise ValueError('no luck')
+
+
+@override_settings(TASKS_EAGER=False)
+class TaskQueueTest(TestCase):
+
+    def setUp(self):
+        calls.clear()
+
+    def test_identical_calls_coalesce(self):
+        record.enqueue(1)
+        record.enqueue(1)
+        record.enqueue(2)
+        self.assertEqual(Task.objects.count(), 2)
+        queue.run_until_empty()
+        self.assertEqual(calls, [1, 2])
+        self.assertFalse(Task.objects.exists())
+
+    def test_batches(self):
+        for value in (3, 1, 2):
+            record_batch.enqueue(value)
+        record.enqueue(4)
+        self.assertEqual(queue.run_once(), 3)
+        self.assertEqual(calls, [[1, 2, 3]])
+        queue.run_once()
+        self.assertEqual(calls, [[1, 2, 3], 4])
+
+    def test_running_tasks_do_not_absorb_new_calls(self):
+        record.enqueue(1)
+        claimed = queue.claim(10)
+        record.enqueue(1)
+        self.assertEqual(len(claimed), 1)
+        self.assertEqual(Task.objects.count(), 2)
+        # and a claimed task is not handed out twice
+        self.assertEqual(queue.claim(10)[0].pk, Task.objects.exclude(pk=claimed[0].pk).get().pk)
+        self.assertEqual(queue.claim(10), [])
+
+    @override_settings(TASKS_MAX_ATTEMPTS=2, TASKS_RETRY_DELAY=10)
+    def test_retries_with_backoff(self):
+        fail.enqueue()
+        with self.assertLogs('tasks.queue', 'WARNING'):
+            queue.run_once()
+        stored = Task.objects.get()
+        self.assertEqual((stored.attempts, stored.failed), (1, False))
+        self.assertIn('ValueError: no luck', stored.error)
+        self.assertGreaterEqual(stored.run_after, timezone.now() + timedelta(seconds=9))
+        self.assertEqual(queue.run_once(), 0)
+
+        Task.objects.update(run_after=timezone.now())
+        with self.assertLogs('tasks.queue', 'ERROR'):
+            queue.run_once()
+        self.assertTrue(Task.objects.get().failed)
+        self.assertEqual(queue.run_once(), 0)
+
+    def test_expired_leases_are_claimed_again(self):
+        record.enqueue(1)
+        queue.claim(10)
+        self.assertEqual(queue.claim(10), [])
+        Task.objects.update(locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(len(queue.claim(10)), 1)
+
+    def test_depth(self):
+        record.enqueue(1)
+        record.enqueue(2, delay=60)
+        Task.objects.filter(args='[1]').update(run_after=timezone.now() - timedelta(seconds=30))
+        stats = queue.depth()
+        self.assertEqual((stats['waiting'], stats['ready'], stats['failed']), (2, 1, 0))
+        self.assertGreaterEqual(stats['lag_seconds'], 30)
+
+        admin = CustomUser.objects.create_superuser(email='admin@example.com', password='pw')
+        self.client.force_login(admin)
+        body = self.client.get('/metrics/').content.decode()
+        self.assertIn('task_queue_ready 1', body)
+        self.assertIn('# TYPE task_queue_lag_seconds gauge', body)
+
+    def test_run_workers_once(self):
+        record.enqueue(1)
+        output = StringIO()
+        call_command('run_workers', once=True, stdout=output)
+        self.assertEqual(calls, [1])
+        self.assertIn('Ran 1 tasks', output.getvalue())
+
+    def test_writes_leave_their_side_effects_queued(self):
+        owner = CustomUser.objects.create_user(email='owner@example.com', password='pw')
+        supporter = CustomUser.objects.create_user(email='supporter@example.com', password='pw')
+        dog = PetTag.objects.create(petspecies='dog')
+        supporter.profile.petlikes.add(dog)
+        project = Project.objects.create(
+            title='Walkies', description='', goal=100, image='', is_open=True,
+            date_created=timezone.now(), owner=owner
+        )
+        project.species.add(dog)
+        self.assertFalse(Recommendation.objects.exists())
+        self.assertEqual(
+            sorted(Task.objects.values_list('name', flat=True)),
+            [
+                'projects.recommendations.refresh_projects',
+                'projects.recommendations.refresh_users',
+                'projects.search.reindex',
+            ]
+        )
+        with mock.patch('projects.recommendations.refresh_for_projects') as refresh:
+            queue.run_until_empty()
+        # a save and a species change, refreshed once
+        refresh.assert_called_once_with({project.pk})
+        self.assertTrue(self.client.get('/search/', {'q': 'walkies'}).json())
+
+    def test_pledges_queue_one_rescore_per_project(self):
+        owner = CustomUser.objects.create_user(email='owner@example.com', password='pw')
+        supporter = CustomUser.objects.create_user(email='supporter@example.com', password='pw')
+        project = Project.objects.create(
+            title='Walkies', description='', goal=100, image='', is_open=True,
+            date_created=timezone.now(), owner=owner
+        )
+        Task.objects.all().delete()
+        with CaptureQueriesContext(connection) as queries:
+            for amount in (5, 10):
+                Pledge.objects.create(amount=amount, comment='', anonymous=False, project=project, supporter=supporter)
+        self.assertFalse([query for query in queries if 'projects_recommendation' in query['sql']])
+        self.assertEqual(
+            sorted(Task.objects.values_list('name', 'args')),
+            [
+                ('projects.recommendations.refresh_projects', '[%d]' % project.pk),
+                ('projects.recommendations.refresh_users', '[%d]' % supporter.pk),
+            ]
+        )
+
+
+class EagerTaskTest(TestCase):
+
+    def setUp(self):
+        calls.clear()
+
+    def test_eager_tasks_stay_out_of_the_query_budget(self):
+        with QueryRecorder() as queries:
+            count_tags.enqueue()
+            PetTag.objects.count()
+        self.assertEqual(calls, [0])
+        self.assertEqual(queries.count, 1)
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class UsersConfig(AppConfig):
     name = 'users'
+
+    def ready(self):
+        # connects the signal receivers that invalidate cached tokens
+        from . import authentication  # noqa: F401
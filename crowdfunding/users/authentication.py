@@ -0,0 +1,118 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from .models import CustomUser
+
+
+class TokenCache:
+    """
+    Thread-safe LRU of token key -> (user, token), each entry living at
+    most `ttl` seconds. The cache is per process: other workers only see
+    a deactivation or rotated token once their entry expires.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def discard_user(self, user_id):
+        with self._lock:
+            for key in [key for key, (_, (user, _)) in self._entries.items() if user.pk == user_id]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+
+token_cache = TokenCache(settings.TOKEN_CACHE_SIZE, settings.TOKEN_CACHE_TTL)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication that remembers recently seen tokens, so steady
+    state requests authenticate without a query. The user comes with its
+    profile and shelter already joined. Every request gets its own copy,
+    views may change it.
+    """
+
+    def authenticate_credentials(self, key):
+        cached = token_cache.get(key)
+        if cached is not None:
+            return copy.deepcopy(cached)
+        try:
+            token = self.get_model().objects.select_related(
+                'user__profile', 'user__shelter'
+            ).get(key=key)
+        except self.get_model().DoesNotExist:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+        token_cache.set(key, copy.deepcopy((token.user, token)))
+        return (token.user, token)
+
+
+# Invalidation
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def forget_token(sender, instance, **kwargs):
+    token_cache.discard(instance.key)
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def forget_user_tokens(sender, instance, **kwargs):
+    # covers deactivation as well as any change to the cached snapshot
+    token_cache.discard_user(instance.pk)
+
+@receiver(post_save, sender='users.Profile')
+@receiver(post_delete, sender='users.Profile')
+def forget_profile_user_tokens(sender, instance, **kwargs):
+    token_cache.discard_user(instance.user_id)
+
+@receiver(post_save, sender='projects.Shelter')
+@receiver(post_delete, sender='projects.Shelter')
+def forget_shelter_owner_tokens(sender, instance, **kwargs):
+    # the cached user carries its shelter, approval included
+    token_cache.discard_user(instance.owner_id)
@@ -1,14 +1,28 @@
+from django.apps import apps
 from django.contrib.auth.models import AbstractUser, BaseUserManager
 from django.db import models
+from django.db.models import Exists, OuterRef
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.utils.translation import ugettext_lazy as _
 
+class UserQuerySet(models.QuerySet):
+
+    def delete(self):
+        # supporters' pledges are settled once per delete, see projects.models
+        from projects.models import deleting
+        with deleting():
+            return super().delete()
+
+
 class UserManager(BaseUserManager):
     """Define a model manager for User model with no username field."""
 
     use_in_migrations = True
 
+    def get_queryset(self):
+        return UserQuerySet(self.model, using=self._db)
+
     def _create_user(self, email, password, **extra_fields):
         """Create and save a User with the given email and password."""
         if not email:
@@ -37,6 +51,22 @@ class UserManager(BaseUserManager):
 
         return self._create_user(email, password, **extra_fields)
 
+    def with_profile(self):
+        """
+        Users with their profile and pet likes loaded in bulk, and the
+        is_supporter/is_owner flags computed in the same query.
+        """
+        Pledge = apps.get_model('projects', 'Pledge')
+        Shelter = apps.get_model('projects', 'Shelter')
+        return self.get_queryset().select_related('profile').prefetch_related(
+            'profile__petlikes'
+        ).annotate(
+            has_public_pledges=Exists(
+                Pledge.objects.filter(supporter=OuterRef('pk'), anonymous=False)
+            ),
+            has_shelter=Exists(Shelter.objects.filter(owner=OuterRef('pk'))),
+        )
+
 class CustomUser(AbstractUser):
     username = None
     email = models.EmailField(_('email address'), unique=True)
@@ -49,16 +79,25 @@ class CustomUser(AbstractUser):
 
     def is_supporter(self):
         """ is the user a supporter """
+        if hasattr(self, 'has_public_pledges'):
+            return self.has_public_pledges
         return self.supporter_pledges.filter(anonymous=False).count() > 0
     is_supporter.boolean = True
 
     def is_owner(self):
         """ is the user an owner """
+        if hasattr(self, 'has_shelter'):
+            return self.has_shelter
         return hasattr(self, 'shelter')
     is_owner.boolean = True
 
     objects = UserManager()
 
+    def delete(self, *args, **kwargs):
+        from projects.models import deleting
+        with deleting():
+            return super().delete(*args, **kwargs)
+
 
 class Profile(models.Model):
 
@@ -75,6 +114,7 @@ class Profile(models.Model):
         related_name = "liked_by",
         related_query_name = "pet"
     )
+    updated_at = models.DateTimeField(auto_now=True)
 
 @receiver(post_save, sender=CustomUser)
 def create_user_profile(sender, instance, created, **kwargs):
@@ -82,5 +122,8 @@ def create_user_profile(sender, instance, created, **kwargs):
         Profile.objects.create(user=instance)
 
 @receiver(post_save, sender=CustomUser)
-def save_user_profile(sender, instance, **kwargs):
+def save_user_profile(sender, instance, update_fields=None, **kwargs):
+    # a login only saves last_login, and a profile save expires the user's pledged projects
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
     instance.profile.save()
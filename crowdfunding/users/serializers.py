@@ -1,17 +1,18 @@
 from rest_framework import serializers
+from crowdfunding.metrics import TimedSerializerMixin
 from .models import CustomUser, Profile
 
-from projects.models import PetTag
+from projects.pettags import CachedSlugRelatedField
 
 
-class UserSerializer(serializers.Serializer):
+class UserSerializer(TimedSerializerMixin, serializers.Serializer):
     id = serializers.ReadOnlyField()
     email = serializers.EmailField(max_length=200)
     preferredname = serializers.CharField(max_length=200, source='profile.preferredname')
     password = serializers.CharField(max_length=200)
     bio = serializers.CharField(source='profile.bio')
     profile_pic = serializers.URLField(source='profile.profile_pic')
-    petlikes = serializers.SlugRelatedField(many=True, slug_field="petspecies", queryset=PetTag.objects.all(), source='profile.petlikes')
+    petlikes = CachedSlugRelatedField(many=True, source='profile.petlikes')
     is_supporter = serializers.BooleanField(read_only=True)
     is_owner = serializers.BooleanField(read_only=True)
 
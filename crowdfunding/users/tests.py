@@ -1,3 +1,178 @@
+from django.db import connection
 from django.test import TestCase
+from django.utils import timezone
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
 
-# Create your tests here.
+from projects.models import Pledge, PetTag, Project, Shelter
+from .authentication import CachedTokenAuthentication, TokenCache, token_cache
+from .models import CustomUser
+
+
+class ConditionalGetTest(TestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='user@example.com', password='pw')
+
+    def test_user_detail_answers_304_until_profile_changes(self):
+        url = '/users/%d/' % self.user.pk
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.user.profile.preferredname = 'Renamed'
+        self.user.profile.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_pledge_and_shelter_change_user_etag(self):
+        url = '/users/%d/' % self.user.pk
+        etag = self.client.get(url)['ETag']
+        shelter = Shelter.objects.create(
+            name='Shelter', description='', address='', charityregister=1, owner=self.user
+        )
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['is_owner'])
+        project = Project.objects.create(
+            title='Project', description='', goal=10, image='https://example.com/x.png',
+            is_open=True, date_created=timezone.now(), owner=self.user
+        )
+        etag = response['ETag']
+        Pledge.objects.create(amount=1, comment='Go', anonymous=False, project=project, supporter=self.user)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['is_supporter'])
+
+    def test_login_keeps_pledged_project_etags(self):
+        project = Project.objects.create(
+            title='Project', description='', goal=10, image='https://example.com/x.png',
+            is_open=True, date_created=timezone.now(), owner=self.user
+        )
+        Pledge.objects.create(amount=1, comment='Go', anonymous=False, project=project, supporter=self.user)
+        urls = ('/projects/', '/projects/%d/' % project.pk, '/users/')
+        etags = [self.client.get(url)['ETag'] for url in urls]
+        self.assertTrue(self.client.login(email='user@example.com', password='pw'))
+        for url, etag in zip(urls, etags):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_user_list_answers_304(self):
+        etag = self.client.get('/users/')['ETag']
+        self.assertEqual(self.client.get('/users/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        CustomUser.objects.create_user(email='other@example.com', password='pw')
+        self.assertEqual(self.client.get('/users/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class CachedTokenAuthenticationTest(TestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='user@example.com', password='pw')
+        self.token = Token.objects.create(user=self.user)
+
+    def get(self, token=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                '/users/%d/' % self.user.pk,
+                HTTP_AUTHORIZATION='Token %s' % (token or self.token.key)
+            )
+        auth_queries = [q['sql'] for q in queries.captured_queries if 'authtoken_token' in q['sql']]
+        return response, len(auth_queries)
+
+    def test_steady_state_makes_no_auth_queries(self):
+        before = token_cache.stats()
+        self.assertEqual(self.get()[1], 1)
+        response, auth_queries = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(auth_queries, 0)
+        after = token_cache.stats()
+        self.assertEqual(after['hits'] - before['hits'], 1)
+
+    def test_deleted_token_is_forgotten(self):
+        self.get()
+        key = self.token.key
+        self.token.delete()
+        self.assertEqual(self.get(key)[0].status_code, 401)
+
+    def test_deactivated_user_is_forgotten(self):
+        self.get()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get()[0].status_code, 401)
+
+    def test_each_request_gets_its_own_user(self):
+        authentication = CachedTokenAuthentication()
+        first, _ = authentication.authenticate_credentials(self.token.key)
+        second, _ = authentication.authenticate_credentials(self.token.key)
+        self.assertEqual(first.pk, second.pk)
+        self.assertIsNot(first, second)
+        self.assertIsNot(first.profile, second.profile)
+
+    def test_shelter_changes_are_seen(self):
+        shelter = Shelter.objects.create(
+            name='Shelter', description='', address='', charityregister=1, is_approved=True, owner=self.user
+        )
+        project = {
+            'title': 'Roof', 'description': 'A roof', 'goal': 100, 'image': 'https://example.com/r.png',
+            'is_open': True, 'date_created': timezone.now().isoformat(), 'species': [],
+        }
+
+        def create_project():
+            return self.client.post(
+                '/projects/', project, content_type='application/json',
+                HTTP_AUTHORIZATION='Token %s' % self.token.key
+            )
+        self.assertEqual(create_project().status_code, 201)
+        shelter.is_approved = False
+        shelter.save()
+        self.assertIsNone(token_cache.get(self.token.key))
+        self.assertEqual(create_project().status_code, 400)
+        self.assertFalse(token_cache.get(self.token.key)[0].shelter.is_approved)
+
+    def test_bounded_and_expiring(self):
+        cache = TokenCache(max_size=2, ttl=0)
+        cache.set('a', (self.user, None))
+        self.assertIsNone(cache.get('a'))
+
+        cache = TokenCache(max_size=2, ttl=60)
+        for key in 'abc':
+            cache.set(key, (self.user, None))
+        self.assertIsNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('c'))
+        self.assertEqual(cache.stats()['size'], 2)
+
+
+class UserListQueryCountTest(TestCase):
+
+    def add_users(self, count, start):
+        dog = PetTag.objects.get_or_create(petspecies='dog')[0]
+        for i in range(start, start + count):
+            user = CustomUser.objects.create_user(email='user%d@example.com' % i, password='pw')
+            user.profile.petlikes.add(dog)
+            if i % 2:
+                shelter = Shelter.objects.create(
+                    name='Shelter %d' % i, description='', address='', charityregister=i, owner=user
+                )
+                project = Project.objects.create(
+                    title='Project', description='', goal=10, image='https://example.com/x.png',
+                    is_open=True, date_created=timezone.now(), owner=user
+                )
+                Pledge.objects.create(amount=1, comment='Go', anonymous=False, project=project, supporter=user)
+
+    def test_constant_queries(self):
+        start = 0
+        for size in (5, 50):
+            with self.subTest(size=size):
+                self.add_users(size - start, start)
+                start = size
+                # users with flags + pet likes
+                with self.assertNumQueries(2):
+                    response = self.client.get('/users/')
+                self.assertEqual(len(response.json()), size)
+
+    def test_flags_match_model_methods(self):
+        self.add_users(4, 0)
+        by_email = {user['email']: user for user in self.client.get('/users/').json()}
+        for user in CustomUser.objects.all():
+            self.assertEqual(by_email[user.email]['is_supporter'], user.is_supporter())
+            self.assertEqual(by_email[user.email]['is_owner'], user.is_owner())
+            self.assertEqual(by_email[user.email]['petlikes'], ['dog'])
+        self.assertEqual(sum(user['is_owner'] for user in by_email.values()), 2)
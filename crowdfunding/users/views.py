@@ -4,15 +4,35 @@ from rest_framework.authtoken.models import Token
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework import status, permissions
+from rest_framework import status, permissions, generics
 from .models import CustomUser, Profile
 from .serializers import UserSerializer
 from .permissions import IsOwnerOrReadOnly
+from projects.conditional import conditional_get, version_state
+from projects.streaming import stream_json_list, wants_stream
 
 
-class UserList(APIView):
+def users_state(pk=None):
+    # the payload reads the profile, and is_supporter/is_owner depend on pledges and
+    # shelters, so the receivers in projects.models bump these for all three
+    if pk is not None:
+        return version_state('user:%s' % pk)
+    return version_state('users')
+
+
+class UserList(generics.GenericAPIView):
+    serializer_class = UserSerializer
+    query_budget = {'GET': 4}
+
+    @conditional_get(users_state)
     def get(self, request):
-        users = CustomUser.objects.all()
+        users = CustomUser.objects.with_profile()
+        if wants_stream(request):
+            return stream_json_list(users, UserSerializer)
+        page = self.paginate_queryset(users)
+        if page is not None:
+            serializer = UserSerializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
         serializer = UserSerializer(users, many=True)
         return Response(serializer.data)
 
@@ -29,13 +49,15 @@ class UserDetail(APIView):
     permission_classes = [permissions.IsAuthenticatedOrReadOnly,
                           IsOwnerOrReadOnly
                           ]
+    query_budget = {'GET': 4}
 
     def get_object(self, pk):
         try:
-            return CustomUser.objects.get(pk=pk)
+            return CustomUser.objects.with_profile().get(pk=pk)
         except CustomUser.DoesNotExist:
             raise Http404
 
+    @conditional_get(users_state)
     def get(self, request, pk):
         user = self.get_object(pk)
         serializer = UserSerializer(user)